@@ -1,7 +1,10 @@
-import os, re, json, base64, decimal, datetime, traceback
+import os, re, gzip, json, base64, decimal, hashlib, tarfile, datetime, threading, traceback
+from concurrent.futures import ThreadPoolExecutor
+import boto3
 
 str_to_float = lambda string: float(string)
 str_to_int = lambda string: int(string)
+str_to_bool = lambda string: str(string).strip().lower() in ('1', 'true', 'yes')
 is_target_file = lambda filepath, patterns: any(match_glob_pattern(filepath, pattern) for pattern in patterns)
 filter_targets = lambda filepaths, targets: [path for path in filepaths if is_target_file(path, targets) ]
 
@@ -9,8 +12,127 @@ STATUS_COMPLETE = 'Complete'
 STATUS_PROCESSING = 'Processing'
 STATUS_START = 'Start'
 
+FETCH_CONCURRENCY = str_to_int(os.getenv('FETCH_CONCURRENCY', '16'))
+PROJECT_FETCH_MODE = os.getenv('PROJECT_FETCH_MODE', 'archive')		# all模式获取代码的方式: archive / api
+
 get_s3_object = lambda s3, bucket, key: s3.Object(bucket, key).get()['Body'].read().decode('utf-8')
 put_s3_object = lambda s3, bucket, key, text, content_type: s3.Object(bucket, key).put(Body=text, ContentType=content_type)
+put_s3_object_gzip = lambda s3, bucket, key, text, content_type: s3.Object(bucket, key).put(Body=gzip.compress(text.encode('utf-8')), ContentType=content_type, ContentEncoding='gzip')
+
+def get_s3_object_gzip(s3, bucket, key):
+	# 以流的方式解压读取，避免同时在内存中保留压缩和解压两份数据
+	with gzip.GzipFile(fileobj=s3.Object(bucket, key).get()['Body']) as f:
+		return f.read().decode('utf-8')
+
+class ThreadLocalResource:
+	"""
+	按线程创建的boto3 resource，用法与boto3.resource(service_name)相同
+	boto3的resource和session不是线程安全的，map_concurrently的工作线程不能共享模块级的resource，
+	每个线程第一次访问时用独立的session创建自己的resource
+	"""
+
+	def __init__(self, service_name):
+		self.service_name = service_name
+		self.local = threading.local()
+
+	def __getattr__(self, name):
+		if name in ('service_name', 'local'):
+			raise AttributeError(name)
+		resource = getattr(self.local, 'resource', None)
+		if resource is None:
+			resource = self.local.resource = boto3.session.Session().resource(self.service_name)
+		return getattr(resource, name)
+
+def map_concurrently(func, items, max_workers=None):
+	"""
+	使用有界线程池并发执行func(item)，结果按items的原有顺序返回
+	单个item执行失败时，对应位置返回该异常对象，由调用方决定如何处理
+	@params max_workers 并发数，默认使用FETCH_CONCURRENCY
+	"""
+	items = list(items)
+	if not items:
+		return []
+	workers = max(1, min(max_workers or FETCH_CONCURRENCY, len(items)))
+
+	def call(item):
+		try:
+			return func(item)
+		except Exception as ex:
+			return ex
+
+	if workers == 1:
+		return [ call(item) for item in items ]
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		return list(executor.map(call, items))
+
+def projection_params(projection, names=None):
+	"""
+	将属性名列表转换为ProjectionExpression和ExpressionAttributeNames参数，属性名统一使用占位符
+	"""
+	names = dict(names or {})
+	placeholders = []
+	for index, name in enumerate(projection):
+		names[f'#p{index}'] = name
+		placeholders.append(f'#p{index}')
+	return dict(ProjectionExpression=', '.join(placeholders), ExpressionAttributeNames=names)
+
+def query_pages(table, projection=None, **params):
+	"""
+	分页执行DynamoDB query，按LastEvaluatedKey读取到最后一页，每次返回一页的Items
+	@params table DynamoDB Table资源
+	@params projection 需要返回的属性名列表，为None时返回完整记录；属性名统一使用占位符，避免与保留字（如data、number）冲突
+	@params params 其余参数原样传给query，如KeyConditionExpression、IndexName
+	"""
+	if projection:
+		params = dict(params, **projection_params(projection, params.get('ExpressionAttributeNames')))
+	while True:
+		response = table.query(**params)
+		yield response.get('Items', [])
+		if not response.get('LastEvaluatedKey'):
+			return
+		params = dict(params, ExclusiveStartKey=response['LastEvaluatedKey'])
+
+def query_items(table, projection=None, **params):
+	"""
+	逐条返回分页query的所有记录，参数同query_pages
+	"""
+	for items in query_pages(table, projection=projection, **params):
+		yield from items
+
+def read_archive_files(fileobj, targets):
+	"""
+	以流的方式读取仓库归档(tar/tar.gz)，返回符合targets的文件，顺序与归档一致
+	归档的第一层目录（如owner-repo-sha/）会被去掉，使路径与仓库文件树一致
+	@params fileobj 归档的文件对象，只需支持顺序读取
+	@return (files, skipped) files为[(filepath, content)]，skipped为无法按UTF-8解码的文件路径
+	"""
+	files, skipped = [], []
+	with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+		for member in tar:
+			if not member.isfile():
+				continue
+			parts = member.name.split('/', 1)
+			if len(parts) < 2 or not is_target_file(parts[1], targets):
+				continue
+			try:
+				content = tar.extractfile(member).read().decode('utf-8')
+				files.append((parts[1], content))
+			except UnicodeDecodeError:
+				skipped.append(parts[1])
+	return files, skipped
+
+def format_code_files(files):
+	"""
+	将[(filepath, content)]拼接为提示词中使用的代码文本，每个文件一段
+	"""
+	return '\n\n'.join(f'{file_path}\n```\n{file_content}\n```' for file_path, file_content in files)
+
+def git_blob_sha(text):
+	"""
+	按git的规则计算文本内容的blob SHA，内容不变时与仓库中的blob SHA一致
+	"""
+	data = text.encode('utf-8')
+	return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
 
 class CodelibException(Exception):
 	def __init__(self, message, code=None):
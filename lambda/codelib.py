@@ -1,8 +1,40 @@
+import collections
 import datetime
+import hashlib
 import json
+import logging
 import os
+import re
+import threading
+import time
+import base
 import gitlab_code
 import github_code
+from logger import init_logger
+
+BLOB_CACHE_SIZE = base.str_to_int(os.getenv('BLOB_CACHE_SIZE', '2048'))		# 进程内缓存的blob数量
+BLOB_CACHE_PREFIX = 'cache/blob'
+TREE_CACHE_SIZE = 32		# 进程内缓存的提交文件树数量
+CONTEXT_CACHE_TTL = base.str_to_int(os.getenv('CONTEXT_CACHE_TTL', '300'))	# 仓库上下文缓存有效期(秒)，0表示不缓存
+
+s3 = base.ThreadLocalResource('s3')
+
+init_logger()
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+# 以git blob SHA为key的进程内LRU缓存，Lambda热启动时跨调用复用
+_blob_cache = collections.OrderedDict()
+_blob_cache_lock = threading.Lock()
+
+# (仓库源, 项目, 提交ID)到文件blob SHA映射的进程内缓存，提交内容不可变，可以安全复用
+# 每个key一把锁，读取文件树时只持有该key的锁，同一提交并发读取时只下载一次文件树，不阻塞其他提交
+_tree_cache = collections.OrderedDict()
+_tree_cache_lock = threading.Lock()
+_tree_locks = dict()
+
+# 仓库上下文缓存，key为(source, repo_url, project_id, token哈希)，value为(过期时间, 上下文)
+_context_cache = dict()
+_context_cache_lock = threading.Lock()
 
 def detect_source_from_event(event):
 	"""
@@ -59,18 +91,38 @@ def init_repo_context(params):
 		dict: 仓库上下文字典
 			- source: 仓库源类型
 			- project: 仓库对象 (GitLab Project 或 GitHub Repository)
+			
+	说明:
+		上下文在CONTEXT_CACHE_TTL秒内按仓库和token缓存，Lambda热启动时复用已建立的客户端连接池，
+		并跳过获取项目信息的API调用
 	"""
 	source = params.get('source') or detect_source_from_event(params)
 	
+	token = params.get('private_token') or ''
+	key = (source, params.get('repo_url'), str(params.get('project_id')), hashlib.sha256(token.encode('utf-8')).hexdigest())
+	now = time.time()
+	with _context_cache_lock:
+		cached = _context_cache.get(key)
+	if cached and cached[0] > now:
+		log.info(f'Reuse cached repo context for project({params.get("project_id")}).')
+		return dict(cached[1])
+
 	if source == 'gitlab':
 		project = gitlab_code.init_gitlab_context(params.get('repo_url'), params.get('project_id'), params.get('private_token'))
-		return dict(source='gitlab', project=project)
+		repo_context = dict(source='gitlab', project=project)
 	elif source == 'github':
 		repository = github_code.init_github_context(params.get('repo_url'), params.get('project_id'), params.get('private_token'))
-		return dict(source='github', project=repository)
+		repo_context = dict(source='github', project=repository)
 	else:
 		raise Exception(f'Code lib source({source}) is not supported yet.')
 
+	if CONTEXT_CACHE_TTL > 0:
+		with _context_cache_lock:
+			for expired in [ k for k, v in _context_cache.items() if v[0] <= now ]:
+				del _context_cache[expired]
+			_context_cache[key] = (now + CONTEXT_CACHE_TTL, repo_context)
+	return dict(repo_context)
+
 def parse_webtool_parameters(event):
 	"""
 	解析Web工具请求参数
@@ -120,6 +172,85 @@ def parse_parameters(event):
 	params['request_id'] = '{}_{}_{}'.format(date_str, params['source'], params['username'])
 	return params
 
+def remember_blob(sha, content):
+	with _blob_cache_lock:
+		_blob_cache[sha] = content
+		_blob_cache.move_to_end(sha)
+		while len(_blob_cache) > BLOB_CACHE_SIZE:
+			_blob_cache.popitem(last=False)
+
+def save_blob(sha, content):
+	"""
+	将下载的文件内容写入两级缓存，进程内缓存中已有的blob不再重复写S3
+	"""
+	with _blob_cache_lock:
+		cached = sha in _blob_cache
+	bucket_name = os.getenv('BUCKET_NAME')
+	key = f'{BLOB_CACHE_PREFIX}/{sha}'
+	if bucket_name and not cached:
+		try:
+			base.put_s3_object(s3, bucket_name, key, content, 'text/plain; charset=utf-8')
+		except Exception as ex:
+			log.info(f'Fail to write blob({sha}) to cache s3://{bucket_name}/{key}.', extra=dict(exception=str(ex)))
+	remember_blob(sha, content)
+
+def read_blob(sha, fetch):
+	"""
+	按git blob SHA读取文件内容，依次查找进程内LRU缓存、S3缓存(BUCKET_NAME)，都未命中时调用fetch下载并回写两级缓存
+	
+	参数:
+		sha: git blob SHA，为空时直接调用fetch且不缓存
+		fetch: 无参函数，返回文件内容，失败时返回None或抛出异常
+		
+	返回:
+		str: 文件内容，fetch返回None时返回None
+	"""
+	if not sha:
+		return fetch()
+
+	with _blob_cache_lock:
+		if sha in _blob_cache:
+			_blob_cache.move_to_end(sha)
+			return _blob_cache[sha]
+
+	bucket_name = os.getenv('BUCKET_NAME')
+	key = f'{BLOB_CACHE_PREFIX}/{sha}'
+	if bucket_name:
+		try:
+			content = base.get_s3_object(s3, bucket_name, key)
+			remember_blob(sha, content)
+			return content
+		except s3.meta.client.exceptions.NoSuchKey:
+			pass
+		except Exception as ex:
+			log.info(f'Fail to read blob({sha}) from cache s3://{bucket_name}/{key}.', extra=dict(exception=str(ex)))
+
+	content = fetch()
+	if content is None:
+		return None
+	save_blob(sha, content)
+	return content
+
+def get_project_code_files(repo_context, commit_id, targets):
+	"""
+	获取项目中符合目标模式的所有文件
+	
+	参数:
+		repo_context: 仓库上下文字典
+		commit_id: 提交ID
+		targets: 目标文件模式列表
+		
+	返回:
+		list: [(文件路径, 文件内容)]，顺序与文件树一致
+	"""
+	source = repo_context.get('source')
+	if source == 'gitlab':
+		return gitlab_code.get_project_code_files(repo_context.get('project'), commit_id, targets, read_blob=read_blob)
+	elif source == 'github':
+		return github_code.get_project_code_files(repo_context.get('project'), commit_id, targets, read_blob=read_blob)
+	else:
+		raise Exception(f'Code lib source({source}) is not supported yet.')
+
 def get_project_code_text(repo_context, commit_id, targets):
 	"""
 	获取项目代码文本
@@ -134,9 +265,9 @@ def get_project_code_text(repo_context, commit_id, targets):
 	"""
 	source = repo_context.get('source')
 	if source == 'gitlab':
-		return gitlab_code.get_project_code_text(repo_context.get('project'), commit_id, targets)
+		return gitlab_code.get_project_code_text(repo_context.get('project'), commit_id, targets, read_blob=read_blob)
 	elif source == 'github':
-		return github_code.get_project_code_text(repo_context.get('project'), commit_id, targets)
+		return github_code.get_project_code_text(repo_context.get('project'), commit_id, targets, read_blob=read_blob)
 	else:
 		raise Exception(f'Code lib source({source}) is not supported yet.')
 
@@ -184,7 +315,62 @@ def get_involved_diffs(repo_context, commit_id, previous_commit_id):
 	else:
 		raise Exception(f'Code lib source({source}) is not supported yet.')
 
-def get_repository_file(repo_context, filepath, commit_id):
+def get_project_identity(repo_context):
+	"""
+	区分仓库的标识，GitLab为项目ID，GitHub为owner/repo
+	"""
+	project = repo_context.get('project')
+	if repo_context.get('source') == 'github':
+		return getattr(project, 'full_name', None)
+	return getattr(project, 'id', None)
+
+def get_blob_shas(repo_context, commit_id):
+	"""
+	获取提交中所有文件的blob SHA
+	
+	参数:
+		repo_context: 仓库上下文字典
+		commit_id: 提交ID
+		
+	返回:
+		dict: 文件路径到blob SHA的映射，失败时返回空字典
+		
+	说明:
+		一次递归列出文件树即可获得所有文件的SHA，commit_id为完整提交ID时按仓库和提交缓存
+	"""
+	source = repo_context.get('source')
+	project = repo_context.get('project')
+	key = (source, get_project_identity(repo_context), commit_id)
+	with _tree_cache_lock:
+		if key in _tree_cache:
+			_tree_cache.move_to_end(key)
+			return _tree_cache[key]
+		key_lock = _tree_locks.setdefault(key, threading.Lock())
+
+	with key_lock:
+		with _tree_cache_lock:
+			if key in _tree_cache:
+				return _tree_cache[key]
+		try:
+			if source == 'gitlab':
+				blobs = gitlab_code.get_gitlab_blob_ids(project, commit_id)
+			elif source == 'github':
+				blobs = github_code.get_github_blob_shas(project, commit_id)
+			else:
+				raise Exception(f'Code lib source({source}) is not supported yet.')
+		except Exception as ex:
+			log.info(f'Fail to get blob SHAs for commit_id({commit_id}).', extra=dict(exception=str(ex)))
+			blobs = None
+
+		with _tree_cache_lock:
+			_tree_locks.pop(key, None)
+			if blobs is not None and re.fullmatch(r'[0-9a-f]{40}', commit_id or ''):
+				_tree_cache[key] = blobs
+				while len(_tree_cache) > TREE_CACHE_SIZE:
+					_tree_cache.popitem(last=False)
+	return blobs if blobs is not None else dict()
+
+def get_repository_file(repo_context, filepath, commit_id, blob_shas=None):
 	"""
 	获取仓库文件内容
 	
@@ -192,15 +378,33 @@ def get_repository_file(repo_context, filepath, commit_id):
 		repo_context: 仓库上下文字典
 		filepath: 文件路径
 		commit_id: 提交ID
+		blob_shas: 可选，get_blob_shas的结果，批量获取文件时由调用方预先解析
 		
 	返回:
 		str: 文件内容，失败时返回None
+		
+	说明:
+		提供blob_shas时先按blob SHA读取缓存，内容未变化的文件不会被重复下载；
+		未提供时直接下载文件，并用响应中的blob SHA写入缓存，不为单个文件列出整个文件树
 	"""
 	source = repo_context.get('source')
+	project = repo_context.get('project')
+	if blob_shas is None:
+		if source == 'gitlab':
+			content, sha = gitlab_code.get_gitlab_file_blob(project, filepath, commit_id)
+		elif source == 'github':
+			content, sha = github_code.get_github_file_blob(project, filepath, commit_id)
+		else:
+			raise Exception(f'Code lib source({source}) is not supported yet.')
+		if content is not None and sha:
+			save_blob(sha, content)
+		return content
+
+	sha = blob_shas.get(filepath)
 	if source == 'gitlab':
-		return gitlab_code.get_gitlab_file(repo_context.get('project'), filepath, commit_id)
+		return read_blob(sha, lambda: gitlab_code.get_gitlab_file(project, filepath, commit_id))
 	elif source == 'github':
-		return github_code.get_github_file(repo_context.get('project'), filepath, commit_id)
+		return read_blob(sha, lambda: github_code.get_github_file(project, filepath, commit_id))
 	else:
 		raise Exception(f'Code lib source({source}) is not supported yet.')
 
@@ -1,4 +1,3 @@
-import boto3
 import os, datetime, logging
 import base, task_base
 from logger import init_logger
@@ -7,42 +6,116 @@ REQUEST_TABLE 			= os.getenv('REQUEST_TABLE')
 TASK_TABLE 				= os.getenv('TASK_TABLE')
 SNS_TOPIC_ARN 			= os.getenv('SNS_TOPIC_ARN')
 REPORT_TIMEOUT_SECONDS 	= base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
+CRON_MAX_ITEMS 			= base.str_to_int(os.getenv('CRON_MAX_ITEMS', '50'))			# 每次执行最多检查的请求数量，其余留给下一次执行
+CRON_CONCURRENCY 		= base.str_to_int(os.getenv('CRON_CONCURRENCY', '8'))			# 并发检查请求的数量
+CRON_TIME_MARGIN 		= base.str_to_int(os.getenv('CRON_TIME_MARGIN', '10'))			# 剩余执行时间少于该秒数时不再读取新的请求
+CRON_SCAN_HOURS 		= 24
+CHECKPOINT_KEY 			= dict(commit_id='#cron', request_id='checkpoint')				# 保存扫描进度的记录，不含task_status，不会出现在索引中
 
-dynamodb 				= boto3.resource("dynamodb")
-sns 					= boto3.resource('sns')
-s3 						= boto3.resource("s3")
+dynamodb 				= base.ThreadLocalResource("dynamodb")
+sns 					= base.ThreadLocalResource('sns')
+s3 						= base.ThreadLocalResource("s3")
 
 init_logger()
-log = logging.getLogge('crlog_{}'.format(__name__))
+log = logging.getLogger('crlog_{}'.format(__name__))
 
-def lambda_handler(event, context):
+def load_checkpoint():
+	"""
+	读取上一次执行结束时每种状态的扫描位置(LastEvaluatedKey)
+	"""
+	item = dynamodb.Table(REQUEST_TABLE).get_item(Key=CHECKPOINT_KEY, ConsistentRead=True).get('Item') or {}
+	return item.get('cursors') or {}
 
-	log.info(event, extra=dict(label='event'))
+def save_checkpoint(cursors):
+	dynamodb.Table(REQUEST_TABLE).put_item(Item=dict(CHECKPOINT_KEY, cursors=cursors, update_time=str(datetime.datetime.now())))
 
-	items = []
-	hours = 24
-	start_time = datetime.datetime.now() - datetime.timedelta(hours=hours)
-	result = dynamodb.Table(REQUEST_TABLE).query(
-		IndexName='TaskStatusIndex',
-		KeyConditionExpression='task_status = :s AND create_time >= :t',
-		ExpressionAttributeValues={ ':s': base.STATUS_PROCESSING ,':t': str(start_time) },
-		ConsistentRead=True
-	)
-	items = items + result.get('Items')
-	result = dynamodb.Table(REQUEST_TABLE).query(
+def has_time_left(context):
+	if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+		return True
+	return context.get_remaining_time_in_millis() > CRON_TIME_MARGIN * 1000
+
+def get_index_key(item):
+	"""
+	请求在TaskStatusIndex中的位置，与query返回的LastEvaluatedKey格式相同
+	"""
+	return { key: item[key] for key in ('commit_id', 'request_id', 'task_status', 'create_time') }
+
+def sweep_status(status, cursors, limit, context):
+	"""
+	从cursors[status]开始分页读取指定状态的请求，并发检查进度，最多处理limit条
+	每个请求开始检查前确认剩余执行时间，时间不足的请求留给下一次执行
+	每页处理后将扫描位置更新到cursors并保存，位置之前的请求都已检查完；扫描到末尾时删除该状态的位置
+	@return 检查完的请求数量
+	"""
+	start_time = str(datetime.datetime.now() - datetime.timedelta(hours=CRON_SCAN_HOURS))
+	cursor = cursors.pop(status, None)
+	if cursor and cursor.get('create_time', '') < start_time:
+		# 扫描位置已移出查询的时间范围，不能再作为ExclusiveStartKey，从头开始扫描
+		log.info(f'Drop expired cursor of status({status}).', extra=dict(cursor=cursor))
+		cursor = None
+
+	def check_request(item):
+		if not has_time_left(context):
+			return False
+		task_base.check_request_progress(item, log)
+		return True
+
+	params = dict(
 		IndexName='TaskStatusIndex',
 		KeyConditionExpression='task_status = :s AND create_time >= :t',
-		ExpressionAttributeValues={ ':s': base.STATUS_START ,':t': str(start_time) },
-		ConsistentRead=True
+		ExpressionAttributeValues={ ':s': status, ':t': start_time },
 	)
-	items = items + result.get('Items')
-	log.info(f'Load incomplete request record for the last {hours} hours.', extra=dict(items=items))
-
-	for item in items:
+	processed = 0
+	while processed < limit and has_time_left(context):
+		if cursor:
+			params['ExclusiveStartKey'] = cursor
+		params['Limit'] = limit - processed
 		try:
-			if item:
-				task_base.check_request_progress(item, log)
+			response = dynamodb.Table(REQUEST_TABLE).query(**params)
 		except Exception as ex:
-			log.error('Fail to process request record.', extra=dict(exception=str(ex)))
-	
+			# 查询失败时丢弃该状态的扫描位置，下一次从头开始，避免每次都因同一个位置失败
+			log.error(f'Fail to query request records in status({status}), reset its cursor.', extra=dict(exception=str(ex), cursor=cursor))
+			save_checkpoint(cursors)
+			return processed
+
+		items = response.get('Items', [])
+		results = base.map_concurrently(check_request, items, max_workers=CRON_CONCURRENCY)
+		finished = 0
+		for item, result in zip(items, results):
+			if result is False:
+				break
+			if isinstance(result, Exception):
+				log.error(f'Fail to process request record({item.get("request_id")}).', extra=dict(exception=str(result)))
+			finished += 1
+		processed += finished
+
+		if finished < len(items):
+			# 剩余执行时间不足，从最后一个检查完的请求之后继续
+			cursor = get_index_key(items[finished - 1]) if finished else cursor
+		else:
+			cursor = response.get('LastEvaluatedKey')
+		if cursor:
+			cursors[status] = cursor
+		save_checkpoint(cursors)
+		if not cursor or finished < len(items):
+			break
+	if cursor:
+		cursors[status] = cursor
+	return processed
+
+def lambda_handler(event, context):
+
+	log.info(event, extra=dict(label='event'))
+
+	# 每次执行只处理有限数量的请求，并从上一次结束的位置继续，扫描到末尾后下一次从头开始
+	cursors = load_checkpoint()
+	remaining = CRON_MAX_ITEMS
+	for status in (base.STATUS_PROCESSING, base.STATUS_START):
+		if remaining <= 0 or not has_time_left(context):
+			break
+		processed = sweep_status(status, cursors, remaining, context)
+		remaining -= processed
+		log.info(f'Check {processed} incomplete request records in status({status}) for the last {CRON_SCAN_HOURS} hours.', extra=dict(cursor=cursors.get(status)))
+
+	save_checkpoint(cursors)
 	log.info('Complete cron function.')
@@ -1,5 +1,6 @@
 import github.GithubException
 import os, json, yaml, logging
+import requests
 import github
 import base
 from github import Github
@@ -512,10 +513,10 @@ def init_github_context(repo_url, project_id, private_token):
         # 创建GitHub客户端实例
         if api_base_url != 'https://api.github.com':
             # 对于GitHub Enterprise Server，需要指定base_url
-            g = Github(private_token, base_url=api_base_url)
+            g = Github(private_token, base_url=api_base_url, pool_size=base.FETCH_CONCURRENCY)
         else:
             # 对于公共GitHub，使用默认配置
-            g = Github(private_token)
+            g = Github(private_token, pool_size=base.FETCH_CONCURRENCY)
         
         log.info(f'Try to get repository({project_id})')
         
@@ -606,6 +607,50 @@ def get_github_file(repository, path, ref):
         return None
 
 
+def get_github_file_blob(repository, path, ref):
+    """
+    获取GitHub仓库中指定文件的内容及其blob SHA
+    
+    参数:
+        repository: PyGithub Repository对象
+        path: 文件路径
+        ref: 提交ID或分支名
+        
+    返回:
+        tuple: (文件内容, blob SHA)，失败时返回(None, None)
+        
+    说明:
+        get_contents的响应中已包含blob SHA，一次调用即可写入blob缓存
+    """
+    try:
+        file_content = repository.get_contents(path, ref=ref)
+        if file_content.type != 'file':
+            log.warning(f'Path {path} is not a file, type: {file_content.type}')
+            return None, None
+        return file_content.decoded_content.decode('utf-8'), file_content.sha
+    except Exception as ex:
+        log.error(f'Fail to get GitHub file {path} @ {ref}', extra=dict(exception=str(ex)))
+        return None, None
+
+
+def get_github_blob_shas(repository, ref):
+    """
+    获取GitHub仓库指定提交中所有文件的blob SHA
+    
+    参数:
+        repository: PyGithub Repository对象
+        ref: 提交ID或分支名
+        
+    返回:
+        dict: 文件路径到blob SHA的映射
+        
+    说明:
+        一次递归的get_git_tree调用即可获得整个提交的文件SHA，缓存由codelib.get_blob_shas负责
+    """
+    git_tree = repository.get_git_tree(ref, recursive=True)
+    return { item.path: item.sha for item in git_tree.tree if item.type == 'blob' }
+
+
 def get_github_file_content(repository, file_path, ref_name):
     """
     获取GitHub仓库中指定文件的内容（内部版本）
@@ -784,9 +829,9 @@ def get_commit_files(repository, commit_id):
         raise base.CodelibException(error_msg, code='Unknown') from ex
 
 
-def get_project_code_text(repository, commit_id, targets):
+def get_project_code_files_from_archive(repository, commit_id, targets):
     """
-    获取整个项目的代码文本
+    通过仓库tarball获取整个项目中符合目标模式的文件
     
     参数:
         repository: PyGithub Repository对象
@@ -794,59 +839,110 @@ def get_project_code_text(repository, commit_id, targets):
         targets: 目标文件模式列表
         
     返回:
-        str: 格式化的代码文本
+        list: [(文件路径, 文件内容)]，顺序与tarball一致
+        
+    说明:
+        只需一次API调用获取tarball下载地址，再以流的方式下载并在内存中解包，
+        避免逐个文件调用get_contents而触发速率限制
+    """
+    log.info(f'Try to download repository tarball for commit {commit_id}')
+    archive_url = repository.get_archive_link('tarball', ref=commit_id)
+    with requests.get(archive_url, stream=True, timeout=300) as response:
+        response.raise_for_status()
+        files, skipped = base.read_archive_files(response.raw, targets)
+    log.info('Read {} files from repository tarball for commit_id({}), filters({}).'.format(
+        len(files), commit_id, targets), extra=dict(skipped=skipped))
+    return files
+
+
+def get_project_code_files(repository, commit_id, targets, read_blob=None):
+    """
+    获取整个项目中符合目标模式的文件
+    
+    参数:
+        repository: PyGithub Repository对象
+        commit_id: 提交ID
+        targets: 目标文件模式列表
+        read_blob: 可选，按blob SHA读取缓存的函数read_blob(sha, fetch)
+        
+    返回:
+        list: [(文件路径, 文件内容)]，顺序与文件树一致
         
     处理流程:
         1. 获取指定提交的文件树
         2. 过滤出符合目标模式的文件
-        3. 批量获取文件内容
-        4. 格式化为统一的文本格式
+        3. 并发获取文件内容（并发数由FETCH_CONCURRENCY控制）
+        
+    当PROJECT_FETCH_MODE为archive（默认）时，优先通过tarball一次性获取，失败后回退到上述流程
     """
+    if base.PROJECT_FETCH_MODE == 'archive':
+        try:
+            return get_project_code_files_from_archive(repository, commit_id, targets)
+        except Exception as ex:
+            log.info(f'Fail to read repository tarball for commit {commit_id}, fall back to file API.', extra=dict(exception=str(ex)))
+    
     try:
-        log.info(f'Getting project code text for commit {commit_id} with targets: {targets}')
+        log.info(f'Getting project code files for commit {commit_id} with targets: {targets}')
         
         # 获取指定提交的Git树（递归获取所有文件）
         git_tree = repository.get_git_tree(commit_id, recursive=True)
         
-        # 提取所有文件路径（只要blob类型，不要tree类型）
-        all_file_paths = [item.path for item in git_tree.tree if item.type == 'blob']
+        # 提取所有文件路径及blob SHA（只要blob类型，不要tree类型）
+        blob_shas = {item.path: item.sha for item in git_tree.tree if item.type == 'blob'}
         
         # 使用base.filter_targets过滤符合目标模式的文件
-        file_paths = base.filter_targets(all_file_paths, targets)
+        file_paths = base.filter_targets(list(blob_shas.keys()), targets)
         
         log.info('Scanned {} files after filtering in repository for commit_id({}), filters({}).'.format(
             len(file_paths), commit_id, targets))
         
-        # 构建代码文本
-        text = ''
-        for file_path in file_paths:
-            try:
-                # 获取文件内容
-                file_content = get_github_file_content(repository, file_path, commit_id)
-                
-                # 格式化为代码段
-                section = f'{file_path}\n```\n{file_content}\n```'
-                text = '{}\n\n{}'.format(text, section) if text else section
-                
-            except Exception as ex:
-                log.info(f'Fail to get file({file_path}) content.', extra=dict(exception=str(ex)))
+        def fetch(file_path):
+            if read_blob:
+                return read_blob(blob_shas.get(file_path), lambda: get_github_file_content(repository, file_path, commit_id))
+            return get_github_file_content(repository, file_path, commit_id)
+        
+        # 并发获取文件内容，结果保持文件树的顺序
+        file_contents = base.map_concurrently(fetch, file_paths)
+        
+        files = []
+        for file_path, file_content in zip(file_paths, file_contents):
+            if isinstance(file_content, Exception):
+                log.info(f'Fail to get file({file_path}) content.', extra=dict(exception=str(file_content)))
                 # 继续处理其他文件，不因单个文件失败而中断
                 continue
+            files.append((file_path, file_content))
         
-        log.info(f'Successfully generated project code text with {len(file_paths)} files')
-        return text
+        log.info(f'Successfully got {len(files)} project code files')
+        return files
         
     except GithubException as ex:
-        error_msg = f'GitHub API error getting project code text for commit {commit_id}: {ex.data.get("message", str(ex)) if hasattr(ex, "data") and ex.data else str(ex)}'
+        error_msg = f'GitHub API error getting project code files for commit {commit_id}: {ex.data.get("message", str(ex)) if hasattr(ex, "data") and ex.data else str(ex)}'
         log.error(error_msg, extra=dict(status=ex.status, exception=str(ex)))
         raise base.CodelibException(error_msg, code=parse_github_errcode(ex)) from ex
         
     except Exception as ex:
-        error_msg = f'Fail to get project code text: {ex}'
+        error_msg = f'Fail to get project code files: {ex}'
         log.error(error_msg, extra=dict(commit_id=commit_id, targets=targets, exception=str(ex)))
         raise base.CodelibException(error_msg, code='Unknown') from ex
 
 
+def get_project_code_text(repository, commit_id, targets, read_blob=None):
+    """
+    获取整个项目的代码文本
+    
+    参数:
+        repository: PyGithub Repository对象
+        commit_id: 提交ID
+        targets: 目标文件模式列表
+        read_blob: 可选，按blob SHA读取缓存的函数read_blob(sha, fetch)
+        
+    返回:
+        str: 格式化的代码文本，每个文件一段
+    """
+    files = get_project_code_files(repository, commit_id, targets, read_blob=read_blob)
+    return base.format_code_files(files)
+
+
 def get_rules(repository, commit_id, branch):
     """
     从.codereview目录获取评审规则
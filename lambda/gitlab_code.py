@@ -1,6 +1,7 @@
 import gitlab.exceptions
-import os, json, yaml, logging
+import os, io, json, yaml, logging
 import gitlab
+import requests
 import base
 from gitlab.exceptions import GitlabHttpError
 from logger import init_logger
@@ -190,6 +191,27 @@ def get_gitlab_file(project, path, ref):
 		log.error(f'Fail to get git file {path} @ {ref}.', extra=dict(exception=str(ex)))
 		return None
 
+def get_gitlab_file_blob(project, path, ref):
+	"""
+	下载文件内容，同时取得文件的blob id，一次调用即可写入blob缓存
+	@return (content, blob_id)，失败时返回(None, None)
+	"""
+	try:
+		log.info(f'Try to get gitlab file with blob id in ref({ref}): {path}')
+		file = project.files.get(file_path=path, ref=ref)
+		return file.decode().decode(), file.blob_id
+	except Exception as ex:
+		log.error(f'Fail to get git file {path} @ {ref}.', extra=dict(exception=str(ex)))
+		return None, None
+
+def get_gitlab_blob_ids(project, ref):
+	"""
+	一次递归列出文件树，获取ref中所有文件的blob id
+	@return 文件路径到blob id的映射
+	"""
+	items = project.repository_tree(ref=ref, all=True, recursive=True)
+	return { item['path']: item.get('id') for item in items if item['type'] == 'blob' }
+
 def get_gitlab_file_content(project, file_path, ref_name):
 	file_content = project.files.raw(file_path=file_path, ref=ref_name).decode()
 	log.info(f'Getting file content({file_path}).', extra=dict(content=file_content))
@@ -264,32 +286,72 @@ def get_first_commit_id(project, branch):
 	first_commit_id = next((commit.id for commit in commits if not commit.parent_ids), None)
 	return first_commit_id
 
+def create_session():
+	# 连接池大小与文件并发获取数一致，避免并发下载时连接被丢弃重建
+	session = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections=base.FETCH_CONCURRENCY, pool_maxsize=base.FETCH_CONCURRENCY)
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	return session
+
 def init_gitlab_context(repo_url, project_id, private_token):
 	try:
 		log.info(f'Try to init gitlab connection for repo({repo_url}).')
-		gl = gitlab.Gitlab(repo_url if repo_url else None, private_token=private_token)
+		gl = gitlab.Gitlab(repo_url if repo_url else None, private_token=private_token, session=create_session())
 		log.info(f'Try to get project({project_id})')
 		project = gl.projects.get(project_id)
 		return project
 	except Exception as ex:
 		raise base.CodelibException(f'Fail to init Gitlab context: {ex}', code=parse_gitlab_errcode(ex)) from ex
 	
-def get_project_code_text(repo_context, commit_id, targets):
+def get_project_code_files_from_archive(project, commit_id, targets):
+	"""
+	一次性下载commit_id对应的仓库归档，在内存中按targets过滤
+	@return [(filepath, content)]，顺序与归档一致
+	"""
+	log.info(f'Try to download repository archive for commit_id({commit_id}).')
+	archive = project.repository_archive(sha=commit_id, format='tar.gz')
+	files, skipped = base.read_archive_files(io.BytesIO(archive), targets)
+	log.info('Read {} files from repository archive for commit_id({}), filters({}).'.format(len(files), commit_id, targets), extra=dict(skipped=skipped))
+	return files
+
+def get_project_code_files(repo_context, commit_id, targets, read_blob=None):
+	"""
+	获取项目中符合targets的所有文件
+	@return [(filepath, content)]，顺序与文件树一致，获取失败的文件被跳过
+	"""
 	
 	project = repo_context
+
+	if base.PROJECT_FETCH_MODE == 'archive':
+		try:
+			return get_project_code_files_from_archive(project, commit_id, targets)
+		except Exception as ex:
+			log.info(f'Fail to read repository archive for commit_id({commit_id}), fall back to file API.', extra=dict(exception=str(ex)))
 	
 	# 用于存储文件路径的数组
 	items = project.repository_tree(ref=commit_id, all=True, recursive=True)
-	file_paths = base.filter_targets([ item['path'] for item in items if item['type'] == 'blob'], targets)
+	blob_ids = { item['path']: item.get('id') for item in items if item['type'] == 'blob' }
+	file_paths = base.filter_targets(list(blob_ids.keys()), targets)
 	log.info('Scaned {} files after ext filtering in repository for commit_id({}), filters({}).'.format(len(file_paths), commit_id, targets))
 
-	text = ''
-	for file_path in file_paths:
-		try:
-			file_content = get_gitlab_file_content(project, file_path, commit_id)
-			section = f'{file_path}\n```\n{file_content}\n```'
-			text = '{}\n\n{}'.format(text, section) if text else section			
-		except Exception as ex:
-			log.info(f'Fail to get file({file_path}) content.', extra=dict(exception=str(ex)))
+	def fetch(file_path):
+		if read_blob:
+			return read_blob(blob_ids.get(file_path), lambda: get_gitlab_file_content(project, file_path, commit_id))
+		return get_gitlab_file_content(project, file_path, commit_id)
+
+	# 并发获取文件内容，结果保持文件树的顺序
+	file_contents = base.map_concurrently(fetch, file_paths)
+
+	files = []
+	for file_path, file_content in zip(file_paths, file_contents):
+		if isinstance(file_content, Exception):
+			log.info(f'Fail to get file({file_path}) content.', extra=dict(exception=str(file_content)))
+			continue
+		files.append((file_path, file_content))
   
-	return text
+	return files
+
+def get_project_code_text(repo_context, commit_id, targets, read_blob=None):
+	files = get_project_code_files(repo_context, commit_id, targets, read_blob=read_blob)
+	return base.format_code_files(files)
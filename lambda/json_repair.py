@@ -0,0 +1,161 @@
+"""
+容错的JSON解析，用于解析模型在<output>标签中输出的评审结果
+
+先按严格JSON解析，失败后在一次扫描中修复常见的问题再解析：
+- 单引号字符串、Python字面量（True/False/None）
+- 对象和数组中多余的尾逗号
+- 字符串中未转义的换行和制表符，以及JSON不支持的转义（如正则中的\\d）
+- 包裹在```json代码块中，或完整的JSON之后跟有说明文字
+- 输出被截断：保留最外层最后一个完整的标量，丢弃不完整的元素并补全括号
+都无法解析时才由调用方让模型重新输出
+"""
+import re, ast, json
+
+PYTHON_LITERALS = { 'True': 'true', 'False': 'false', 'None': 'null' }
+CLOSING = { '[': ']', '{': '}' }
+JSON_ESCAPES = '"\\/bfnrt'
+UNICODE_ESCAPE = re.compile(r'u[0-9a-fA-F]{4}')
+
+class JSONRepairError(ValueError):
+	pass
+
+
+def strip_code_fence(text):
+	match = re.match(r'^\s*```[a-zA-Z]*\s*\n(.*?)\n?\s*(```\s*)?$', text, re.DOTALL)
+	return match.group(1) if match else text
+
+
+def normalize(text):
+	"""
+	逐字符扫描，将文本改写为严格JSON，并记录截断位置
+	@return (json_text, stack, last_complete)
+		stack为扫描结束时仍未闭合的括号
+		last_complete为最后一个完整元素结束后的位置（位于输出中），用于截断时回退
+	"""
+	out = []
+	stack = []
+	last_complete = None
+	i, length = 0, len(text)
+	while i < length:
+		char = text[i]
+		if char in '"\'':
+			# 字符串：统一改写为双引号
+			quote, i = char, i + 1
+			buffer = ['"']
+			closed = False
+			while i < length:
+				c = text[i]
+				if c == '\\' and i + 1 < length:
+					nxt = text[i + 1]
+					if nxt == "'":
+						buffer.append("'")
+					elif nxt in JSON_ESCAPES or UNICODE_ESCAPE.match(text, i + 1):
+						buffer.append(c + nxt)
+					else:
+						buffer.append('\\\\' + nxt)
+					i += 2
+					continue
+				if c == quote:
+					closed = True
+					i += 1
+					break
+				if c == '"':
+					buffer.append('\\"')
+				elif c == '\n':
+					buffer.append('\\n')
+				elif c == '\r':
+					buffer.append('\\r')
+				elif c == '\t':
+					buffer.append('\\t')
+				else:
+					buffer.append(c)
+				i += 1
+			if not closed:
+				# 字符串被截断，整个未完成的元素会在后面被丢弃
+				break
+			buffer.append('"')
+			out.append(''.join(buffer))
+			continue
+		if char in '[{':
+			stack.append(char)
+			out.append(char)
+		elif char in ']}':
+			# 去掉尾逗号
+			while out and out[-1].strip() == '':
+				out.pop()
+			if out and out[-1] == ',':
+				out.pop()
+			if stack:
+				stack.pop()
+			out.append(char)
+			if not stack:
+				# 最外层已闭合，忽略之后的说明文字
+				break
+			if len(stack) == 1:
+				last_complete = len(out)
+		elif char.isalpha() or char == '_':
+			match = re.match(r'[A-Za-z_]\w*', text[i:])
+			word = match.group(0)
+			out.append(PYTHON_LITERALS.get(word, word))
+			i += len(word)
+			continue
+		else:
+			out.append(char)
+			if char == ',' and len(stack) == 1:
+				last_complete = len(out) - 1
+		i += 1
+	return out, stack, last_complete
+
+
+def close_truncated(out, stack, last_complete):
+	"""
+	输出被截断时，回退到最后一个完整元素并补全括号
+	截断发生在最外层的元素之间时，最后一个完整的标量（如'[1, 2, 3'中的3）直接补全括号保留
+	"""
+	if len(stack) == 1:
+		candidate = ''.join(out).rstrip() + CLOSING[stack[0]]
+		try:
+			json.loads(candidate)
+			return candidate
+		except ValueError:
+			pass
+	if last_complete is None:
+		raise JSONRepairError('Truncated JSON without complete element')
+	out = out[:last_complete]
+	while out and (out[-1].strip() == '' or out[-1] == ','):
+		out.pop()
+	return ''.join(out) + CLOSING[stack[0]]
+
+
+def loads(text):
+	"""
+	容错地解析JSON文本
+	@return (python_object, repaired) repaired表示是否经过了本地修复
+	@raise JSONRepairError 无法修复
+	"""
+	text = text.strip()
+	try:
+		return json.loads(text), False
+	except ValueError:
+		pass
+
+	text = strip_code_fence(text)
+	try:
+		# 完整的JSON之后跟有说明文字
+		return json.JSONDecoder().raw_decode(text)[0], True
+	except ValueError:
+		pass
+
+	out, stack, last_complete = normalize(text)
+	try:
+		if stack:
+			return json.loads(close_truncated(out, stack, last_complete)), True
+		return json.loads(''.join(out)), True
+	except ValueError:
+		pass
+
+	# 兼容之前按Python字面量解析的行为
+	try:
+		return ast.literal_eval(text), True
+	except (ValueError, SyntaxError, MemoryError, RecursionError) as ex:
+		raise JSONRepairError(f'Fail to repair JSON: {ex}') from ex
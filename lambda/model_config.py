@@ -8,8 +8,10 @@ MODEL_CONFIGS = {
     'claude3.7-sonnet': {
         'model_id': 'us.anthropic.claude-3-7-sonnet-20250219-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,
+        'supports_prompt_cache': True,
         'version': '3.7',
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input tokens
         'param_restriction': None,
     },
 
@@ -17,22 +19,28 @@ MODEL_CONFIGS = {
     'claude4-opus': {
         'model_id': 'us.anthropic.claude-opus-4-20250514-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
+        'supports_prompt_cache': True,
         'version': '4',
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input tokens
         'param_restriction': None,
     },
     'claude4-opus-4.1': {
         'model_id': 'us.anthropic.claude-opus-4-1-20250805-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
+        'supports_prompt_cache': True,
         'version': '4.1',
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input tokens
         'param_restriction': None,
     },
     'claude4-sonnet': {
         'model_id': 'us.anthropic.claude-sonnet-4-20250514-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
+        'supports_prompt_cache': True,
         'version': '4',
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input tokens
         'param_restriction': None,
     },
 
@@ -40,15 +48,19 @@ MODEL_CONFIGS = {
     'claude4.5-sonnet': {
         'model_id': 'us.anthropic.claude-sonnet-4-5-20250929-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
+        'supports_prompt_cache': True,
         'version': '4.5',
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input tokens
         'param_restriction': 'temperature_only',  # Can only use temperature
     },
     'claude4.5-haiku': {
         'model_id': 'us.anthropic.claude-haiku-4-5-20251001-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
+        'supports_prompt_cache': True,
         'version': '4.5',
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input tokens
         'param_restriction': 'temperature_only',  # Can only use temperature
     },
 
@@ -56,36 +68,46 @@ MODEL_CONFIGS = {
     'claude3.5-sonnet': {
         'model_id': 'anthropic.claude-3-5-sonnet-20240620-v1:0',
         'supports_reasoning': False,
+        'supports_prompt_cache': False,
         'version': '3.5',
         'timeout': 120,
+        'context_window': 200000,
         'param_restriction': None,
     },
     'claude3-opus': {
         'model_id': 'anthropic.claude-3-opus-20240229-v1:0',
         'supports_reasoning': False,
+        'supports_prompt_cache': False,
         'version': '3',
         'timeout': 120,
+        'context_window': 200000,
         'param_restriction': None,
     },
     'claude3-sonnet': {
         'model_id': 'anthropic.claude-3-sonnet-20240229-v1:0',
         'supports_reasoning': False,
+        'supports_prompt_cache': False,
         'version': '3',
         'timeout': 120,
+        'context_window': 200000,
         'param_restriction': None,
     },
     'claude3-haiku': {
         'model_id': 'anthropic.claude-3-haiku-20240307-v1:0',
         'supports_reasoning': False,
+        'supports_prompt_cache': False,
         'version': '3',
         'timeout': 120,
+        'context_window': 200000,
         'param_restriction': None,
     },
     'claude3': {  # Default mapping
         'model_id': 'anthropic.claude-3-sonnet-20240229-v1:0',
         'supports_reasoning': False,
+        'supports_prompt_cache': False,
         'version': '3',
         'timeout': 120,
+        'context_window': 200000,
         'param_restriction': None,
     },
 }
@@ -163,6 +185,37 @@ def supports_reasoning(model_name):
     return config.get('supports_reasoning', False)
 
 
+def get_context_window(model_name, default=200000):
+    """
+    Get context window size (in tokens) by model name
+
+    Args:
+        model_name: Model name
+        default: Value returned for unknown models
+
+    Returns:
+        int: Context window size in tokens
+    """
+    try:
+        return get_model_config(model_name).get('context_window', default)
+    except ValueError:
+        return default
+
+
+def supports_prompt_cache(model_name):
+    """
+    Check if the model supports Bedrock prompt caching
+
+    Args:
+        model_name: Model name
+
+    Returns:
+        bool: True if model supports prompt caching
+    """
+    config = get_model_config(model_name)
+    return config.get('supports_prompt_cache', False)
+
+
 def get_model_id(model_name):
     """
     Get Bedrock model ID by model name
@@ -0,0 +1,212 @@
+"""
+Bedrock调用的自适应令牌桶限流
+
+每个模型一个令牌桶，所有task_executor实例调用Bedrock前先获取令牌：
+- 配置RATE_LIMIT_TABLE时令牌桶保存在DynamoDB中，在所有Lambda实例间共享
+- 未配置时使用进程内的令牌桶代替
+
+令牌的补充速率（RPM）按AIMD调整：每次调用成功后加性增加RATE_LIMIT_INCREASE，
+被Bedrock限流时乘以RATE_LIMIT_DECREASE，使整体吞吐稳定在配额附近而不是反复触发限流
+"""
+import os, time, decimal, logging, threading
+import base
+from botocore.exceptions import ClientError
+from logger import init_logger
+
+RATE_LIMIT_TABLE		= os.getenv('RATE_LIMIT_TABLE')
+RATE_LIMIT_RPM			= base.str_to_float(os.getenv('RATE_LIMIT_RPM', '60'))			# 初始的每分钟请求数
+RATE_LIMIT_MIN_RPM		= base.str_to_float(os.getenv('RATE_LIMIT_MIN_RPM', '6'))		# 每分钟请求数的下限
+RATE_LIMIT_MAX_RPM		= base.str_to_float(os.getenv('RATE_LIMIT_MAX_RPM', '600'))		# 每分钟请求数的上限
+RATE_LIMIT_BURST		= base.str_to_int(os.getenv('RATE_LIMIT_BURST', '5'))			# 令牌桶容量，即允许的突发请求数
+RATE_LIMIT_MAX_WAIT		= base.str_to_float(os.getenv('RATE_LIMIT_MAX_WAIT', '2'))		# 在函数内等待令牌的最长时间(秒)，超过后重新入队延迟执行
+RATE_LIMIT_INCREASE		= base.str_to_float(os.getenv('RATE_LIMIT_INCREASE', '1'))		# 每次调用成功后增加的RPM
+RATE_LIMIT_DECREASE		= base.str_to_float(os.getenv('RATE_LIMIT_DECREASE', '0.5'))	# 被限流后RPM的乘数
+
+THROTTLING_CODES		= ('ThrottlingException', 'TooManyRequestsException')
+
+init_logger()
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+to_decimal = lambda number: decimal.Decimal(str(round(number, 6)))
+
+
+class RateLimitExceeded(Exception):
+	"""在RATE_LIMIT_MAX_WAIT内无法获取令牌，wait为预计还需等待的秒数"""
+
+	def __init__(self, message, wait=0):
+		super().__init__(message)
+		self.wait = wait
+
+
+def refill(tokens, rpm, updated, now):
+	"""按上次更新以来的时间补充令牌，不超过桶容量"""
+	return min(RATE_LIMIT_BURST, tokens + max(0, now - updated) * rpm / 60)
+
+
+class LocalTokenBucket:
+	"""进程内令牌桶，未配置RATE_LIMIT_TABLE时使用"""
+
+	def __init__(self):
+		self.states = dict()
+		self.lock = threading.Lock()
+
+	def get_state(self, model, now):
+		return self.states.setdefault(model, dict(tokens=RATE_LIMIT_BURST, rpm=RATE_LIMIT_RPM, updated=now))
+
+	def try_acquire(self, model):
+		"""获取一个令牌，成功返回0，否则返回需要等待的秒数"""
+		with self.lock:
+			now = time.time()
+			state = self.get_state(model, now)
+			tokens = refill(state['tokens'], state['rpm'], state['updated'], now)
+			state['updated'] = now
+			if tokens >= 1:
+				state['tokens'] = tokens - 1
+				return 0
+			state['tokens'] = tokens
+			return (1 - tokens) * 60 / state['rpm']
+
+	def increase(self, model):
+		with self.lock:
+			state = self.get_state(model, time.time())
+			state['rpm'] = min(RATE_LIMIT_MAX_RPM, state['rpm'] + RATE_LIMIT_INCREASE)
+
+	def decrease(self, model):
+		with self.lock:
+			now = time.time()
+			state = self.get_state(model, now)
+			state['rpm'] = max(RATE_LIMIT_MIN_RPM, state['rpm'] * RATE_LIMIT_DECREASE)
+			# 从现在开始重新补充令牌，否则下次获取时会补回上次获取以来的全部令牌
+			state['tokens'] = 0
+			state['updated'] = now
+
+
+class DynamoTokenBucket:
+	"""
+	保存在DynamoDB中的令牌桶，每个模型一条记录(model, tokens, rpm, updated)
+	以updated作为乐观锁，DynamoDB访问失败时放行调用，不因限流器故障阻塞评审
+	调用成功后的RPM增量先在进程内累积，在下一次获取令牌的写入中一并更新，不额外写DynamoDB
+	"""
+
+	def __init__(self, table_name):
+		self.dynamodb = base.ThreadLocalResource('dynamodb')
+		self.table_name = table_name
+		self.pending = dict()
+		self.lock = threading.Lock()
+
+	@property
+	def table(self):
+		# 限流器在task_executor的工作线程间共享，每个线程使用自己的resource
+		return self.dynamodb.Table(self.table_name)
+
+	def try_acquire(self, model):
+		"""获取一个令牌，成功返回0，否则返回需要等待的秒数"""
+		try:
+			for _ in range(5):
+				now = time.time()
+				item = self.table.get_item(Key=dict(model=model), ConsistentRead=True).get('Item')
+				if not item:
+					if self.put_if_absent(model, RATE_LIMIT_BURST - 1, RATE_LIMIT_RPM, now):
+						return 0
+					continue
+				rpm = float(item['rpm'])
+				tokens = refill(float(item['tokens']), rpm, float(item['updated']), now)
+				if tokens < 1:
+					return (1 - tokens) * 60 / rpm
+				with self.lock:
+					pending = self.pending.get(model, 0)
+				if self.update_if_unchanged(model, item['updated'], tokens - 1, min(RATE_LIMIT_MAX_RPM, rpm + pending), now):
+					with self.lock:
+						self.pending[model] = max(0, self.pending.get(model, 0) - pending)
+					return 0
+			# 竞争过于激烈时稍后再试
+			return 60 / RATE_LIMIT_MAX_RPM
+		except Exception as ex:
+			log.error(f'Fail to acquire rate limit token for model({model}).', extra=dict(exception=str(ex)))
+			return 0
+
+	def put_if_absent(self, model, tokens, rpm, now):
+		try:
+			self.table.put_item(
+				Item=dict(model=model, tokens=to_decimal(tokens), rpm=to_decimal(rpm), updated=to_decimal(now)),
+				ConditionExpression='attribute_not_exists(#m)',
+				ExpressionAttributeNames={ '#m': 'model' },
+			)
+			return True
+		except ClientError as ex:
+			if ex.response['Error']['Code'] == 'ConditionalCheckFailedException':
+				return False
+			raise
+
+	def update_if_unchanged(self, model, updated, tokens, rpm, now):
+		try:
+			self.table.update_item(
+				Key=dict(model=model),
+				UpdateExpression='set tokens = :t, rpm = :r, updated = :n',
+				ConditionExpression='updated = :u',
+				ExpressionAttributeValues={ ':t': to_decimal(tokens), ':r': to_decimal(rpm), ':n': to_decimal(now), ':u': updated },
+			)
+			return True
+		except ClientError as ex:
+			if ex.response['Error']['Code'] == 'ConditionalCheckFailedException':
+				return False
+			raise
+
+	def increase(self, model):
+		with self.lock:
+			self.pending[model] = self.pending.get(model, 0) + RATE_LIMIT_INCREASE
+
+	def decrease(self, model):
+		with self.lock:
+			self.pending.pop(model, None)
+		try:
+			item = self.table.get_item(Key=dict(model=model), ConsistentRead=True).get('Item')
+			if not item:
+				return
+			rpm = max(RATE_LIMIT_MIN_RPM, float(item['rpm']) * RATE_LIMIT_DECREASE)
+			# 多个实例同时被限流时只降低一次；同时更新updated，令牌从现在开始重新补充
+			self.table.update_item(
+				Key=dict(model=model),
+				UpdateExpression='set rpm = :r, tokens = :z, updated = :n',
+				ConditionExpression='rpm = :old AND updated = :u',
+				ExpressionAttributeValues={ ':r': to_decimal(rpm), ':z': to_decimal(0), ':n': to_decimal(time.time()), ':old': item['rpm'], ':u': item['updated'] },
+			)
+			log.info(f'Decrease rate limit of model({model}) to {rpm} RPM.')
+		except Exception as ex:
+			log.info(f'Skip decreasing rate limit for model({model}).', extra=dict(exception=str(ex)))
+
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+def get_bucket():
+	global _bucket
+	with _bucket_lock:
+		if _bucket is None:
+			_bucket = DynamoTokenBucket(RATE_LIMIT_TABLE) if RATE_LIMIT_TABLE else LocalTokenBucket()
+		return _bucket
+
+def acquire(model, max_wait=None):
+	"""
+	调用Bedrock前获取令牌，只在函数内短暂等待，需要等待更久时由调用方重新入队
+	@raise RateLimitExceeded 在max_wait(默认RATE_LIMIT_MAX_WAIT)内无法获取令牌
+	"""
+	max_wait = RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+	deadline = time.time() + max_wait
+	while True:
+		wait = get_bucket().try_acquire(model)
+		if wait <= 0:
+			return
+		if time.time() + wait > deadline:
+			raise RateLimitExceeded(f'Fail to acquire rate limit token for model({model}) in {max_wait} seconds.', wait=wait)
+		time.sleep(wait)
+
+def on_success(model):
+	get_bucket().increase(model)
+
+def on_throttle(model):
+	get_bucket().decrease(model)
+
+def is_throttling(ex):
+	"""判断异常是否为Bedrock限流"""
+	return isinstance(ex, ClientError) and ex.response.get('Error', {}).get('Code') in THROTTLING_CODES
@@ -4,14 +4,14 @@ import json
 import logging
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 import base
-import boto3
 from logger import init_logger
 
-dynamodb				= boto3.resource("dynamodb")
-sns						= boto3.resource('sns')
-s3						= boto3.resource("s3")
+dynamodb				= base.ThreadLocalResource("dynamodb")
+sns						= base.ThreadLocalResource('sns')
+s3						= base.ThreadLocalResource("s3")
 
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
@@ -21,6 +21,58 @@ def get_json_directory(project_name, commit_id):
 	name = re.sub(r'^_+|_+$', '', name)
 	return 'report/{}/{}'.format(name, commit_id)
 	
+# 生成报告只需要任务的状态和结果位置
+REPORT_TASK_FIELDS = [ 'request_id', 'number', 'succ', 'data' ]
+
+def query_task_pages(request_id):
+	"""
+	分页查询请求下的所有任务，单次query最多返回1MB数据，需要按LastEvaluatedKey继续读取
+	"""
+	return base.query_pages(
+		dynamodb.Table(os.getenv('TASK_TABLE')),
+		projection=REPORT_TASK_FIELDS,
+		KeyConditionExpression='request_id=:rid',
+		ExpressionAttributeValues={ ':rid': request_id },
+		ConsistentRead=True
+	)
+
+def load_task_result(item):
+	"""
+	读取单个成功任务保存在S3中的评审结果
+	"""
+	bucket_name = os.getenv('BUCKET_NAME')
+	request_id, number, s3_key = map(item.get, ('request_id', 'number', 'data'))
+	json_data = json.loads(base.get_s3_object(s3, bucket_name, s3_key))
+	log.info(f'Found successful result for task(request_id={request_id}, number={number}).', extra=dict(task={ key: str(item[key]) for key in item }, result=json_data))
+	return json_data
+
+def load_all_results(request_id):
+	"""
+	边分页查询任务边并发读取S3中的评审结果，结果按任务顺序返回
+	"""
+	futures = []
+	with ThreadPoolExecutor(max_workers=base.FETCH_CONCURRENCY) as executor:
+		for items in query_task_pages(request_id):
+			for item in items:
+				if item.get('succ') == True:
+					futures.append(executor.submit(load_task_result, item))
+				else:
+					log.info('Found failed result for task(request_id={request_id}, number={number}).'.format(**item), extra=dict(item=base.dump_json(item)))
+
+	all_data = []
+	for future in futures:
+		try:
+			json_data = future.result()
+		except Exception as ex:
+			log.error('Fail to get result for task.', extra=dict(exception=str(ex)))
+			continue
+		if json_data:
+			if type(json_data) is list:
+				all_data.extend(json_data)
+			else:
+				all_data.append(json_data)
+	return all_data
+
 def generate_report_content(project_name, data):
 
 	# 读取Report Template
@@ -104,33 +156,8 @@ def generate_report(record, event, context):
 	project_name = context.get('project_name')
 	directory = get_json_directory(project_name, commit_id)
 	
-	# 写入data.js文件
-	bucket_name = os.getenv('BUCKET_NAME')
-	TASK_TABLE = os.getenv('TASK_TABLE')
-	items = dynamodb.Table(TASK_TABLE).query(
-		KeyConditionExpression='request_id=:rid',
-		ExpressionAttributeValues={ ':rid': request_id },
-		ConsistentRead=True
-	)
-	ret = [ item for item in items.get('Items') ]
-	all_data = []
-	for item in items.get('Items'):
-		try:
-			if item.get('succ') == True:
-				request_id, number, s3_key = map(item.get, ('request_id', 'number', 'data'))
-				s3_content = base.get_s3_object(s3, bucket_name, s3_key)
-				json_data = json.loads(s3_content)
-				log.info(f'Found successful result for task(request_id={request_id}, number={number}).', extra=dict(task={ key: str(item[key]) for key in item }, result=json_data))
-				log.info(f'Parsed JSON data: {json_data}')
-				if json_data:
-					if type(json_data) is list:
-						all_data = all_data + json_data
-					else:
-						all_data.append(json_data)
-			else:
-				log.info('Found failed result for task(request_id={request_id}, number={number}).'.format(**item), extra=dict(item=base.dump_json(item)))
-		except Exception as ex:
-			log.error('Fail to get result for task.', extra=dict(exception=str(ex)))
+	# 读取所有任务的评审结果
+	all_data = load_all_results(request_id)
 	log.info('Got all data.', extra=dict(all_data=all_data))
 	
 	report_data = []
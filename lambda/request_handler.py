@@ -7,7 +7,7 @@ from logger import init_logger
 REQUEST_TABLE 				= os.getenv('REQUEST_TABLE')
 TASK_DISPATCHER_FUN_NAME 	= os.getenv('TASK_DISPATCHER_FUN_NAME')
 	
-dynamodb = boto3.resource('dynamodb')
+dynamodb = base.ThreadLocalResource('dynamodb')
 lambda_client = boto3.client('lambda')
 sqs_client = boto3.client('sqs')
 
@@ -1,67 +1,111 @@
-import os, boto3, base, json, logging
+import os, base, json, decimal, logging, task_base
 from logger import init_logger
 
 REQUEST_TABLE 				= os.getenv('REQUEST_TABLE')
 TASK_TABLE 					= os.getenv('TASK_TABLE')
+TASK_PAGE_SIZE 				= base.str_to_int(os.getenv('TASK_PAGE_SIZE', '100'))		# 每次返回的任务数量
+TASK_PAGE_MAX 				= 1000
 
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.resource("s3")
+# 进度页面展示的任务属性，提示词等大字段不在列表中读取
+TASK_FIELDS = [
+	'request_id', 'number', 'mode', 'model', 'succ', 'message', 'retry_times', 'create_time', 'update_time', 'data', 'cached',
+	'bedrock_model', 'bedrock_start_time', 'bedrock_end_time', 'bedrock_timecost', 'bedrock_ttft', 'parse_timecost',
+	'bedrock_cache_read_tokens', 'bedrock_cache_write_tokens',
+]
+
+dynamodb = base.ThreadLocalResource('dynamodb')
+s3 = base.ThreadLocalResource("s3")
 
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
 
+def get_page_limit(params):
+	try:
+		limit = base.str_to_int(params.get('limit') or TASK_PAGE_SIZE)
+	except ValueError:
+		limit = TASK_PAGE_SIZE
+	return max(1, min(limit, TASK_PAGE_MAX))
+
+def query_task_summaries(request_id, limit, cursor=None):
+	"""
+	分页读取任务摘要，不包含S3中的提示词和评审结果
+	@params cursor 上一页最后一个任务的number，为空时从第一个任务开始
+	@return (tasks, next_cursor) 没有更多任务时next_cursor为None
+	"""
+	params = dict(
+		KeyConditionExpression='request_id=:rid',
+		ExpressionAttributeValues={ ':rid': request_id },
+		Limit=limit,
+		**base.projection_params(TASK_FIELDS),
+	)
+	if cursor:
+		params['ExclusiveStartKey'] = dict(request_id=request_id, number=decimal.Decimal(cursor))
+	response = dynamodb.Table(TASK_TABLE).query(**params)
+	last_key = response.get('LastEvaluatedKey')
+	return response.get('Items', []), str(last_key['number']) if last_key else None
+
+def get_task_detail(request_id, number):
+	"""
+	读取单个任务的完整信息，包括S3中的提示词、Payload和评审结果
+	"""
+	task = dynamodb.Table(TASK_TABLE).get_item(Key=dict(request_id=request_id, number=decimal.Decimal(number))).get('Item')
+	if not task:
+		return None
+
+	s3_key = task.get('data')
+	if s3_key:
+		bucket_name = os.getenv('BUCKET_NAME')
+		try:
+			s3_content = base.get_s3_object(s3, bucket_name, s3_key)
+			s3_data = json.loads(s3_content)
+			task['bedrock_system'] = s3_data.get('prompt_system', '')
+			task['bedrock_prompt'] = s3_data.get('prompt_user', '')
+			task['bedrock_payload'] = s3_data.get('payload', '')
+			task['reasoning'] = s3_data.get('reasoning', '')
+			task['result'] = s3_content
+		except Exception as ex:
+			log.info(f'Fail to parse data in s3({s3_key}) for task(request_id={request_id}, number={number})', extra=dict(exception=str(ex)))
+			task['prompt_system'] = task['prompt_user'] = task['payload'] = task['result'] = ''
+	return task
+
 def lambda_handler(event, context):
-	
+
 	log.info(event, extra=dict(label='event'))
-	params = event.get('queryStringParameters', {})
+	params = event.get('queryStringParameters') or {}
 	commit_id = params.get('commit_id')
 	request_id = params.get('request_id')
-	
+
 	headers = {
 		"Access-Control-Allow-Headers" : "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,x-gitlab-token",
 		"Access-Control-Allow-Origin": "*",
 		"Access-Control-Allow-Methods": "OPTIONS,GET"
 	}
-	
+
 	try:
-		
+
+		# 指定number时只返回该任务的详细信息
+		if params.get('number'):
+			task = get_task_detail(request_id, params.get('number'))
+			return { 'statusCode': 200, 'headers': headers, 'body': base.dump_json(dict(succ=task is not None, task=task)) }
+
 		item = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=commit_id, request_id=request_id), ConsistentRead=True)
 		result = item.get('Item')
 
 		ready, url = False, None
 		summary, tasks = None, []
 		if result:
-			summary = '{} tasks total: {} successful, {} failed。'.format(result.get('task_total'), result.get('task_complete'), result.get('task_failure'))
+			completes, failures = task_base.get_request_counters(result)
+			summary = '{} tasks total: {} successful, {} failed。'.format(result.get('task_total'), completes, failures)
 			if result.get('task_status') == 'Complete':
 				ready = True
 				url = result.get('report_url')
 		log.info(f'Load ready: {ready}, report URL: {url}')
 
-		# 获取所有Task
-		items = dynamodb.Table(TASK_TABLE).query(
-			KeyConditionExpression='request_id=:rid',
-			ExpressionAttributeValues={ ':rid': request_id }
-		)
-		tasks = items.get('Items')
+		# 分页获取Task摘要，详细信息由调用方按number单独获取
+		tasks, next_cursor = query_task_summaries(request_id, get_page_limit(params), params.get('cursor'))
+
+		ret = dict(succ=True, ready=ready, url=url, summary=summary, tasks=tasks, next_cursor=next_cursor)
 
-		bucket_name = os.getenv('BUCKET_NAME')
-		for task in tasks:
-			request_id, number, s3_key = map(task.get, ('request_id', 'number', 'data'))
-			
-			if s3_key:
-				try:
-					s3_content = base.get_s3_object(s3, bucket_name, s3_key)
-					s3_data = json.loads(s3_content)
-					task['bedrock_system'] = s3_data.get('prompt_system', '')
-					task['bedrock_prompt'] = s3_data.get('prompt_user', '')
-					task['bedrock_payload'] = s3_data.get('payload', '')
-					task['result'] = s3_content
-				except Exception as ex:
-					log.info(f'Fail to parse data in s3({s3_key}) for task(request_id={request_id}, number={number})', extra=dict(exception=str(ex)))
-					task['prompt_system'] = task['prompt_user'] = task['payload'] = task['result'] = ''
-
-		ret = dict(succ=True, ready=ready, url=url, summary=summary, tasks=tasks)
-		
 		return { 'statusCode': 200, 'headers': headers, 'body': base.dump_json(ret) }
 
 	except Exception as ex:
@@ -1,7 +1,16 @@
-import os, datetime
+import os, random, datetime
 import base, boto3, report
 
-dynamodb				= boto3.resource("dynamodb")
+dynamodb				= base.ThreadLocalResource("dynamodb")
+sqs_client				= boto3.client("sqs")
+
+REPORT_CLAIM_TIMEOUT	= base.str_to_int(os.getenv('REPORT_CLAIM_TIMEOUT', '300'))	# 认领报告后超过该时间(秒)仍未完成，允许重新认领
+COUNTER_SHARDS			= base.str_to_int(os.getenv('COUNTER_SHARDS', '0'))			# 大于1时，任务计数分散到多条分片记录，避免同一条Request记录成为热点
+COUNTER_SHARDS_MAX		= 100														# 一次BatchGetItem最多读取100条记录
+SQS_DELAY_LIMIT			= 900														# SQS DelaySeconds的上限
+DEADLINE_MESSAGE_TYPE	= 'deadline'
+CLAIM_COMPLETE			= 'complete'												# 所有任务完成后认领报告
+CLAIM_TIMEOUT			= 'timeout'													# 请求超时后认领报告
 
 def is_datetime_expired(datetime_text, duration):
 	now_datetime = datetime.datetime.now()
@@ -9,6 +18,48 @@ def is_datetime_expired(datetime_text, duration):
 	past_datetime_text = str(past_datetime)
 	return datetime_text < past_datetime_text
 
+def get_report_timeout():
+	return base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
+
+def schedule_request_deadline(commit_id, request_id, delay, log):
+	"""
+	通过SQS延迟消息安排请求的超时检查，到期后由task_executor检查一次该请求，不再需要定时扫描整张表
+	超过SQS延迟上限时，到期后会按剩余时间再次安排
+	@params delay 距离超时检查的秒数
+	@return 是否安排成功，失败时由cron兜底
+	"""
+	sqs_url = os.getenv('TASK_SQS_URL')
+	if not sqs_url:
+		log.info(f'TASK_SQS_URL is not provided, deadline of request({request_id}) is left to cron.')
+		return False
+	delay = max(0, min(int(delay), SQS_DELAY_LIMIT))
+	message = dict(type=DEADLINE_MESSAGE_TYPE, commit_id=commit_id, request_id=request_id)
+	try:
+		sqs_client.send_message(QueueUrl=sqs_url, MessageBody=base.encode_base64(base.dump_json(message)), DelaySeconds=delay)
+		log.info(f'Deadline of request({request_id}) is scheduled in {delay} seconds.')
+		return True
+	except Exception as ex:
+		log.error(f'Fail to schedule deadline of request({request_id}).', extra=dict(exception=str(ex)))
+		return False
+
+def handle_request_deadline(event, log):
+	"""
+	处理到期的超时检查：请求已完成时忽略；未到超时时间时按剩余时间再次安排；否则检查进度并生成报告
+	"""
+	commit_id, request_id = event.get('commit_id'), event.get('request_id')
+	table_name = os.getenv('REQUEST_TABLE')
+	record = dynamodb.Table(table_name).get_item(Key=dict(commit_id=commit_id, request_id=request_id), ConsistentRead=True).get('Item')
+	if not record or record.get('task_status') == base.STATUS_COMPLETE:
+		log.info(f'Request({request_id}) is complete or missing before deadline.')
+		return
+
+	timeout = get_report_timeout()
+	if not is_datetime_expired(record.get('create_time'), timeout):
+		elapsed = (datetime.datetime.now() - datetime.datetime.fromisoformat(record.get('create_time'))).total_seconds()
+		schedule_request_deadline(commit_id, request_id, timeout - elapsed + 1, log)
+		return
+	check_request_progress(record, log)
+
 def check_request_progress_by_pksk(commit_id, request_id, log):
 	"""
 	检查Request Record的进度状态，如果已完成（含超时），则执行后续报告流程
@@ -20,28 +71,131 @@ def check_request_progress_by_pksk(commit_id, request_id, log):
 	check_request_progress(item.get('Item'), log)
 
 
+def get_counter_shards():
+	"""
+	task_dispatcher创建任务时使用的计数分片数，0表示不分片
+	"""
+	shards = min(COUNTER_SHARDS, COUNTER_SHARDS_MAX)
+	return shards if shards > 1 else 0
+
+def get_shard_key(commit_id, request_id, shard):
+	"""
+	计数分片记录的主键，分片使用不同的分区键，使写入分散到不同分区
+	"""
+	return dict(commit_id=f'{commit_id}#shard-{shard}', request_id=request_id)
+
+def get_shard_quota(shard, counter_shards, task_count):
+	"""
+	按任务编号(1..task_count)对分片数取模分配时，分片上的任务数量
+	"""
+	return len(range(shard or counter_shards, task_count + 1, counter_shards))
+
+def increment_request_counter(commit_id, request_id, field, counter_shards=0, number=None, task_count=None):
+	"""
+	增加Request的任务计数（task_complete或task_failure）
+	不分片时直接更新Request记录；分片时按任务编号选择分片记录累加，只有该分片上的任务全部结束时，
+	请求才可能已完成，此时才读取Request记录，避免每个任务都读取热点记录并汇总所有分片
+	没有任务编号或任务数量时（旧消息）随机选择分片，每次都读取Request记录
+	@return 用于判断进度的Request记录，请求不可能已完成时返回None
+	"""
+	table = dynamodb.Table(os.getenv('REQUEST_TABLE'))
+	datetime_str = str(datetime.datetime.now())
+	if not counter_shards:
+		response = table.update_item(
+			Key = { 'commit_id': commit_id, 'request_id': request_id },
+			UpdateExpression = f'set task_status = :s, {field} = {field} + :n, update_time = :t',
+			ExpressionAttributeValues = { ':s': base.STATUS_PROCESSING, ':n': 1, ':t': datetime_str },
+			ReturnValues = 'ALL_NEW'
+		)
+		return response.get('Attributes')
+
+	sharded = number is not None and bool(task_count)
+	shard = int(number) % counter_shards if sharded else random.randrange(counter_shards)
+	response = table.update_item(
+		Key = get_shard_key(commit_id, request_id, shard),
+		UpdateExpression = f'add {field} :n set update_time = :t',
+		ExpressionAttributeValues = { ':n': 1, ':t': datetime_str },
+		ReturnValues = 'ALL_NEW'
+	)
+	if sharded:
+		counters = response.get('Attributes') or {}
+		if counters.get('task_complete', 0) + counters.get('task_failure', 0) < get_shard_quota(shard, counter_shards, int(task_count)):
+			return None
+	return table.get_item(Key=dict(commit_id=commit_id, request_id=request_id), ConsistentRead=True).get('Item')
+
+def get_request_counters(record):
+	"""
+	汇总Request记录及其所有计数分片的完成数和失败数
+	@return (task_complete, task_failure)
+	"""
+	completes, failures = record.get('task_complete', 0), record.get('task_failure', 0)
+	shards = int(record.get('counter_shards') or 0)
+	if shards <= 1:
+		return completes, failures
+
+	table_name = os.getenv('REQUEST_TABLE')
+	keys = [ get_shard_key(record['commit_id'], record['request_id'], shard) for shard in range(shards) ]
+	request_items = { table_name: dict(Keys=keys, ConsistentRead=True, **base.projection_params(['task_complete', 'task_failure'])) }
+	while request_items:
+		response = dynamodb.batch_get_item(RequestItems=request_items)
+		for item in response.get('Responses', {}).get(table_name, []):
+			completes += item.get('task_complete', 0)
+			failures += item.get('task_failure', 0)
+		request_items = response.get('UnprocessedKeys')
+	return completes, failures
+
+def claim_report(commit_id, request_id, reason, log):
+	"""
+	以条件更新原子地认领报告生成，多个执行器同时发现请求完成时只有一个能认领成功
+	认领后报告生成失败时，超过REPORT_CLAIM_TIMEOUT后可由cron重新认领
+	超时认领只生成阶段性报告，之后所有任务完成时的认领总能成功，生成最终报告
+	@params reason CLAIM_COMPLETE或CLAIM_TIMEOUT
+	@return 是否认领成功
+	"""
+	now = datetime.datetime.now()
+	stale = now - datetime.timedelta(seconds=REPORT_CLAIM_TIMEOUT)
+	condition = 'attribute_not_exists(report_claimed) OR report_claimed < :stale'
+	values = { ':now': str(now), ':stale': str(stale), ':reason': reason }
+	if reason == CLAIM_COMPLETE:
+		condition += ' OR report_claim_reason = :timeout'
+		values[':timeout'] = CLAIM_TIMEOUT
+	try:
+		dynamodb.Table(os.getenv('REQUEST_TABLE')).update_item(
+			Key = { 'commit_id': commit_id, 'request_id': request_id },
+			UpdateExpression = 'set report_claimed = :now, report_claim_reason = :reason',
+			ConditionExpression = condition,
+			ExpressionAttributeValues = values,
+		)
+		return True
+	except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+		log.info(f'Report of request record(commit_id={commit_id}, request_id={request_id}) is claimed by others.')
+		return False
+
 def check_request_progress(record, log):
 	"""
 	检查Request Record的进度状态，如果已完成（含超时），则执行后续报告流程
 	@params record request表记录
 	"""
 
-	commit_id, request_id, mode, project_name, create_time, total, completes, failures = base.extract_dict(record, 'commit_id, request_id, mode, project_name, create_time, task_total, task_complete, task_failure')
+	commit_id, request_id, mode, project_name, create_time, total = base.extract_dict(record, 'commit_id, request_id, mode, project_name, create_time, task_total')
 	label = f'request record(commit_id={commit_id}, request_id={request_id})'
 	log.info(f'Checking incomplete request record(commit_id={commit_id}, request_id={request_id})...')
 
 	is_completed = False
+	reason = CLAIM_TIMEOUT
 	
 	# 检查整个Code Review是否完成
 	try:
+		completes, failures = get_request_counters(record)
 		if completes + failures >= total:
 			is_completed = True
+			reason = CLAIM_COMPLETE
 			log.info(f'Mark code review complete. For all sub-task are complete for {label}.')
 		else:
 			log.info(f'Code review is uncomplete. Completes({completes}) + Failures({failures}) < Total({total}) for {label}.')
 		
 		# 检查整个Code Review是否超时
-		timeout = base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
+		timeout = get_report_timeout()
 		if type(timeout) == int:
 			if is_datetime_expired(create_time, timeout):
 				is_completed = True
@@ -55,6 +209,8 @@ def check_request_progress(record, log):
 	# Code Review完成，则产生报告
 	if is_completed:
 		try:
+			if not claim_report(commit_id, request_id, reason, log):
+				return
 			event = dict(commit_id = commit_id, request_id = request_id, mode = mode)
 			context = dict(project_name=project_name)
 			report.generate_report_and_notify(None, event, context)
@@ -1,13 +1,23 @@
 import boto3
-import os, re, datetime, logging
-import base, codelib, report
+import os, re, json, time, hashlib, datetime, logging, posixpath
+import base, codelib, report, task_base, model_config
 from logger import init_logger
 
 # Initialize AWS services clients
-dynamodb 				= boto3.resource("dynamodb")
+dynamodb 				= base.ThreadLocalResource("dynamodb")
 sqs_client 				= boto3.client("sqs")
-sns						= boto3.resource('sns')
-s3						= boto3.resource("s3")
+sns						= base.ThreadLocalResource('sns')
+s3						= base.ThreadLocalResource("s3")
+
+SQS_BATCH_SIZE			= 10				# SendMessageBatch单次最多10条消息
+SQS_MAX_PAYLOAD			= 256 * 1024		# SQS单条消息及单次批量发送的最大字节数
+DYNAMODB_BATCH_SIZE		= 25				# BatchWriteItem单次最多25条记录
+DYNAMODB_BATCH_RETRIES	= 5					# BatchWriteItem未处理记录的最大重试次数
+PROMPT_OFFLOAD_THRESHOLD	= base.str_to_int(os.getenv('PROMPT_OFFLOAD_THRESHOLD', str(200 * 1024)))	# 消息超过该字节数时，提示词转存到S3
+CHARS_PER_TOKEN			= 3					# 估算token数时每个token对应的字符数（偏保守，代码中符号较多）
+CHUNK_CONTEXT_PERCENT	= base.str_to_int(os.getenv('CHUNK_CONTEXT_PERCENT', '90'))	# all模式每批代码最多占用上下文窗口扣除提示词和输出后剩余部分的百分比，余量用于抵消token估算误差
+MAX_TOKEN_TO_SAMPLE		= base.str_to_int(os.getenv('MAX_TOKEN_TO_SAMPLE', '10000'))	# 模型输出的最大token数，与task_executor一致
+REVIEW_INDEX_PREFIX		= 'cache/review-index'	# single模式的评审索引：(规则, 规则内容, 文件, blob SHA) -> 之前的评审结果
 
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
@@ -27,6 +37,101 @@ def send_message(data):
 		log.error(f'Fail to send message to SQS({sqs_url}).', extra=dict(exception=str(ex)))
 		return False
 
+def send_message_batch(messages):
+	"""
+	通过SendMessageBatch发送一批消息
+	@params messages [(data, body)]，body为data的base64编码，数量不超过SQS_BATCH_SIZE
+	@return 发送失败的data列表
+	"""
+	sqs_url = os.getenv('TASK_SQS_URL')
+	entries = [ dict(Id=str(i), MessageBody=body) for i, (data, body) in enumerate(messages) ]
+	try:
+		response = sqs_client.send_message_batch(QueueUrl=sqs_url, Entries=entries)
+	except Exception as ex:
+		log.error(f'Fail to send {len(messages)} messages to SQS({sqs_url}) in batch.', extra=dict(exception=str(ex)))
+		return [ data for data, body in messages ]
+	failed = response.get('Failed', [])
+	if failed:
+		log.info(f'Fail to send {len(failed)} of {len(messages)} messages to SQS({sqs_url}) in batch.', extra=dict(failed=failed))
+	return [ messages[int(entry['Id'])][0] for entry in failed ]
+
+def write_task_batch(items):
+	"""
+	通过BatchWriteItem写入一批TASK记录，未处理的记录退避后重试
+	@params items TASK记录，数量不超过DYNAMODB_BATCH_SIZE
+	@return 最终写入失败的记录的number列表
+	"""
+	table_name = os.getenv('TASK_TABLE')
+	requests = [ dict(PutRequest=dict(Item=item)) for item in items ]
+	for attempt in range(DYNAMODB_BATCH_RETRIES):
+		try:
+			response = dynamodb.batch_write_item(RequestItems={ table_name: requests })
+		except Exception as ex:
+			log.info(f'Fail to write {len(requests)} tasks in batch.', extra=dict(exception=str(ex)))
+		else:
+			requests = response.get('UnprocessedItems', {}).get(table_name, [])
+			if not requests:
+				return []
+		time.sleep(min(0.05 * 2 ** attempt, 1))
+	return [ request['PutRequest']['Item']['number'] for request in requests ]
+
+def register_tasks(request_id, items):
+	"""
+	分发前批量创建所有TASK记录，执行器不再需要逐条创建，result_checker也能立即看到全部任务
+	@params items 待发送的SQS任务
+	@return 创建成功的任务number集合
+	"""
+	datetime_str = str(datetime.datetime.now())
+	rows = [ dict(
+		request_id = request_id,
+		number = item['number'],
+		mode = item['mode'],
+		model = item['model'],
+		retry_times = 0,
+		create_time = datetime_str,
+		update_time = datetime_str,
+	) for item in items ]
+	batches = [ rows[i:i + DYNAMODB_BATCH_SIZE] for i in range(0, len(rows), DYNAMODB_BATCH_SIZE) ]
+	registered = { row['number'] for row in rows }
+	for batch, failed in zip(batches, base.map_concurrently(write_task_batch, batches)):
+		if isinstance(failed, Exception):
+			failed = [ row['number'] for row in batch ]
+		registered.difference_update(failed)
+	if len(registered) < len(rows):
+		log.info(f'Fail to register {len(rows) - len(registered)} of {len(rows)} tasks, executors will create them.')
+	return registered
+
+def offload_prompt(item):
+	"""
+	将任务的提示词压缩后写入S3，消息中只保留S3 key，由task_executor读取还原
+	@return 去掉提示词、增加prompt_s3key后的任务数据
+	"""
+	bucket_name = os.getenv('BUCKET_NAME')
+	key = f"prompt/{item['request_id']}/{item['number']}.json.gz"
+	prompt = dict(prompt_system=item.get('prompt_system'), prompt_user=item.get('prompt_user'))
+	base.put_s3_object_gzip(s3, bucket_name, key, base.dump_json(prompt), 'application/json')
+	log.info(f'Offload prompt of task(number={item["number"]}) to s3://{bucket_name}/{key}.')
+	item = { k: v for k, v in item.items() if k not in ('prompt_system', 'prompt_user') }
+	item['prompt_s3key'] = key
+	return item
+
+def pack_message_batches(messages):
+	"""
+	按SendMessageBatch的数量和大小限制，将消息依次打包成多个批次
+	@params messages [(data, body)]
+	"""
+	batches, batch, size = [], [], 0
+	for data, body in messages:
+		length = len(body.encode('utf-8'))
+		if batch and (len(batch) >= SQS_BATCH_SIZE or size + length > SQS_MAX_PAYLOAD):
+			batches.append(batch)
+			batch, size = [], 0
+		batch.append((data, body))
+		size += length
+	if batch:
+		batches.append(batch)
+	return batches
+
 def format_prompt(pattern, variables, code=None):
 	"""
 	格式化提示词模板，支持变量替换
@@ -109,7 +214,7 @@ def get_prompt_data(mode, rule, code, variables=None):
 			prompt_system = rule.get('system', '')
 			
 			# 排除Built-in字段和特殊字段，只保留DIY字段用于构建prompt_user
-			field_excludes = ['name', 'event', 'mode', 'model', 'branch', 'target', 'system', 'order', 'confirm']
+			field_excludes = ['name', 'event', 'mode', 'model', 'branch', 'target', 'system', 'order', 'confirm', 'early_stop']
 			
 			# 获取order字段，用于指定DIY字段的排序顺序
 			order = rule.get('order', [])
@@ -126,8 +231,8 @@ def get_prompt_data(mode, rule, code, variables=None):
 				value = rule.get(key)
 				prompt_user = f'{prompt_user}\n\n{value}' if prompt_user else value
 			
-			# 在DIY字段前添加代码内容
-			prompt_user = f'以下是我的代码:\n{code}\n{prompt_user}'
+			# 在DIY字段后添加代码内容，使同一规则的所有任务共享相同的前缀，便于Bedrock缓存
+			prompt_user = f'{prompt_user}\n\n以下是我的代码:\n{code}' if prompt_user else f'以下是我的代码:\n{code}'
 		
 		# 对两种模式的提示词都进行变量替换
 		prompt_system = format_prompt(prompt_system, variables, code=code)
@@ -137,25 +242,120 @@ def get_prompt_data(mode, rule, code, variables=None):
 		# 非Claude模型不支持
 		return None, None
 	
+def get_prompt_cache_prefix(prompt_user, code):
+	"""
+	返回prompt_user中代码之前的字符数，即同一规则的各个任务共享的前缀长度，用于设置Bedrock提示词缓存点
+	找不到代码（例如代码被变量替换改写）时返回0，表示不缓存prompt_user
+	"""
+	if not code:
+		return 0
+	return max(prompt_user.find(code), 0)
+
+def get_review_index_key(rule, filepath, blob_sha, variables=None, confirm_prompt=None):
+	"""
+	single模式评审索引的S3 key，以下都相同时评审结果可以复用：
+	- 规则内容
+	- 变量替换后的提示词（不含代码，代码由blob SHA表示）
+	- 确认提示词
+	- 文件路径和blob SHA
+	"""
+	prompts = get_prompt_data('single', rule, '', variables)
+	identity = dict(rule=rule, prompts=prompts, confirm_prompt=confirm_prompt, filepath=filepath, blob_sha=blob_sha)
+	digest = hashlib.sha256(json.dumps(identity, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+	return '{}/{}.json'.format(REVIEW_INDEX_PREFIX, digest)
+
+def find_reusable_results(contents):
+	"""
+	并发查询评审索引，返回review_index_key到之前评审结果S3 key的映射
+	"""
+	keys = list({ content['review_index_key'] for content in contents if content.get('review_index_key') })
+	bucket_name = os.getenv('BUCKET_NAME')
+
+	def lookup(key):
+		try:
+			return json.loads(base.get_s3_object(s3, bucket_name, key)).get('result_s3key')
+		except s3.meta.client.exceptions.NoSuchKey:
+			return None
+
+	reusable = dict()
+	for key, result_s3key in zip(keys, base.map_concurrently(lookup, keys)):
+		if isinstance(result_s3key, Exception):
+			log.info(f'Fail to read review index({key}).', extra=dict(exception=str(result_s3key)))
+		elif result_s3key:
+			reusable[key] = result_s3key
+	log.info(f'Found {len(reusable)} reusable review results in {len(keys)} unchanged candidates.')
+	return reusable
+
+def record_dispatch_failures(commit_id, request_id, failures, failed, registered, counter_shards, task_count):
+	"""
+	记录分发阶段失败的任务，使请求仍能在其余任务结束时判断为完成
+	- 已批量创建的TASK记录标记为失败，result_checker不会一直显示为处理中
+	- 不分片时失败数量汇总后一次性累加到Request记录
+	- 分片时已编号的失败任务计入编号所在的分片，否则该分片永远达不到任务数量，不会触发汇总
+	所有任务在分发完成前就已结束时，由这里检查进度并生成报告
+	@params failures 未分配编号的失败数量
+	@params failed 已分配编号但未能发送的任务
+	"""
+	if not failures and not failed:
+		return
+
+	datetime_str = str(datetime.datetime.now())
+	rows = [ dict(
+		request_id = request_id,
+		number = item['number'],
+		mode = item['mode'],
+		model = item['model'],
+		retry_times = 0,
+		succ = False,
+		message = 'Fail to send task to SQS.',
+		create_time = datetime_str,
+		update_time = datetime_str,
+	) for item in failed if item['number'] in registered ]
+	for i in range(0, len(rows), DYNAMODB_BATCH_SIZE):
+		write_task_batch(rows[i:i + DYNAMODB_BATCH_SIZE])
+
+	record = None
+	total = failures if counter_shards else failures + len(failed)
+	try:
+		if total:
+			response = dynamodb.Table(os.getenv('REQUEST_TABLE')).update_item(
+				Key=dict(commit_id=commit_id, request_id=request_id),
+				UpdateExpression="set task_failure = task_failure + :tf",
+				ExpressionAttributeValues={ ':tf': total },
+				ReturnValues="ALL_NEW",
+			)
+			record = response.get('Attributes')
+		if counter_shards:
+			for item in failed:
+				record = task_base.increment_request_counter(commit_id, request_id, 'task_failure', counter_shards, item['number'], task_count) or record
+	except Exception as ex:
+		log.error(f'Fail to update FAILURE COUNT({failures + len(failed)}) for commit_id({commit_id}) and request_id({request_id}).', extra=dict(exception=str(ex)))
+		return
+	if record:
+		task_base.check_request_progress(record, log)
+
 def send_task_to_sqs(event, rules, request_id, commit_id, contents, variables=None):
 
 	# 更新记录的任务总数
 	count = len(contents)
 	log.info('Final count: {}'.format(count))
 	log.info('Commit Id, Request Id: {}, {}'.format(commit_id, request_id))
+	# 分片计数时执行器不再更新Request记录的状态，这里直接标记为Processing以便cron检查
+	counter_shards = task_base.get_counter_shards()
 	try:
 		table_name = os.getenv('REQUEST_TABLE')
 		table = dynamodb.Table(table_name)
 		table.update_item(
 			Key = dict(commit_id=commit_id, request_id=request_id),
-			UpdateExpression = "set #s = :s, update_time = :t, task_complete = :tc, task_failure = :tf, task_total = :tt, report_s3key = :rs, report_url = :ru",
+			UpdateExpression = "set #s = :s, update_time = :t, task_complete = :tc, task_failure = :tf, task_total = :tt, counter_shards = :cs, report_s3key = :rs, report_url = :ru",
 			ExpressionAttributeNames = { '#s': 'task_status' },
 			ExpressionAttributeValues = {
-				':s': 'Initializing',
+				':s': base.STATUS_PROCESSING if counter_shards else 'Initializing',
 				':t': str(datetime.datetime.now()),
 				':tc': 0,
 				':tf': 0,
 				':tt': count,
+				':cs': counter_shards,
 				':rs': '',
 				':ru': '',
 			},
@@ -169,11 +369,17 @@ def send_task_to_sqs(event, rules, request_id, commit_id, contents, variables=No
 		
 	# 每一个content与每一个rule组合成一个Bedrock Task
 	# 刚写完，准备deploy一次，然后看看效果吧。应该每次request，只管branch，不管mode，所有mode都会执行一次。
-	number = 0
+	number, failures = 0, 0
+	items, failed = [], []		# failed为已分配编号但未能发送的任务
+	confirm_prompt = event.get('confirm_prompt') if event.get('confirm', False) else None
+	for content in contents:
+		if content.get('blob_sha'):
+			content['review_index_key'] = get_review_index_key(content.get('rule'), content.get('filepath'), content['blob_sha'], variables, confirm_prompt)
+	reusable = find_reusable_results(contents)
 	for content in contents:
 		mode = content.get('mode')
 		rule = content.get('rule')
-		result = True
+		numbered = number
 		try:
 			model = rule.get('model')
 			prompt_system, prompt_user = get_prompt_data(mode, rule, content.get('content'), variables)
@@ -195,27 +401,58 @@ def send_task_to_sqs(event, rules, request_id, commit_id, contents, variables=No
 				rule_name = rule_name,
 				prompt_system = prompt_system,
 				prompt_user = prompt_user,
+				prompt_cache_prefix = get_prompt_cache_prefix(prompt_user, content.get('content')),
+				early_stop = base.str_to_bool(rule.get('early_stop', True)),	# 流式读取时，看到</output>后是否立即停止
+				counter_shards = counter_shards,
 			)
+			index_key = content.get('review_index_key')
+			if index_key:
+				item['review_index_key'] = index_key
+			if index_key in reusable:
+				# 文件内容和规则都没有变化，复用之前的评审结果，不再发送提示词
+				item = { k: v for k, v in item.items() if k not in ('prompt_system', 'prompt_user', 'prompt_cache_prefix') }
+				item['reuse_s3key'] = reusable[index_key]
 			if event.get('confirm', False) and event.get('confirm_prompt'):
 				item['confirm_prompt'] = event.get('confirm_prompt')
-			result = send_message(item)
-			if not result:
-				log.info('Fail to send bedrock task to SQS')
+			items.append(item)
 		except Exception as ex:
 			log.error(f'Fail to create SQS task.', extra=dict(exception=str(ex)))
-			result = False
-		
-		if not result:
-			try:
-				table.update_item(
-					Key=dict(commit_id=commit_id, request_id=request_id),
-					UpdateExpression="set task_failure = task_failure + :tf",
-					ExpressionAttributeValues={ ':tf': 1 },
-					ReturnValues="ALL_NEW",
-				)
-			except Exception as ex:
-				log.error(f'Fail to update FAILURE COUNT for commit_id({commit_id}) and mode({mode}).', extra=dict(exception=str(ex)))
+			if number > numbered:
+				failed.append(dict(number=number, mode=mode, model=rule.get('model')))
+			else:
+				failures += 1
 
+	# 批量创建TASK记录，创建成功的任务由执行器直接更新
+	registered = register_tasks(request_id, items)
+	messages = []
+	for item in items:
+		try:
+			item['task_registered'] = item['number'] in registered
+			if counter_shards:
+				# 执行器据此计算每个分片上的任务数量，分片上的任务全部结束时才汇总计数
+				item['task_count'] = number
+			body = base.encode_base64(base.dump_json(item))
+			if len(body) > PROMPT_OFFLOAD_THRESHOLD:
+				item = offload_prompt(item)
+				body = base.encode_base64(base.dump_json(item))
+			messages.append((item, body))
+		except Exception as ex:
+			log.error(f'Fail to create SQS task.', extra=dict(exception=str(ex)))
+			failed.append(item)
+
+	# 分批并发发送，批量发送失败的消息逐条重试
+	batches = pack_message_batches(messages)
+	log.info(f'Send {len(messages)} bedrock tasks to SQS in {len(batches)} batches.')
+	for batch, unsent in zip(batches, base.map_concurrently(send_message_batch, batches)):
+		if isinstance(unsent, Exception):
+			log.error(f'Fail to send bedrock tasks to SQS in batch.', extra=dict(exception=str(unsent)))
+			unsent = [ item for item, body in batch ]
+		for item in unsent:
+			if not send_message(item):
+				log.info('Fail to send bedrock task to SQS')
+				failed.append(item)
+
+	record_dispatch_failures(commit_id, request_id, failures, failed, registered, counter_shards, number)
 	return True
 
 def update_dynamodb_status(commit_id, scan_scope, status, file_num):
@@ -274,7 +511,7 @@ def load_rules(event, repo_context, commit_id=None, branch=None):
 	
 	字段分类：
 	1. Built-in属性（系统固定字段）：
-	   - name, mode, model, event, branch, target, confirm
+	   - name, mode, model, event, branch, target, confirm, early_stop
 	
 	2. 特殊字段（模式特定）：
 	   - prompt_system, prompt_user：仅在webtool模式下存在，用户直接指定完整提示词
@@ -321,18 +558,108 @@ def get_targets(rule):
 	targets = [t.strip() for t in rule.get('target', '').strip().rstrip('.').split(',')]
 	return targets
 
+def estimate_tokens(text):
+	return len(text) // CHARS_PER_TOKEN + 1
+
+def get_chunk_token_budget(rule):
+	"""
+	all模式每批代码的token预算
+	从规则所用模型的上下文窗口中扣除系统提示词、DIY字段组成的用户提示词和为输出保留的MAX_TOKEN_TO_SAMPLE，
+	剩余部分按CHUNK_CONTEXT_PERCENT留出估算误差的余量
+	"""
+	prompt_system, prompt_user = get_prompt_data('all', rule, '') or (None, None)
+	prompt_tokens = sum(estimate_tokens(prompt) for prompt in (prompt_system, prompt_user) if prompt)
+	available = model_config.get_context_window(rule.get('model')) - prompt_tokens - MAX_TOKEN_TO_SAMPLE
+	return max(available, 0) * CHUNK_CONTEXT_PERCENT // 100
+
+def chunk_project_files(files, max_tokens):
+	"""
+	将项目文件按目录分组打包成若干批，每批估算的token数不超过max_tokens
+	- 同一目录的文件尽量放在同一批中，批次和批内文件保持文件树的顺序
+	- 目录放不进当前批次时开启新批次，单个目录超过预算时按文件拆分
+	- 单个文件超过预算时独占一批
+	@params files [(filepath, content)]
+	@return [[(filepath, content)]]
+	"""
+	groups = dict()
+	for file_path, file_content in files:
+		groups.setdefault(posixpath.dirname(file_path), []).append((file_path, file_content))
+
+	chunks, chunk, used = [], [], 0
+	def flush():
+		nonlocal chunk, used
+		if chunk: chunks.append(chunk)
+		chunk, used = [], 0
+
+	for group in groups.values():
+		sizes = [ estimate_tokens(base.format_code_files([ file ])) for file in group ]
+		if used + sum(sizes) <= max_tokens:
+			chunk.extend(group)
+			used += sum(sizes)
+			continue
+		flush()
+		for file, size in zip(group, sizes):
+			if used + size > max_tokens:
+				flush()
+			if size > max_tokens:
+				log.warning(f'File({file[0]}) exceeds token budget({max_tokens}) on its own.', extra=dict(tokens=size))
+			chunk.append(file)
+			used += size
+	flush()
+	return chunks
+
 def get_code_contents_for_all(repo_context, commit_id, rule):
 	targets = get_targets(rule)
-	text = codelib.get_project_code_text(repo_context, commit_id, targets)      # 计算完整的代码块
+	files = codelib.get_project_code_files(repo_context, commit_id, targets)
+	chunks = chunk_project_files(files or [], get_chunk_token_budget(rule))
+	log.info(f'Split {len(files or [])} project files into {len(chunks)} chunks.', extra=dict(chunks=[ len(chunk) for chunk in chunks ]))
+
+	# 每一批代码作为一个任务，只有一批时保持原来的文件路径标识
 	contents = []
-	if text:
-		contents.append(dict(mode='all', filepath = '<The Whole Project>', content=text, rule=rule))
+	for index, chunk in enumerate(chunks):
+		filepath = '<The Whole Project>' if len(chunks) == 1 else f'<The Whole Project> ({index + 1}/{len(chunks)})'
+		contents.append(dict(mode='all', filepath = filepath, content=base.format_code_files(chunk), rule=rule))
 	return contents
 
-def get_code_contents_for_single(repo_context, commit_id, previous_commit_id, rule):
+def make_fetch_plan(repo_context, commit_id, previous_commit_id, rules):
+	"""
+	为一次请求制定代码获取计划，供所有规则共享
+	
+	- diff只计算一次（single/diff模式的规则都需要）
+	- single模式规则命中的文件取并集后只下载一次
+	
+	Returns:
+		dict: file_diffs为文件路径到差异内容的映射，file_contents为文件路径到完整内容的映射
+	"""
+	plan = dict(file_diffs=dict(), file_contents=dict())
+	modes = { rule.get('mode') for rule in rules }
+	if 'single' not in modes and 'diff' not in modes:
+		return plan
+
+	plan['file_diffs'] = codelib.get_involved_files(repo_context, commit_id, previous_commit_id)
+	files = list(plan['file_diffs'].keys())
+
+	targets = set()
+	for rule in rules:
+		if rule.get('mode') == 'single':
+			targets.update(base.filter_targets(files, get_targets(rule)))
+	filepaths = [ filepath for filepath in files if filepath in targets ]
+	log.info(f'Fetch {len(filepaths)} files once for all single rules.', extra=dict(files=filepaths))
+
+	# 并发下载前先解析一次文件树，避免每个线程各自下载完整的文件树
+	blob_shas = codelib.get_blob_shas(repo_context, commit_id) if filepaths else dict()
+	codes = base.map_concurrently(lambda filepath: codelib.get_repository_file(repo_context, filepath, commit_id, blob_shas), filepaths)
+	for filepath, code in zip(filepaths, codes):
+		if isinstance(code, Exception):
+			log.info(f'Fail to get file({filepath}) content.', extra=dict(exception=str(code)))
+			code = None
+		plan['file_contents'][filepath] = code
+	return plan
+
+def get_code_contents_for_single(repo_context, commit_id, previous_commit_id, rule, plan=None):
 	# 获取涉及的文件
 	targets = get_targets(rule)
-	file_diffs = codelib.get_involved_files(repo_context, commit_id, previous_commit_id)
+	file_diffs = plan['file_diffs'] if plan else codelib.get_involved_files(repo_context, commit_id, previous_commit_id)
 	files = list(file_diffs.keys())
 	log.info(f'Get {len(files)} involved files before filtering.', extra=dict(files=files))
 	files = base.filter_targets(files, targets)
@@ -341,15 +668,22 @@ def get_code_contents_for_single(repo_context, commit_id, previous_commit_id, ru
 	# 逐个文件组装成提示词片段
 	contents = []
 	for filepath in files:
-		code = codelib.get_repository_file(repo_context, filepath, commit_id)
+		if plan and filepath in plan['file_contents']:
+			code = plan['file_contents'][filepath]
+		else:
+			code = codelib.get_repository_file(repo_context, filepath, commit_id)
 		content = f'{filepath}\n```\n{code}\n```'
-		contents.append(dict(mode='single', filepath = filepath, content = content, rule=rule))
+		item = dict(mode='single', filepath = filepath, content = content, rule=rule)
+		if code is not None:
+			# 评审索引key还与变量和确认提示词有关，由send_task_to_sqs计算
+			item['blob_sha'] = base.git_blob_sha(code)
+		contents.append(item)
 	return contents
 
-def get_code_contents_for_diff(repo_context, commit_id, previous_commit_id, rule):
+def get_code_contents_for_diff(repo_context, commit_id, previous_commit_id, rule, plan=None):
 	# 获取涉及的文件
 	targets = get_targets(rule)
-	file_diffs = codelib.get_involved_files(repo_context, commit_id, previous_commit_id)
+	file_diffs = plan['file_diffs'] if plan else codelib.get_involved_files(repo_context, commit_id, previous_commit_id)
 	files = list(file_diffs.keys())
 	log.info(f'Get {len(files)} involved files before filtering.', extra=dict(files=files))
 	files = base.filter_targets(files, targets)
@@ -416,6 +750,9 @@ def lambda_handler(event, context):
 	modes = list({rule.get('mode') for rule in rules})
 	log.info('Found {} modes for branch({}): {}'.format(len(modes), target_branch, modes))
 	
+	# 一次性获取所有规则需要的diff和文件，再分发给各规则
+	plan = make_fetch_plan(repo_context, commit_id, previous_commit_id, rules)
+
 	# contents_with_mode = dict()
 	contents = []
 	for rule in rules:
@@ -425,9 +762,9 @@ def lambda_handler(event, context):
 		if mode == 'all':
 			rule_contents = get_code_contents_for_all(repo_context, commit_id, rule)
 		elif mode == 'single':
-			rule_contents = get_code_contents_for_single(repo_context, commit_id, previous_commit_id, rule)
+			rule_contents = get_code_contents_for_single(repo_context, commit_id, previous_commit_id, rule, plan=plan)
 		elif mode == 'diff':
-			rule_contents = get_code_contents_for_diff(repo_context, commit_id, previous_commit_id, rule)
+			rule_contents = get_code_contents_for_diff(repo_context, commit_id, previous_commit_id, rule, plan=plan)
 		
 		log.info(f'Get {len(rule_contents)} contents for rule({rule.get("name")}).', extra=dict(contents=rule_contents))
 		contents = contents + rule_contents
@@ -436,6 +773,9 @@ def lambda_handler(event, context):
 	# contents = None # to del
 	if contents:
 		result = send_task_to_sqs(event, rules, request_id, commit_id, contents)
+		# 到达超时时间后检查一次，即使部分任务一直没有完成也能生成报告
+		if result:
+			task_base.schedule_request_deadline(commit_id, request_id, task_base.get_report_timeout(), log)
 	else:
 		try:
 			datetime_str = str(datetime.datetime.now())
@@ -1,8 +1,8 @@
 import boto3
 import traceback
-import os, re, ast, json, time, datetime, logging, random
+import os, re, json, time, decimal, hashlib, datetime, logging, random, threading
 import base, task_base
-import model_config
+import model_config, rate_limiter, json_repair
 from botocore.config import Config
 from logger import init_logger
 
@@ -12,25 +12,37 @@ SNS_TOPIC_ARN 			= os.getenv('SNS_TOPIC_ARN')
 SQS_MAX_DELAY 			= base.str_to_int(os.getenv('SQS_MAX_DELAY', '300'))   		# 最大延迟时间(秒)
 SQS_BASE_DELAY 			= base.str_to_int(os.getenv('SQS_BASE_DELAY', '60'))   		# 初始延迟时间(秒)
 SQS_MAX_RETRIES 		= base.str_to_int(os.getenv('SQS_MAX_RETRIES', '5'))		# 最大重试次数
+SQS_DELAY_LIMIT 		= 900																# SQS DelaySeconds的上限(秒)
+EXECUTOR_CONCURRENCY 	= base.str_to_int(os.getenv('EXECUTOR_CONCURRENCY', '10'))	# 单次调用内并发处理的SQS消息数
 MAX_FAILED_TIMES 		= base.str_to_int(os.getenv('MAX_FAILED_TIMES', '6'))
 MAX_TOKEN_TO_SAMPLE 	= base.str_to_int(os.getenv('MAX_TOKEN_TO_SAMPLE', '10000'))
 REPORT_TIMEOUT_SECONDS 	= base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
 TOP_P 					= base.str_to_float(os.getenv('TOP_P', '1'))
 TEMPERATURE 			= base.str_to_float(os.getenv('TEMPERATURE', '0'))
+PROMPT_CACHE 			= base.str_to_bool(os.getenv('PROMPT_CACHE', 'true'))		# 是否使用Bedrock提示词缓存
+BEDROCK_STREAMING 		= base.str_to_bool(os.getenv('BEDROCK_STREAMING', 'true'))	# 是否以流式方式读取Bedrock响应
+OUTPUT_END_TAG 			= '</output>'
+RESULT_CACHE_TTL 		= base.str_to_int(os.getenv('RESULT_CACHE_TTL', str(7 * 24 * 3600)))	# 评审结果缓存的有效期(秒)，0表示不使用缓存
+RESULT_CACHE_PREFIX 	= 'cache/result'
 
 BEDROCK_ACCESS_KEY 		= os.getenv('BEDROCK_ACCESS_KEY')
 BEDROCK_SECRET_KEY 		= os.getenv('BEDROCK_SECRET_KEY')
 BEDROCK_REGION 			= os.getenv('BEDROCK_REGION')
+BEDROCK_MAX_POOL_CONNECTIONS	= base.str_to_int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '10'))	# 每个Bedrock客户端的HTTP连接池大小
 
 sqs						= boto3.client("sqs")
-dynamodb				= boto3.resource("dynamodb")
-sns						= boto3.resource('sns')
-s3						= boto3.resource("s3")
+dynamodb				= base.ThreadLocalResource("dynamodb")
+sns						= base.ThreadLocalResource('sns')
+s3						= base.ThreadLocalResource("s3")
 if BEDROCK_ACCESS_KEY and BEDROCK_SECRET_KEY and BEDROCK_REGION:
 	bedrock	= boto3.client(service_name="bedrock-runtime", aws_access_key_id=BEDROCK_ACCESS_KEY, aws_secret_access_key=BEDROCK_SECRET_KEY, region_name=BEDROCK_REGION)
 else:
 	bedrock	= boto3.client(service_name="bedrock-runtime")
 
+# Bedrock客户端池，按(read_timeout, region)复用，Lambda热启动时无需重新创建客户端和建立TLS连接
+_bedrock_clients		= dict()
+_bedrock_clients_lock	= threading.Lock()
+
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
 
@@ -103,13 +115,35 @@ def invoke_claude3(model, prompt_data, task_name):
 		raise Exception(f'Fail to invoke Claude3: {ex}') from ex
 
 
-def build_messages(messages, for_converse_api=False):
+def build_cached_content(text, cache_prefix, for_converse_api=False):
+	"""
+	Split text into a shared prefix and the rest, with a prompt-cache checkpoint after the prefix
+
+	Args:
+		text: Message text
+		cache_prefix: Length of the shared prefix
+		for_converse_api: If True, format for Converse API (cachePoint block)
+
+	Returns:
+		list: Content blocks
+	"""
+	prefix, rest = text[:cache_prefix], text[cache_prefix:]
+	if for_converse_api:
+		return [{'text': prefix}, {'cachePoint': {'type': 'default'}}, {'text': rest}]
+	return [
+		{'type': 'text', 'text': prefix, 'cache_control': {'type': 'ephemeral'}},
+		{'type': 'text', 'text': rest},
+	]
+
+
+def build_messages(messages, for_converse_api=False, cache_prefix=0):
 	"""
 	Build messages array for Bedrock API
 
 	Args:
 		messages: List of message strings or message objects
 		for_converse_api: If True, format for Converse API (no 'type' field)
+		cache_prefix: Length of the shared prefix of the first message to cache, 0 means no cache checkpoint
 
 	Returns:
 		list: Formatted messages array
@@ -119,7 +153,13 @@ def build_messages(messages, for_converse_api=False):
 		for i, message in enumerate(messages):
 			role = 'user' if i % 2 == 0 else 'assistant'
 			if isinstance(message, str):
-				if for_converse_api:
+				if i == 0 and 0 < (cache_prefix or 0) < len(message):
+					# 同一规则各任务共享的前缀之后设置缓存点，只有代码部分不同
+					formatted_messages.append({
+						'role': role,
+						'content': build_cached_content(message, cache_prefix, for_converse_api)
+					})
+				elif for_converse_api:
 					# Converse API format: no 'type' field
 					formatted_messages.append({
 						'role': role,
@@ -149,15 +189,19 @@ def build_request_params(model_cfg, prompt_data, enable_reasoning, reasoning_bud
 	Returns:
 		dict: Request parameters
 	"""
+	prompt_cache = use_prompt_cache(model_cfg)
 	params = {
 		'anthropic_version': 'bedrock-2023-05-31',
 		'max_tokens': MAX_TOKEN_TO_SAMPLE,
-		'messages': build_messages(prompt_data.get('messages', [])),
+		'messages': build_messages(prompt_data.get('messages', []), cache_prefix=prompt_data.get('cache_prefix', 0) if prompt_cache else 0),
 	}
 
 	# Add system prompt if provided
 	if prompt_data.get('system'):
-		params['system'] = prompt_data.get('system')
+		if prompt_cache:
+			params['system'] = [{'type': 'text', 'text': prompt_data.get('system'), 'cache_control': {'type': 'ephemeral'}}]
+		else:
+			params['system'] = prompt_data.get('system')
 
 	# Handle Claude 4.5/Haiku 4.5 parameter restrictions
 	if model_cfg.get('param_restriction') == 'temperature_only':
@@ -172,6 +216,26 @@ def build_request_params(model_cfg, prompt_data, enable_reasoning, reasoning_bud
 	return params
 
 
+def use_prompt_cache(model_cfg):
+	"""
+	Whether to add prompt-cache checkpoints for the model (controlled by PROMPT_CACHE)
+	"""
+	return PROMPT_CACHE and model_cfg.get('supports_prompt_cache', False)
+
+
+def get_cache_usage(usage):
+	"""
+	Extract prompt-cache token counts from usage, compatible with both InvokeModel and Converse API
+
+	Returns:
+		tuple: (cache_read_tokens, cache_write_tokens)
+	"""
+	usage = usage or {}
+	read = usage.get('cache_read_input_tokens', usage.get('cacheReadInputTokens')) or 0
+	write = usage.get('cache_creation_input_tokens', usage.get('cacheWriteInputTokens')) or 0
+	return read, write
+
+
 def build_reasoning_config(reasoning_budget):
 	"""
 	Build reasoning configuration for Claude 3.7
@@ -246,6 +310,112 @@ def parse_response(response_body, model_cfg, used_converse_api):
 			raise Exception('Invalid response format: no content')
 
 
+def get_bedrock_client(timeout):
+	"""
+	Get a pooled Bedrock runtime client for the read timeout
+
+	Args:
+		timeout: Read timeout in seconds
+
+	Returns:
+		Bedrock runtime client, created once per (timeout, region) and reused afterwards
+	"""
+	key = (timeout, BEDROCK_REGION)
+	with _bedrock_clients_lock:
+		client = _bedrock_clients.get(key)
+		if client:
+			return client
+
+		boto_config = Config(
+			read_timeout=timeout,
+			max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+			tcp_keepalive=True,
+		)
+		if BEDROCK_ACCESS_KEY and BEDROCK_SECRET_KEY and BEDROCK_REGION:
+			client = boto3.client(
+				service_name="bedrock-runtime",
+				aws_access_key_id=BEDROCK_ACCESS_KEY,
+				aws_secret_access_key=BEDROCK_SECRET_KEY,
+				region_name=BEDROCK_REGION,
+				config=boto_config
+			)
+		else:
+			client = boto3.client(
+				service_name="bedrock-runtime",
+				config=boto_config
+			)
+		log.info(f'Create Bedrock client for timeout({timeout}).', extra=dict(region=key[1]))
+		_bedrock_clients[key] = client
+		return client
+
+
+def read_invoke_model_stream(stream, early_stop=False):
+	"""
+	Read InvokeModel response stream and build the text incrementally
+
+	Args:
+		stream: EventStream from invoke_model_with_response_stream
+		early_stop: Stop reading once OUTPUT_END_TAG has been seen
+
+	Returns:
+		tuple: (result with text, reasoning, stop_reason, usage; time of the first token or None)
+	"""
+	result = {'text': '', 'reasoning': None, 'stop_reason': None, 'usage': {}}
+	first_token_time = None
+	for event in stream:
+		chunk = json.loads(event.get('chunk', {}).get('bytes', b'{}'))
+		chunk_type = chunk.get('type')
+		if chunk_type == 'message_start':
+			result['usage'].update(chunk.get('message', {}).get('usage', {}))
+		elif chunk_type == 'content_block_delta':
+			delta = chunk.get('delta', {})
+			if delta.get('type') == 'text_delta':
+				first_token_time = first_token_time or time.time()
+				result['text'] += delta.get('text', '')
+				if early_stop and OUTPUT_END_TAG in result['text']:
+					result['stop_reason'] = 'early_stop'
+					break
+		elif chunk_type == 'message_delta':
+			result['stop_reason'] = chunk.get('delta', {}).get('stop_reason')
+			result['usage'].update(chunk.get('usage', {}))
+	if hasattr(stream, 'close'):
+		stream.close()
+	return result, first_token_time
+
+
+def read_converse_stream(stream, early_stop=False):
+	"""
+	Read ConverseStream response stream and build the text incrementally
+
+	Args:
+		stream: EventStream from converse_stream
+		early_stop: Stop reading once OUTPUT_END_TAG has been seen
+
+	Returns:
+		tuple: (result with text, reasoning, stop_reason, usage; time of the first token or None)
+	"""
+	result = {'text': '', 'reasoning': None, 'stop_reason': None, 'usage': {}}
+	first_token_time = None
+	for event in stream:
+		if 'contentBlockDelta' in event:
+			delta = event['contentBlockDelta'].get('delta', {})
+			first_token_time = first_token_time or time.time()
+			if 'reasoningContent' in delta:
+				result['reasoning'] = (result['reasoning'] or '') + delta['reasoningContent'].get('text', '')
+			elif 'text' in delta:
+				result['text'] += delta['text']
+				if early_stop and OUTPUT_END_TAG in result['text']:
+					result['stop_reason'] = 'early_stop'
+					break
+		elif 'messageStop' in event:
+			result['stop_reason'] = event['messageStop'].get('stopReason')
+		elif 'metadata' in event:
+			result['usage'] = event['metadata'].get('usage', {})
+	if hasattr(stream, 'close'):
+		stream.close()
+	return result, first_token_time
+
+
 def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 	"""
 	Invoke Claude model (supports Claude 3/3.5/3.7/4/4.5 all series)
@@ -257,7 +427,10 @@ def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 		enable_reasoning: Whether to enable reasoning capability (only Claude 3.7 supports)
 
 	Returns:
-		dict: Response containing text, reasoning, usage, etc.
+		dict: Response containing text, reasoning, usage, ttft, etc.
+
+	When BEDROCK_STREAMING is on, the response is read as a stream and reading stops once
+	OUTPUT_END_TAG has been seen, unless prompt_data['early_stop'] is False.
 	"""
 	# 1. Get model configuration
 	config = model_config.get_model_config(model)
@@ -271,23 +444,11 @@ def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 	if enable_reasoning and config.get('supports_reasoning'):
 		additional_fields = build_reasoning_config(reasoning_budget)
 
-	# 4. Create Bedrock client with timeout configuration
-	timeout = config.get('timeout', 120)
-	boto_config = Config(read_timeout=timeout)
-
-	if BEDROCK_ACCESS_KEY and BEDROCK_SECRET_KEY and BEDROCK_REGION:
-		bedrock_client = boto3.client(
-			service_name="bedrock-runtime",
-			aws_access_key_id=BEDROCK_ACCESS_KEY,
-			aws_secret_access_key=BEDROCK_SECRET_KEY,
-			region_name=BEDROCK_REGION,
-			config=boto_config
-		)
-	else:
-		bedrock_client = boto3.client(
-			service_name="bedrock-runtime",
-			config=boto_config
-		)
+	# 4. Get Bedrock client with timeout configuration (reused across invocations)
+	bedrock_client = get_bedrock_client(config.get('timeout', 120))
+
+	# Take a token from the model's rate limiter, RateLimitExceeded requeues the task without counting a retry
+	rate_limiter.acquire(model)
 
 	# 5. Invoke Bedrock
 	try:
@@ -295,12 +456,16 @@ def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 				 extra={'params': params, 'additional_fields': additional_fields})
 
 		start_time = time.time()
+		first_token_time = None
+		early_stop = prompt_data.get('early_stop', True)
 
 		# Choose API based on whether additional_fields are needed
 		if additional_fields:
 			# Use Converse API (supports additionalModelRequestFields)
 			# Need to rebuild messages in Converse format (no 'type' field)
-			converse_messages = build_messages(prompt_data.get('messages', []), for_converse_api=True)
+			prompt_cache = use_prompt_cache(config)
+			converse_messages = build_messages(prompt_data.get('messages', []), for_converse_api=True,
+											   cache_prefix=prompt_data.get('cache_prefix', 0) if prompt_cache else 0)
 
 			converse_params = {
 				'modelId': config['model_id'],
@@ -313,28 +478,42 @@ def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 			}
 
 			# Add system prompt if present
-			if params.get('system'):
-				converse_params['system'] = [{'text': params.get('system')}]
+			if prompt_data.get('system'):
+				converse_params['system'] = [{'text': prompt_data.get('system')}]
+				if prompt_cache:
+					converse_params['system'].append({'cachePoint': {'type': 'default'}})
 
 			# Note: topP is not used when thinking is enabled (temperature must be 1.0)
 
-			response = bedrock_client.converse(**converse_params)
-			response_body = response
+			if BEDROCK_STREAMING:
+				response = bedrock_client.converse_stream(**converse_params)
+				result, first_token_time = read_converse_stream(response['stream'], early_stop)
+			else:
+				response = bedrock_client.converse(**converse_params)
+				result = parse_response(response, config, True)
 		else:
 			# Use InvokeModel API (existing approach)
-			response = bedrock_client.invoke_model(
-				body=json.dumps(params),
-				modelId=config['model_id']
-			)
-			response_body = json.loads(response['body'].read())
+			if BEDROCK_STREAMING:
+				response = bedrock_client.invoke_model_with_response_stream(
+					body=json.dumps(params),
+					modelId=config['model_id']
+				)
+				result, first_token_time = read_invoke_model_stream(response['body'], early_stop)
+			else:
+				response = bedrock_client.invoke_model(
+					body=json.dumps(params),
+					modelId=config['model_id']
+				)
+				result = parse_response(json.loads(response['body'].read()), config, False)
 
 		end_time = time.time()
+		rate_limiter.on_success(model)
 
-		# 6. Parse response
-		result = parse_response(response_body, config, additional_fields is not None)
-
-		# 7. Return result
+		# 6. Return result
 		timecost = int((end_time - start_time) * 1000)
+		ttft = int((first_token_time - start_time) * 1000) if first_token_time else None
+		cache_read_tokens, cache_write_tokens = get_cache_usage(result.get('usage'))
+		log.info(f'Prompt cache usage for {task_name}: read {cache_read_tokens}, write {cache_write_tokens} tokens.')
 		return {
 			'model': config['model_id'],
 			'text': result['text'],
@@ -343,15 +522,43 @@ def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 			'usage': result.get('usage', {}),
 			'payload': json.dumps(params),
 			'timecost': timecost,
+			'ttft': ttft,
+			'cache_read_tokens': cache_read_tokens,
+			'cache_write_tokens': cache_write_tokens,
 			'start_time': datetime.datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
 			'end_time': datetime.datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
 		}
 
 	except Exception as ex:
 		log.error(f'Failed to invoke {config["model_id"]}: {ex}')
+		if rate_limiter.is_throttling(ex):
+			rate_limiter.on_throttle(model)
 		raise Exception(f'Fail to invoke Claude: {ex}') from ex
 
 
+class RetryScheduled(Exception):
+	"""任务已带着重试状态重新发送到SQS延迟执行，当前消息视为处理完成"""
+	pass
+
+
+def schedule_retry(prompt_data, delay):
+	"""
+	将原始SQS消息连同重试状态重新发送到SQS，由DelaySeconds实现退避，当前Lambda无需等待
+	@return 是否发送成功，没有原始消息或发送失败时返回False
+	"""
+	event = prompt_data.get('event')
+	if not event or not TASK_SQS_URL:
+		return False
+	retry_state = dict(current_retry=prompt_data['current_retry'], error_messages=prompt_data.get('error_messages', []))
+	try:
+		message = base.encode_base64(base.dump_json(dict(event, retry_state=retry_state)))
+		sqs.send_message(QueueUrl=TASK_SQS_URL, MessageBody=message, DelaySeconds=max(0, min(int(delay), SQS_DELAY_LIMIT)))
+		return True
+	except Exception as ex:
+		log.error(f'Fail to schedule retry in {delay} seconds.', extra=dict(exception=str(ex)))
+		return False
+
+
 def invoke_bedrock(task_name, prompt_data):
 	"""
 	Bedrock invocation entry point (maintains existing signature, enhanced functionality)
@@ -379,10 +586,14 @@ def invoke_bedrock(task_name, prompt_data):
 				prompt_data['end_time'] = reply['end_time']
 				if 'start_time' not in prompt_data:
 					prompt_data['start_time'] = reply['start_time']
+				if prompt_data.get('ttft') is None:
+					prompt_data['ttft'] = reply.get('ttft')
 				if 'timecost' not in prompt_data:
 					prompt_data['timecost'] = reply['timecost']
 				else:
 					prompt_data['timecost'] += reply['timecost']
+				prompt_data['cache_read_tokens'] = prompt_data.get('cache_read_tokens', 0) + reply.get('cache_read_tokens', 0)
+				prompt_data['cache_write_tokens'] = prompt_data.get('cache_write_tokens', 0) + reply.get('cache_write_tokens', 0)
 
 			else:
 				log.info(f'Model({model}) is not supported.')
@@ -390,6 +601,16 @@ def invoke_bedrock(task_name, prompt_data):
 
 			return prompt_data
 
+		except rate_limiter.RateLimitExceeded as ex:
+
+			# 限流器拒绝时Bedrock尚未被调用，不计入重试次数，随机错开后重新入队
+			delay = min(int(ex.wait) + 1 + random.randint(0, SQS_BASE_DELAY), SQS_DELAY_LIMIT)
+			if schedule_retry(prompt_data, delay):
+				log.info(f'{task_name} is rate limited, requeue in {delay} seconds.')
+				raise RetryScheduled(f'{task_name} is rate limited, requeue in {delay} seconds.')
+			log.info(f'{task_name} is rate limited, wait {ex.wait} seconds.')
+			time.sleep(ex.wait)
+
 		except Exception as ex:
 
 			prompt_data['current_retry'] += 1
@@ -411,34 +632,48 @@ def invoke_bedrock(task_name, prompt_data):
 				True
 			)
 			
+			if prompt_data['current_retry'] >= prompt_data['max_retry']:
+				break
+
+			# 重新入队延迟重试，当前Lambda立即退出；无法入队时退回到原地等待
+			if schedule_retry(prompt_data, delay):
+				log.info(f'Retry of {task_name} is scheduled in {delay} seconds.')
+				raise RetryScheduled(f'Retry of {task_name} is scheduled in {delay} seconds.')
 			log.info(f"Retrying in {delay} seconds...")
 			time.sleep(delay)  # 延迟一段时间后重试
 	
 	# 跳出循环即表示重试多次失败
 	commit_id, request_id, number, mode = base.extract_dict(prompt_data.get('context', {}), 'commit_id, request_id, number, mode')
-	update_failure_task(
+	record = update_failure_task(
 		commit_id, request_id, number, mode, 
 		base.dump_json(prompt_data['error_messages']), 
 		prompt_data.get('system'), 
 		base.dump_json(prompt_data.get('messages')), 
-		False
+		False,
+		prompt_data['context'].get('counter_shards', 0),
+		prompt_data['context'].get('task_count')
 	)
 	log.info(f'Review failure is saved in {task_name}.')
+	if record:
+		task_base.check_request_progress(record, log)
 	raise Exception(f'Fail to process {task_name} for {prompt_data["max_retry"]} times')
 
 
 def extract_bedrock_response(text):
 	
-	match = re.search(r'<output>(.*?)</output>', text, re.DOTALL)
+	match = re.search(r'<output>(.*?)</output>', text, re.DOTALL) or re.search(r'<output>(.*)$', text, re.DOTALL)
 	if not match:
 		log.info('No <output> tag found in response.', extra=dict(text=text))
 		content = ''
 	else:
+		# 没有</output>时说明输出被截断，由json_repair丢弃不完整的部分
 		content = match.group(1)
 
 	try:
 		log.info('Try to parse json result.', extra=dict(content=content))
-		python_object = ast.literal_eval(content)
+		python_object, repaired = json_repair.loads(content)
+		if repaired:
+			log.info('JSON content is repaired locally.', extra=dict(content=content))
 		
 		if isinstance(python_object, dict):
 			python_object = [python_object]
@@ -461,10 +696,14 @@ def invoke_and_extract_bedrock(task_name, prompt_data, message):
 	prompt_data = invoke_bedrock(task_name, prompt_data)
 	reply = prompt_data.get('latest_reply')
 	log.info(f'Get bedrock result.', extra=dict(reply=reply))
+	start_time = time.time()
 	try:
 		content = extract_bedrock_response(reply)
 		prompt_data['content'] = content
+		prompt_data['parse_timecost'] = prompt_data.get('parse_timecost', 0) + (time.time() - start_time) * 1000
 	except Exception as ex:
+		# 本地修复也无法解析时，才让模型重新输出
+		prompt_data['parse_timecost'] = prompt_data.get('parse_timecost', 0) + (time.time() - start_time) * 1000
 		log.info('Fail to parse JSON in output tag. Try to rectify the JSON output.', extra=dict(text=reply))
 		prompt_data['current_retry'] += 1
 		if prompt_data['current_retry'] < prompt_data['max_retry']:
@@ -473,34 +712,192 @@ def invoke_and_extract_bedrock(task_name, prompt_data, message):
 	
 	return prompt_data
 
+def load_offloaded_prompt(event):
+	"""
+	提示词过大时task_dispatcher会将其转存到S3，这里根据prompt_s3key读取还原
+	"""
+	key = event.get('prompt_s3key')
+	if not key:
+		return event
+	bucket_name = os.getenv('BUCKET_NAME')
+	prompt = json.loads(base.get_s3_object_gzip(s3, bucket_name, key))
+	log.info(f'Load offloaded prompt from s3://{bucket_name}/{key}.')
+	return dict(event, prompt_system=prompt.get('prompt_system'), prompt_user=prompt.get('prompt_user'))
+
+def get_prompt_fingerprint(model, prompt_system, prompt_user, confirm_prompt, enable_reasoning=False):
+	"""
+	计算最终提示词和模型参数的指纹，完全相同的任务（如rebase、force push、重复的webtool请求）指纹相同
+	"""
+	params = dict(
+		model = model,
+		prompt_system = prompt_system,
+		prompt_user = prompt_user,
+		confirm_prompt = confirm_prompt,
+		enable_reasoning = enable_reasoning,
+		max_tokens = MAX_TOKEN_TO_SAMPLE,
+		temperature = TEMPERATURE,
+		top_p = TOP_P,
+	)
+	return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def load_cached_result(fingerprint):
+	"""
+	读取指纹对应的评审结果缓存，不存在、已过期或读取失败时返回None
+	"""
+	if RESULT_CACHE_TTL <= 0:
+		return None
+	bucket_name = os.getenv('BUCKET_NAME')
+	key = f'{RESULT_CACHE_PREFIX}/{fingerprint}.json'
+	try:
+		cached = json.loads(base.get_s3_object(s3, bucket_name, key))
+	except Exception as ex:
+		log.info(f'Result cache missed for {fingerprint}.', extra=dict(exception=str(ex)))
+		return None
+	if cached.get('expires', 0) < time.time():
+		log.info(f'Result cache expired for {fingerprint}.')
+		return None
+	return cached.get('result')
+
+def save_cached_result(fingerprint, result):
+	if RESULT_CACHE_TTL <= 0:
+		return
+	bucket_name = os.getenv('BUCKET_NAME')
+	key = f'{RESULT_CACHE_PREFIX}/{fingerprint}.json'
+	try:
+		data = dict(expires=time.time() + RESULT_CACHE_TTL, result=result)
+		base.put_s3_object(s3, bucket_name, key, base.dump_json(data), 'application/json')
+	except Exception as ex:
+		log.info(f'Fail to save result cache for {fingerprint}.', extra=dict(exception=str(ex)))
+
+def save_review_index(index_key, result_s3key):
+	"""
+	single模式评审成功后记录评审索引，文件和规则都未变化时task_dispatcher会复用该结果
+	"""
+	bucket_name = os.getenv('BUCKET_NAME')
+	try:
+		data = dict(result_s3key=result_s3key, update_time=str(datetime.datetime.now()))
+		base.put_s3_object(s3, bucket_name, index_key, base.dump_json(data), 'application/json')
+	except Exception as ex:
+		log.info(f'Fail to save review index {index_key}.', extra=dict(exception=str(ex)))
+
+def handle_reused_review(event, label):
+	"""
+	复用之前对同一文件内容和规则的评审结果，不调用Bedrock
+	"""
+	commit_id, request_id, number, mode, model, rule_name, reuse_s3key = base.extract_dict(event, 'commit_id, request_id, number, mode, model, rule_name, reuse_s3key')
+	current_timestamp = datetime.datetime.now()
+	model = str(model).lower()
+	if not event.get('task_registered'):
+		try:
+			create_task(commit_id, request_id, number, mode, model)
+		except Exception as ex:
+			raise Exception(f'Fail to create task: {ex}') from ex
+
+	bucket_name = os.getenv('BUCKET_NAME')
+	try:
+		reused = json.loads(base.get_s3_object(s3, bucket_name, reuse_s3key))
+	except Exception as ex:
+		record = update_failure_task(commit_id, request_id, number, mode, f'Fail to load reused result({reuse_s3key}): {ex}', '', '', counter_shards=event.get('counter_shards', 0), task_count=event.get('task_count'))
+		if record:
+			task_base.check_request_progress(record, log)
+		log.error(f'Fail to load reused result for {label}.', extra=dict(exception=str(ex)))
+		return
+
+	now = str(datetime.datetime.now())
+	result = dict(
+		reused,
+		commit_id = commit_id,
+		request_id = request_id,
+		rule = rule_name,
+		timestamp = str(current_timestamp),
+		start_time = now,
+		end_time = now,
+		timecost = 0,
+		ttft = None,
+		parse_timecost = 0,
+		cache_read_tokens = 0,
+		cache_write_tokens = 0,
+		cached = True,
+		reused_from = reuse_s3key,
+	)
+	record = update_complete_task(commit_id, request_id, number, mode, result, counter_shards=event.get('counter_shards', 0), task_count=event.get('task_count'))
+	if record:
+		task_base.check_request_progress(record, log)
+	log.info(f'Review result of {label} is reused from {reuse_s3key}.')
+
 def handle_code_review(record, event, context):
 
 	log.info(event, extra=dict(label='task event'))
 	log.info(context, extra=dict(label='task context'))
 
+	raw_event = event
+	event = load_offloaded_prompt(event)
+	retry_state = event.get('retry_state') or dict()
+
 	request_id = event.get('request_id')
 	number = event.get('number')
 	label = f'task(request_id={request_id}, number={number})'
 	log.info(f'Try to do code review for {label}...')
 
+	# 文件内容和规则都未变化的任务，由task_dispatcher指定了可复用的评审结果
+	if event.get('reuse_s3key'):
+		return handle_reused_review(event, label)
+
 	# 校验SQS Event必要字段
 	validate_sqs_event(event)
 	commit_id, request_id, number, mode, model, prompt_system, prompt_user, confirm_prompt, rule_name = base.extract_dict(event, 'commit_id, request_id, number, mode, model, prompt_system, prompt_user, confirm_prompt, rule_name')
 	current_timestamp = datetime.datetime.now()
 	model = model.lower()
 	
-	try:
-		create_task(commit_id, request_id, number, mode, model)
-	except Exception as ex:
-		raise Exception(f'Fail to create task: {ex}') from ex
+	# 延迟重试的任务记录已存在，不能覆盖其中的重试次数和错误信息；task_dispatcher已批量创建的任务记录也无需再创建
+	if not retry_state and not event.get('task_registered'):
+		try:
+			create_task(commit_id, request_id, number, mode, model)
+		except Exception as ex:
+			raise Exception(f'Fail to create task: {ex}') from ex
+	else:
+		log.info(f'Resume {label} for retry {retry_state.get("current_retry")}.')
+
+	# 完全相同的任务直接使用缓存的评审结果
+	fingerprint = get_prompt_fingerprint(model, prompt_system, prompt_user, confirm_prompt)
+	cached = load_cached_result(fingerprint)
+	if cached:
+		now = str(datetime.datetime.now())
+		result = dict(
+			cached,
+			commit_id = commit_id,
+			request_id = request_id,
+			rule = rule_name,
+			timestamp = str(current_timestamp),
+			start_time = now,
+			end_time = now,
+			timecost = 0,
+			ttft = None,
+			parse_timecost = 0,
+			cache_read_tokens = 0,
+			cache_write_tokens = 0,
+			cached = True,
+			fingerprint = fingerprint,
+		)
+		record = update_complete_task(commit_id, request_id, number, mode, result, counter_shards=event.get('counter_shards', 0), task_count=event.get('task_count'))
+		if event.get('review_index_key'):
+			save_review_index(event['review_index_key'], f'result/{request_id}/{number}.json')
+		if record:
+			task_base.check_request_progress(record, log)
+		log.info(f'Review result of {label} is taken from cache.', extra=dict(fingerprint=fingerprint, cached_from=cached.get('request_id')))
+		return
 
 	prompt_data = dict(
-		context = dict(commit_id = commit_id, request_id = request_id, number = number, mode = mode),
+		context = dict(commit_id = commit_id, request_id = request_id, number = number, mode = mode, counter_shards = event.get('counter_shards', 0), task_count = event.get('task_count')),
 		model=model, 
 		system=prompt_system, 
 		messages=[], 
-		current_retry=0, 
-		max_retry=SQS_MAX_RETRIES
+		cache_prefix=event.get('prompt_cache_prefix', 0),
+		current_retry=retry_state.get('current_retry', 0), 
+		max_retry=SQS_MAX_RETRIES,
+		error_messages=retry_state.get('error_messages', []),
+		early_stop=event.get('early_stop', True),
+		event=raw_event,
 	)
 
 	prompt_data = invoke_and_extract_bedrock(label, prompt_data, prompt_user)
@@ -519,15 +916,27 @@ def handle_code_review(record, event, context):
 		start_time = prompt_data.get('start_time', ''),
 		end_time = prompt_data.get('end_time', ''),
 		timecost = prompt_data.get('timecost', ''),
+		ttft = prompt_data.get('ttft'),
+		parse_timecost = round(prompt_data.get('parse_timecost', 0), 3),	# 解析（含本地修复）JSON的耗时(毫秒)
+		cache_read_tokens = prompt_data.get('cache_read_tokens', 0),
+		cache_write_tokens = prompt_data.get('cache_write_tokens', 0),
 		payload = prompt_data.get('payload', ''),
 		prompt_system = prompt_data.get('system', ''),
 		prompt_user = base.dump_json(prompt_data.get('messages')[::2]),
 		reasoning = prompt_data.get('reasoning', ''),  # New: reasoning content
-		enable_reasoning = prompt_data.get('enable_reasoning', False)  # New: reasoning flag
+		enable_reasoning = prompt_data.get('enable_reasoning', False),  # New: reasoning flag
+		cached = False,
+		fingerprint = fingerprint,
 	)
 
-	update_complete_task(commit_id, request_id, number, mode, result)
-	task_base.check_request_progress_by_pksk(commit_id, request_id, log)
+	# 只缓存成功解析的结果
+	if 'content' in prompt_data:
+		save_cached_result(fingerprint, result)
+	record = update_complete_task(commit_id, request_id, number, mode, result, counter_shards=event.get('counter_shards', 0), task_count=event.get('task_count'))
+	if event.get('review_index_key') and 'content' in prompt_data:
+		save_review_index(event['review_index_key'], f'result/{request_id}/{number}.json')
+	if record:
+		task_base.check_request_progress(record, log)
 	log.info(f'Review result is saved in {label}', extra=dict(label=label, result=result))
 	return 
 		
@@ -548,7 +957,11 @@ def create_task(commit_id, request_id, number, mode, model):
 	except Exception as e:
 		raise Exception (f'Fail to create TASK for commit_id({commit_id}) and mode({mode}).') from e
 	
-def update_complete_task(commit_id, request_id, number, mode, result):
+def update_complete_task(commit_id, request_id, number, mode, result, counter_shards=0, task_count=None):
+	"""
+	保存评审结果并增加Request的完成计数
+	@return 更新后的Request记录，分片计数时请求不可能已完成则返回None
+	"""
 	try:
 
 		# 保存数据到S3
@@ -561,7 +974,7 @@ def update_complete_task(commit_id, request_id, number, mode, result):
 		table_name = os.getenv('TASK_TABLE')
 		dynamodb.Table(table_name).update_item(
 			Key={'request_id': request_id, 'number': number},
-			UpdateExpression='set succ = :s, update_time = :t, bedrock_model = :bm, bedrock_start_time = :bst, bedrock_end_time = :bet, bedrock_timecost = :btc, #d = :d',
+			UpdateExpression='set succ = :s, update_time = :t, bedrock_model = :bm, bedrock_start_time = :bst, bedrock_end_time = :bet, bedrock_timecost = :btc, bedrock_ttft = :btt, parse_timecost = :ptc, cached = :c, bedrock_cache_read_tokens = :bcr, bedrock_cache_write_tokens = :bcw, #d = :d',
 			ExpressionAttributeNames={
 				'#d': 'data'
 			},
@@ -572,21 +985,25 @@ def update_complete_task(commit_id, request_id, number, mode, result):
 				':bst': result.get('start_time'),
 				':bet': result.get('end_time'),
 				':btc': result.get('timecost'),
+				':btt': result.get('ttft'),
+				':ptc': decimal.Decimal(str(result.get('parse_timecost', 0))),
+				':c': result.get('cached', False),
+				':bcr': result.get('cache_read_tokens', 0),
+				':bcw': result.get('cache_write_tokens', 0),
 				':d': s3_key
 			},
 			ReturnValues='ALL_NEW'
 		)
-		# 更新Request表
-		dynamodb.Table(REQUEST_TABLE).update_item(
-			Key = { 'commit_id': commit_id, 'request_id': request_id },
-			UpdateExpression = 'set task_status = :s, task_complete = task_complete + :tc, update_time = :t',
-			ExpressionAttributeValues = { ':s': base.STATUS_PROCESSING, ':tc': 1, ':t': datetime_str },
-			ReturnValues = 'ALL_NEW'
-		)
+		# 更新Request表，返回更新后的记录用于判断是否完成，不需要再读一次
+		return task_base.increment_request_counter(commit_id, request_id, 'task_complete', counter_shards, number, task_count)
 	except Exception as e:
 		raise Exception (f'Fail to update TASK COMPLETE for commit_id({commit_id}) and mode({mode}).') from e
 	
-def update_failure_task(commit_id, request_id, number, mode, error_message, prompt_system, prompt_user, need_retry=False):
+def update_failure_task(commit_id, request_id, number, mode, error_message, prompt_system, prompt_user, need_retry=False, counter_shards=0, task_count=None):
+	"""
+	记录任务失败，不再重试时增加Request的失败计数
+	@return 增加失败计数后更新的Request记录，其余情况（含分片计数时请求不可能已完成）返回None
+	"""
 	try:
 		datetime_str = str(datetime.datetime.now())
 		table_name = os.getenv('TASK_TABLE')
@@ -604,12 +1021,7 @@ def update_failure_task(commit_id, request_id, number, mode, error_message, prom
 			ReturnValues = 'ALL_NEW'
 		)
 		if not need_retry:
-			dynamodb.Table(REQUEST_TABLE).update_item(
-				Key = { 'commit_id': commit_id, 'request_id': request_id },
-				UpdateExpression = 'set task_status = :s, task_failure = task_failure + :tf, update_time = :t',
-				ExpressionAttributeValues = { ':s': base.STATUS_PROCESSING, ':tf': 1, ':t': datetime_str },
-				ReturnValues = 'ALL_NEW'
-			)
+			return task_base.increment_request_counter(commit_id, request_id, 'task_failure', counter_shards, number, task_count)
 	except Exception as ex:
 		log.info(f'Fail to update TASK FAILURE for commit_id({commit_id}) and mode({mode}).', extra=dict(exception=str(ex)))
 
@@ -620,28 +1032,50 @@ def validate_sqs_event(event):
 			raise Exception(f'SQS event does not have field {field} - {event}')
 	return True
 
-def lambda_handler(event, context):
-
-	log.info(event, extra=dict(label='event'))
-	log.info('Receiving {} SQS records'.format(len(event["Records"])))
-
-	batch_item_failures, batch_item_successes = [], []
-	for record in event["Records"]:
-		
-		log.info('Processing SQS record.', extra=dict(record=record))
+def process_record(record):
+	"""
+	处理单条SQS消息
+	@return True表示消息处理完成（含已重新入队延迟重试），False表示处理失败需要SQS重新投递
+	"""
+	log.info('Processing SQS record.', extra=dict(record=record))
 
+	try:
 		base64_text = record["body"]
 		body_text = base.decode_base64(base64_text)
 		log.info(body_text, extra=dict(label='plain body'))
 		
 		sqs_event = json.loads(body_text)
 		sqs_context = sqs_event.get('context', {})
+
+		# task_dispatcher安排的请求超时检查
+		if sqs_event.get('type') == task_base.DEADLINE_MESSAGE_TYPE:
+			task_base.handle_request_deadline(sqs_event, log)
+			return True
 	
-		try:
-			handle_code_review(record, sqs_event, sqs_context)
+		handle_code_review(record, sqs_event, sqs_context)
+		return True
+	except RetryScheduled as ex:
+		# 已重新入队延迟重试，删除当前消息
+		log.info(str(ex))
+		return True
+	except Exception as ex:
+		log.info(f'Fail to check code review result.', extra=dict(exception=str(ex)))
+		return False
+
+def lambda_handler(event, context):
+
+	log.info(event, extra=dict(label='event'))
+	records = event["Records"]
+	log.info('Receiving {} SQS records'.format(len(records)))
+
+	# 并发处理同一批次的消息，整批耗时接近最慢的单个评审
+	results = base.map_concurrently(process_record, records, max_workers=EXECUTOR_CONCURRENCY)
+
+	batch_item_failures, batch_item_successes = [], []
+	for record, succ in zip(records, results):
+		if succ is True:
 			batch_item_successes.append({"itemIdentifier": record['messageId']})
-		except Exception as ex:
-			log.info(f'Fail to check code review result.', extra=dict(exception=str(ex)))
+		else:
 			batch_item_failures.append({"itemIdentifier": record['messageId']})
 
 	batch_response = dict(batchItemSeccesses = batch_item_successes, batchItemFailures = batch_item_failures)
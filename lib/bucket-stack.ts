@@ -1,3 +1,4 @@
+import { Duration } from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import { Bucket, BucketEncryption, BlockPublicAccess } from 'aws-cdk-lib/aws-s3';
 import * as s3deploy from 'aws-cdk-lib/aws-s3-deployment';
@@ -31,6 +32,16 @@ export class CRBucket extends Construct {
 			versioned: true,
 			serverAccessLogsBucket: access_logs_bucket,
 			serverAccessLogsPrefix: 'logs/',
+			lifecycleRules: [
+				// 评审结果缓存，task_executor按RESULT_CACHE_TTL判断是否过期，这里负责清理
+				{ prefix: 'cache/result/', expiration: Duration.days(7), noncurrentVersionExpiration: Duration.days(1) },
+				// single模式的评审索引，长期未变化的文件重新评审一次即可
+				{ prefix: 'cache/review-index/', expiration: Duration.days(30), noncurrentVersionExpiration: Duration.days(1) },
+				// 按blob SHA缓存的文件内容，过期后按需重新下载
+				{ prefix: 'cache/blob/', expiration: Duration.days(30), noncurrentVersionExpiration: Duration.days(1) },
+				// 转存到S3的任务提示词，保留时间超过SQS消息的保留期(默认4天)即可
+				{ prefix: 'prompt/', expiration: Duration.days(7), noncurrentVersionExpiration: Duration.days(1) },
+			],
 		})
 
 		new s3deploy.BucketDeployment(this, 'DeployWebToolFiles', {
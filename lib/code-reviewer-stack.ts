@@ -153,6 +153,11 @@ export class CodeReviewerStack extends cdk.Stack {
 		api.task_dispatcher.addEnvironment('TASK_SQS_URL', sqs.task_queue.queueUrl)
 		api.task_dispatcher.addEnvironment('SNS_TOPIC_ARN', sns.report_topic.topicArn)
 		api.task_dispatcher.addEnvironment('ACCESS_TOKEN', access_token.valueAsString)
+		api.task_dispatcher.addEnvironment('FETCH_CONCURRENCY', '16')
+		api.task_dispatcher.addEnvironment('PROJECT_FETCH_MODE', 'archive')
+		api.task_dispatcher.addEnvironment('COUNTER_SHARDS', '0')
+		api.task_dispatcher.addEnvironment('REPORT_TIMEOUT_SECONDS', '900')
+		api.task_dispatcher.addEnvironment('MAX_TOKEN_TO_SAMPLE', '10000')
 
 		api.task_executor.addEnvironment('BUCKET_NAME', buckets.report_bucket.bucketName)
 		api.task_executor.addEnvironment('REQUEST_TABLE', database.request_table.tableName)
@@ -165,6 +170,13 @@ export class CodeReviewerStack extends cdk.Stack {
 		api.task_executor.addEnvironment('TEMPERATURE', '0')
 		api.task_executor.addEnvironment('TOP_P', '1')
 		api.task_executor.addEnvironment('MAX_TOKEN_TO_SAMPLE', '10000')
+		api.task_executor.addEnvironment('PROMPT_CACHE', 'true')
+		api.task_executor.addEnvironment('BEDROCK_STREAMING', 'true')
+		api.task_executor.addEnvironment('RESULT_CACHE_TTL', `${7 * 24 * 3600}`)
+		api.task_executor.addEnvironment('BEDROCK_MAX_POOL_CONNECTIONS', '10')
+		api.task_executor.addEnvironment('RATE_LIMIT_TABLE', database.rate_table.tableName)
+		api.task_executor.addEnvironment('RATE_LIMIT_RPM', '60')
+		api.task_executor.addEnvironment('EXECUTOR_CONCURRENCY', '10')
 		api.task_executor.addEnvironment('MAX_FAILED_TIMES', '6')
 		api.task_executor.addEnvironment('REPORT_TIMEOUT_SECONDS', '900')
 		api.task_executor.addEnvironment('BEDROCK_ACCESS_KEY', bedrock_access_key.valueAsString)
@@ -189,11 +201,14 @@ export class CodeReviewerStack extends cdk.Stack {
 		cron.cron_func.addEnvironment('TASK_TABLE', database.task_table.tableName)
 		cron.cron_func.addEnvironment('SNS_TOPIC_ARN', sns.report_topic.topicArn)
 		cron.cron_func.addEnvironment('REPORT_TIMEOUT_SECONDS', `900`)
+		cron.cron_func.addEnvironment('CRON_MAX_ITEMS', '50')
+		cron.cron_func.addEnvironment('CRON_CONCURRENCY', '8')
 
 		/* 权限配置 */
 		buckets.report_bucket.grantReadWrite(api.task_dispatcher)
 		buckets.report_bucket.grantReadWrite(api.task_executor)
 		buckets.report_bucket.grantRead(api.result_checker)
+		buckets.report_bucket.grantReadWrite(cron.cron_func)
 		
 		database.request_table.grantReadWriteData(api.request_handler)
 		database.request_table.grantReadData(api.result_checker)
@@ -202,9 +217,11 @@ export class CodeReviewerStack extends cdk.Stack {
 		database.request_table.grantReadWriteData(cron.cron_func)
 
 		database.task_table.grantReadWriteData(api.task_executor)
-		database.task_table.grantReadData(api.task_dispatcher)
+		database.task_table.grantReadWriteData(api.task_dispatcher)
 		database.task_table.grantReadData(api.result_checker)
 		database.task_table.grantReadData(cron.cron_func)
+
+		database.rate_table.grantReadWriteData(api.task_executor)
 		
 		sqs.task_queue.grantSendMessages(api.task_dispatcher)
 		sqs.task_queue.grantSendMessages(api.task_executor)
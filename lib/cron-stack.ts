@@ -21,9 +21,9 @@ export class CRCron extends Construct {
 			timeout: cdk.Duration.seconds(30),
 		})
 
-		/* EventBridge定时触发的规则 */
+		/* EventBridge定时触发的规则，超时由task_dispatcher安排的SQS延迟消息处理，这里只作兜底 */
 		const rule = new events.Rule(this, 'CronRule', {
-			schedule: events.Schedule.rate(cdk.Duration.minutes(1)),
+			schedule: events.Schedule.rate(cdk.Duration.minutes(15)),
 		});
 		rule.addTarget(new targets.LambdaFunction(this.cron_func));
 
@@ -8,6 +8,7 @@ export class CRDatabase extends Construct {
   
 	public readonly request_table: dynamodb.Table;
 	public readonly task_table: dynamodb.Table;
+	public readonly rate_table: dynamodb.Table;
 
 	constructor(scope: Construct, id: string, props: { prefix: string }) {
 		super(scope, id);
@@ -40,6 +41,15 @@ export class CRDatabase extends Construct {
 			stream: dynamodb.StreamViewType.NEW_IMAGE,
 			pointInTimeRecovery: true,
 		})
+
+		/* Rate Limit Table，保存每个模型的Bedrock调用令牌桶 */
+		this.rate_table = new dynamodb.Table(this, 'RateLimitTable', {
+			tableName: `${props.prefix}-rate-limit`,
+			partitionKey: { name: 'model', type: dynamodb.AttributeType.STRING },
+			billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+			encryption: dynamodb.TableEncryption.AWS_MANAGED,
+			pointInTimeRecovery: true,
+		})
 		
 	}
 
@@ -6,6 +6,7 @@ Mock仓库管理器
 
 import json
 import difflib
+import hashlib
 from pathlib import Path
 from typing import Dict, List, Optional, Any
 from unittest.mock import Mock
@@ -20,6 +21,12 @@ except ImportError:
             self.response_code = response_code
 
 
+def git_blob_sha(content: str) -> str:
+    """按git规则计算文件内容的blob SHA"""
+    data = content.encode('utf-8')
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
 class MockRepositoryManager:
     """Mock仓库管理器，用于模拟GitLab Project对象的行为"""
     
@@ -200,6 +207,8 @@ class MockRepositoryManager:
         
         file_mock = Mock()
         file_mock.content = content.encode('utf-8')
+        file_mock.decode.return_value = content.encode('utf-8')
+        file_mock.blob_id = git_blob_sha(content)
         file_mock.save = Mock()
         return file_mock
     
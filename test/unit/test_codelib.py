@@ -0,0 +1,200 @@
+"""
+codelib.py 单元测试
+
+测试目标：验证仓库抽象层中与仓库源无关的公共逻辑
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import codelib
+
+
+class TestCodelib:
+    """codelib.py 测试类"""
+
+    def setup_method(self):
+        codelib._blob_cache.clear()
+        codelib._tree_cache.clear()
+        codelib._tree_locks.clear()
+
+    def test_read_blob_through_cache(self):
+        """
+        测试目的：验证按blob SHA读取文件时的两级缓存
+
+        测试场景：同一个blob被多次读取，S3缓存中已有另一个blob
+        业务重要性：内容未变化的文件不应被重复下载，减少代码仓库API调用
+
+        测试流程：
+        1. 第一次读取未缓存的blob，S3未命中，调用fetch并回写S3
+        2. 第二次读取同一个blob，直接命中进程内缓存
+        3. 读取S3中已有的blob，不调用fetch
+        4. fetch返回None时不写入缓存
+
+        期望结果：
+        - 每个blob最多调用一次fetch
+        - 下载结果被写入S3
+        - 失败结果不被缓存
+        """
+        s3_store = {'cache/blob/sha-in-s3': 'cached in s3'}
+
+        def get_s3_object(s3, bucket, key):
+            if key not in s3_store:
+                raise codelib.s3.meta.client.exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            return s3_store[key]
+
+        def put_s3_object(s3, bucket, key, text, content_type):
+            s3_store[key] = text
+
+        fetch = Mock(return_value='fresh content')
+        with patch.dict(os.environ, {'BUCKET_NAME': 'test-bucket'}), \
+             patch('codelib.base.get_s3_object', side_effect=get_s3_object), \
+             patch('codelib.base.put_s3_object', side_effect=put_s3_object):
+
+            assert codelib.read_blob('sha-new', fetch) == 'fresh content'
+            assert codelib.read_blob('sha-new', fetch) == 'fresh content'
+            assert fetch.call_count == 1, "同一个blob只应下载一次"
+            assert s3_store['cache/blob/sha-new'] == 'fresh content', "下载结果应写入S3缓存"
+
+            fetch_s3 = Mock()
+            assert codelib.read_blob('sha-in-s3', fetch_s3) == 'cached in s3'
+            fetch_s3.assert_not_called()
+
+            fetch_none = Mock(return_value=None)
+            assert codelib.read_blob('sha-missing', fetch_none) is None
+            assert codelib.read_blob('sha-missing', fetch_none) is None
+            assert fetch_none.call_count == 2, "获取失败的结果不应被缓存"
+            assert 'cache/blob/sha-missing' not in s3_store
+
+    def test_read_blob_without_sha(self):
+        """
+        测试目的：验证无法解析blob SHA时退化为直接下载
+
+        期望结果：
+        - 每次都调用fetch，且不访问S3
+        """
+        fetch = Mock(return_value='content')
+        with patch('codelib.base.get_s3_object') as mock_get:
+            assert codelib.read_blob(None, fetch) == 'content'
+            assert codelib.read_blob(None, fetch) == 'content'
+        assert fetch.call_count == 2
+        mock_get.assert_not_called()
+
+    def test_blob_shas_resolved_once_per_commit(self):
+        """
+        测试目的：验证并发解析同一提交时，文件树只下载一次，且缓存按仓库区分
+
+        测试场景：多个线程同时解析同一提交的文件树，缓存初始为空
+        业务重要性：每个线程各自下载完整的递归文件树，会抵消按blob SHA缓存节省的API调用；
+        不同仓库可能包含相同的提交ID（如fork），不能共用文件树
+
+        测试流程：
+        1. 多个线程并发调用get_blob_shas
+        2. 另一个项目解析相同的提交ID
+        3. 使用分支名调用get_blob_shas
+        4. 文件树获取失败
+
+        期望结果：
+        - 完整提交ID的文件树在同一项目中只下载一次
+        - 不同项目各自下载文件树
+        - 分支名不缓存，获取失败时返回空字典
+        """
+        commit_id = 'a' * 40
+        project = Mock(id=1)
+        project.repository_tree.return_value = [
+            {'path': 'src/A.java', 'type': 'blob', 'id': 'sha-a'},
+            {'path': 'src', 'type': 'tree', 'id': 'sha-src'},
+        ]
+        repo_context = {'source': 'gitlab', 'project': project}
+
+        results = codelib.base.map_concurrently(lambda i: codelib.get_blob_shas(repo_context, commit_id), range(8), max_workers=8)
+        assert results == [{'src/A.java': 'sha-a'}] * 8
+        assert project.repository_tree.call_count == 1, "文件树应只下载一次"
+        assert codelib._tree_locks == {}, "解析完成后应释放按key创建的锁"
+
+        fork = Mock(id=2)
+        fork.repository_tree.return_value = [{'path': 'src/A.java', 'type': 'blob', 'id': 'sha-fork'}]
+        assert codelib.get_blob_shas({'source': 'gitlab', 'project': fork}, commit_id) == {'src/A.java': 'sha-fork'}
+        assert codelib.get_blob_shas(repo_context, commit_id) == {'src/A.java': 'sha-a'}
+
+        codelib.get_blob_shas(repo_context, 'main')
+        codelib.get_blob_shas(repo_context, 'main')
+        assert project.repository_tree.call_count == 3, "分支名对应的文件树会变化，不应缓存"
+
+        project.repository_tree.side_effect = Exception('forbidden')
+        assert codelib.get_blob_shas(repo_context, 'b' * 40) == {}
+
+    def test_get_repository_file_without_blob_shas(self):
+        """
+        测试目的：验证未提供文件树时直接下载单个文件，并用响应中的blob SHA写入缓存
+
+        测试场景：GitLab和GitHub仓库各获取一个文件，调用方未预先解析文件树
+        业务重要性：为单个文件列出整个递归文件树，API开销远大于直接下载该文件
+
+        测试流程：
+        1. 不传blob_shas调用get_repository_file
+        2. 用响应中的blob SHA读取缓存
+
+        期望结果：
+        - 不调用repository_tree/get_git_tree
+        - 下载的内容按blob SHA写入缓存，后续按SHA读取不再下载
+        """
+        commit_id = 'a' * 40
+        project = Mock(id=1)
+        project.files.get.return_value = Mock(blob_id='sha-a', **{'decode.return_value': b'class A {}'})
+        repository = Mock(full_name='owner/repo')
+        repository.get_contents.return_value = Mock(type='file', sha='sha-b', decoded_content=b'class B {}')
+
+        with patch.dict(os.environ, {'BUCKET_NAME': ''}):
+            assert codelib.get_repository_file({'source': 'gitlab', 'project': project}, 'src/A.java', commit_id) == 'class A {}'
+            assert codelib.get_repository_file({'source': 'github', 'project': repository}, 'src/B.java', commit_id) == 'class B {}'
+
+            fetch = Mock()
+            assert codelib.read_blob('sha-a', fetch) == 'class A {}'
+            assert codelib.read_blob('sha-b', fetch) == 'class B {}'
+            fetch.assert_not_called()
+
+        project.files.get.assert_called_once_with(file_path='src/A.java', ref=commit_id)
+        project.repository_tree.assert_not_called()
+        repository.get_git_tree.assert_not_called()
+
+    def test_init_repo_context_cached(self):
+        """
+        测试目的：验证仓库上下文在有效期内被复用
+
+        测试场景：同一仓库和token在Lambda热启动时多次初始化上下文
+        业务重要性：每次重新创建客户端并获取项目信息会增加webhook延迟
+
+        测试流程：
+        1. 连续两次用相同参数初始化上下文
+        2. 使用不同token初始化上下文
+        3. 缓存过期后再次初始化上下文
+
+        期望结果：
+        - 相同参数在有效期内只创建一次客户端
+        - token不同或缓存过期时重新创建
+        """
+        codelib._context_cache.clear()
+        params = dict(source='gitlab', repo_url='https://gitlab.example.com', project_id=123, private_token='token-a')
+
+        with patch('codelib.gitlab_code.init_gitlab_context', side_effect=lambda url, pid, token: Mock(name=token)) as mock_init, \
+             patch('codelib.time.time', return_value=1000):
+            first = codelib.init_repo_context(params)
+            second = codelib.init_repo_context(dict(params))
+            assert mock_init.call_count == 1, "相同参数应复用缓存的上下文"
+            assert first['project'] is second['project']
+            assert first is not second, "每次应返回新的上下文字典"
+
+            codelib.init_repo_context(dict(params, private_token='token-b'))
+            assert mock_init.call_count == 2, "token不同时不应复用缓存"
+
+        with patch('codelib.gitlab_code.init_gitlab_context', return_value=Mock()) as mock_init, \
+             patch('codelib.time.time', return_value=1000 + codelib.CONTEXT_CACHE_TTL + 1):
+            codelib.init_repo_context(params)
+            assert mock_init.call_count == 1, "缓存过期后应重新创建上下文"
+        codelib._context_cache.clear()
@@ -0,0 +1,178 @@
+"""
+cron_function.py 单元测试
+
+测试目标：验证兜底扫描分页、并发执行，且每次执行的工作量有上限
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+import copy
+import datetime
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+from botocore.exceptions import ClientError
+import cron_function
+
+
+def make_table(items, store):
+    """
+    Mock请求表：按ExclusiveStartKey中的request_id定位分页起点，检查点保存在store中
+    """
+    def query(**params):
+        rows = items[params['ExpressionAttributeValues'][':s']]
+        start_key = params.get('ExclusiveStartKey')
+        start = [row['request_id'] for row in rows].index(start_key['request_id']) + 1 if start_key else 0
+        page = rows[start:start + params['Limit']]
+        response = {'Items': page}
+        if start + len(page) < len(rows):
+            response['LastEvaluatedKey'] = cron_function.get_index_key(page[-1])
+        return response
+
+    table = Mock()
+    table.query.side_effect = query
+    table.get_item.side_effect = lambda Key, ConsistentRead: {'Item': store.get('checkpoint')} if 'checkpoint' in store else {}
+    table.put_item.side_effect = lambda Item: store.__setitem__('checkpoint', copy.deepcopy(Item))
+    return table
+
+
+def make_items(status, count, prefix, create_time=None):
+    create_time = create_time or str(datetime.datetime.now())
+    return [dict(commit_id='c', request_id=f'{prefix}{i}', task_status=status, create_time=create_time) for i in range(count)]
+
+
+class TestCronFunction:
+    """cron_function.py 测试类"""
+
+    def test_bounded_sweep_with_checkpoint(self):
+        """
+        测试目的：验证每次执行最多检查CRON_MAX_ITEMS个请求，并从上一次结束的位置继续
+
+        测试场景：积压了大量未完成的请求
+        业务重要性：逐个串行检查并生成报告会超过cron的30秒超时，每次都从头扫描则后面的请求永远得不到处理
+
+        测试流程：
+        1. Processing状态有3条请求，分页返回，每次最多处理2条
+        2. 第一次执行，保存扫描位置
+        3. 第二次执行，从保存的位置继续，并扫描Start状态
+
+        期望结果：
+        - 第一次只检查2条请求，并保存Processing状态的扫描位置
+        - 第二次从保存的位置继续，扫描到末尾后清除该位置
+        - 单个请求检查失败不影响其他请求
+        """
+        items = {'Processing': make_items('Processing', 3, 'p'), 'Start': make_items('Start', 1, 's')}
+        store = {}
+
+        checked = []
+        def check_request_progress(item, log):
+            checked.append(item['request_id'])
+            if item['request_id'] == 'p1':
+                raise Exception('report failed')
+
+        with patch('cron_function.dynamodb') as mock_dynamodb, \
+             patch('cron_function.CRON_MAX_ITEMS', 2), \
+             patch('cron_function.task_base.check_request_progress', side_effect=check_request_progress):
+            mock_dynamodb.Table.return_value = make_table(items, store)
+
+            cron_function.lambda_handler({}, None)
+            assert sorted(checked) == ['p0', 'p1'], "每次最多检查CRON_MAX_ITEMS个请求"
+            assert store['checkpoint']['cursors'] == {'Processing': cron_function.get_index_key(items['Processing'][1])}
+
+            checked.clear()
+            cron_function.lambda_handler({}, None)
+            assert sorted(checked) == ['p2', 's0'], "应从上一次的位置继续，并处理其他状态"
+            assert store['checkpoint']['cursors'] == {}, "扫描到末尾后应清除扫描位置"
+
+            context = Mock()
+            context.get_remaining_time_in_millis.return_value = 1000
+            checked.clear()
+            cron_function.lambda_handler({}, context)
+            assert checked == [], "剩余执行时间不足时不应读取新的请求"
+
+    def test_time_budget_checked_per_request(self):
+        """
+        测试目的：验证每个请求开始检查前都确认剩余执行时间，并保存最后一个检查完的请求之后的位置
+
+        测试场景：第一页包含CRON_MAX_ITEMS个请求，每个请求都可能生成完整的报告
+        业务重要性：只在分页之间检查时间时，一页请求就会使cron超时，检查点没有保存，之后每次都重复处理同样的请求
+
+        测试流程：
+        1. 一页有5条请求，检查完2条后剩余时间不足
+        2. 再次执行
+
+        期望结果：
+        - 时间不足后不再开始新的检查
+        - 检查点保存在第2条请求的位置
+        - 再次执行时从第3条请求继续
+        """
+        items = {'Processing': make_items('Processing', 5, 'p'), 'Start': []}
+        store = {}
+        checked = []
+        remaining = [60000]
+
+        def check_request_progress(item, log):
+            checked.append(item['request_id'])
+            if item['request_id'] == 'p1':
+                remaining[0] = 1000
+
+        context = Mock()
+        context.get_remaining_time_in_millis.side_effect = lambda: remaining[0]
+        with patch('cron_function.dynamodb') as mock_dynamodb, \
+             patch('cron_function.CRON_CONCURRENCY', 1), \
+             patch('cron_function.task_base.check_request_progress', side_effect=check_request_progress):
+            mock_dynamodb.Table.return_value = make_table(items, store)
+
+            cron_function.lambda_handler({}, context)
+            assert checked == ['p0', 'p1'], "剩余时间不足后不应开始新的检查"
+            assert store['checkpoint']['cursors'] == {'Processing': cron_function.get_index_key(items['Processing'][1])}
+
+            checked.clear()
+            remaining[0] = 60000
+            cron_function.lambda_handler({}, context)
+            assert checked == ['p2', 'p3', 'p4'], "应从最后一个检查完的请求之后继续"
+            assert store['checkpoint']['cursors'] == {}
+
+    def test_expired_or_invalid_cursor_reset(self):
+        """
+        测试目的：验证扫描位置移出查询时间范围或查询失败时，扫描位置被重置
+
+        测试场景：检查点中的请求已超过CRON_SCAN_HOURS，不再满足create_time的查询条件
+        业务重要性：DynamoDB会拒绝不满足键条件的ExclusiveStartKey，检查点无法更新时cron会一直失败
+
+        测试流程：
+        1. 检查点中Processing状态的位置已过期
+        2. 检查点中Start状态的位置导致查询失败
+
+        期望结果：
+        - 过期的位置不作为ExclusiveStartKey，从头扫描
+        - 查询失败的状态的位置被清除，不影响其他状态
+        - 检查点被保存
+        """
+        expired = str(datetime.datetime.now() - datetime.timedelta(hours=cron_function.CRON_SCAN_HOURS + 1))
+        items = {'Processing': make_items('Processing', 2, 'p'), 'Start': make_items('Start', 1, 's')}
+        store = {'checkpoint': {'cursors': {
+            'Processing': dict(commit_id='c', request_id='old', task_status='Processing', create_time=expired),
+            'Start': cron_function.get_index_key(items['Start'][0]),
+        }}}
+        table = make_table(items, store)
+        query = table.query.side_effect
+
+        def failing_query(**params):
+            if params['ExpressionAttributeValues'][':s'] == 'Start':
+                raise ClientError({'Error': {'Code': 'ValidationException'}}, 'Query')
+            return query(**params)
+        table.query.side_effect = failing_query
+
+        checked = []
+        with patch('cron_function.dynamodb') as mock_dynamodb, \
+             patch('cron_function.task_base.check_request_progress', side_effect=lambda item, log: checked.append(item['request_id'])):
+            mock_dynamodb.Table.return_value = table
+            cron_function.lambda_handler({}, None)
+
+        assert checked == ['p0', 'p1'], "过期的位置应被丢弃，从头扫描"
+        assert 'ExclusiveStartKey' not in table.query.call_args_list[0].kwargs
+        assert store['checkpoint']['cursors'] == {}, "查询失败的状态应清除扫描位置"
@@ -211,6 +211,98 @@ class TestGitLabCodeMock:
         file_paths = [item['path'] for item in tree]
         assert any("great" in path for path in file_paths), "应该包含great包结构"
 
+    def test_get_project_code_text_concurrent_with_mock(self):
+        """
+        测试目的：验证all模式下并发获取文件内容的正确性
+
+        测试场景：使用多个并发线程获取整个项目的代码，其中一个文件获取失败
+        业务重要性：大仓库依赖并发获取才能在Lambda时限内完成，必须保证输出顺序和失败处理与串行一致
+
+        测试流程：
+        1. 创建Mock Project，并让其中一个文件的获取抛出异常
+        2. 设置并发数后调用get_project_code_text
+        3. 验证输出中文件的顺序与文件树一致
+        4. 验证失败的文件被跳过，其他文件正常输出
+
+        期望结果：
+        - 文件按文件树顺序输出
+        - 失败文件不出现在结果中，且不影响其他文件
+        """
+        import base
+        import gitlab_code
+
+        mock_project = get_mock_gitlab_project("123")
+        latest_commit = "l23456789012345678901234567890123456789"
+        targets = ['src/main/java/**/*.java']
+
+        tree_paths = [item['path'] for item in mock_project.repository_tree(ref=latest_commit, all=True, recursive=True)]
+        expected_paths = base.filter_targets(tree_paths, targets)
+        assert len(expected_paths) > 3, "真实mock数据应该包含多个Java文件"
+        broken_path = expected_paths[1]
+
+        # Mock数据中文件只存放在引入它的commit下，这里直接按路径生成内容
+        def raw(file_path, ref):
+            if file_path == broken_path:
+                raise Exception('Mock network failure')
+            return f'// content of {file_path}'.encode('utf-8')
+        mock_project.files.raw.side_effect = raw
+
+        with patch.object(base, 'FETCH_CONCURRENCY', 4), patch.object(base, 'PROJECT_FETCH_MODE', 'api'):
+            text = gitlab_code.get_project_code_text(mock_project, latest_commit, targets)
+
+        output_paths = [path for path in expected_paths if f'{path}\n```' in text]
+        assert broken_path not in output_paths, "获取失败的文件应该被跳过"
+        assert output_paths == [path for path in expected_paths if path != broken_path], "其他文件应该全部输出"
+        positions = [text.index(f'{path}\n```') for path in output_paths]
+        assert positions == sorted(positions), "文件应该按文件树顺序输出"
+
+    def test_get_project_code_text_from_archive_with_mock(self):
+        """
+        测试目的：验证all模式通过仓库归档一次性获取代码
+
+        测试场景：Mock的repository_archive返回内存中构造的tar.gz归档
+        业务重要性：归档方式将数千次文件API调用合并为一次下载，避免触发速率限制
+
+        测试流程：
+        1. 构造包含顶层目录、二进制文件和非目标文件的tar.gz归档
+        2. 调用get_project_code_text
+        3. 验证只下载一次归档且没有逐个文件调用files.raw
+        4. 验证输出按target过滤并去掉了顶层目录
+
+        期望结果：
+        - 目标文件按归档顺序输出，路径与仓库文件树一致
+        - 非目标文件和无法解码的文件被跳过
+        """
+        import io
+        import tarfile
+        import base
+        import gitlab_code
+
+        def build_archive(files):
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+                for name, data in files:
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+            return buffer.getvalue()
+
+        archive = build_archive([
+            ('project-abc/src/main/java/A.java', b'class A {}'),
+            ('project-abc/src/main/java/B.java', b'class B {}'),
+            ('project-abc/src/main/java/C.java', b'\xff\xfe\x00'),
+            ('project-abc/README.md', b'# readme'),
+        ])
+        mock_project = Mock()
+        mock_project.repository_archive.return_value = archive
+
+        with patch.object(base, 'PROJECT_FETCH_MODE', 'archive'):
+            text = gitlab_code.get_project_code_text(mock_project, 'abc', ['src/**/*.java'])
+
+        mock_project.repository_archive.assert_called_once_with(sha='abc', format='tar.gz')
+        mock_project.files.raw.assert_not_called()
+        assert text == 'src/main/java/A.java\n```\nclass A {}\n```\n\nsrc/main/java/B.java\n```\nclass B {}\n```'
+
 
 if __name__ == "__main__":
     # 运行测试
@@ -0,0 +1,80 @@
+"""
+json_repair.py 单元测试
+
+测试目标：验证模型输出的JSON在本地被容错解析和修复
+"""
+
+import pytest
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import json_repair
+
+
+class TestJsonRepair:
+    """json_repair.py 测试类"""
+
+    def test_loads_strict_json(self):
+        """
+        测试目的：验证合法JSON走快速路径，不标记为修复
+
+        期望结果：
+        - 解析结果正确，repaired为False
+        - 字符串中的括号、逗号和转义不受影响
+        """
+        text = '[{"title": "SQL注入", "content": "use [x], {y} and \\"z\\""}]'
+        assert json_repair.loads(text) == ([{'title': 'SQL注入', 'content': 'use [x], {y} and "z"'}], False)
+        assert json_repair.loads('  []  ') == ([], False)
+
+    @pytest.mark.parametrize('text, expected', [
+        ('[{"a": 1},]', [{'a': 1}]),
+        ('{"a": 1, "b": [1, 2,],}', {'a': 1, 'b': [1, 2]}),
+        ("[{'title': 'x', 'ok': True, 'n': None}]", [{'title': 'x', 'ok': True, 'n': None}]),
+        ("[{'a': 'it\\'s \"quoted\"'}]", [{'a': 'it\'s "quoted"'}]),
+        ('[{"a": "line1\nline2\tend"}]', [{'a': 'line1\nline2\tend'}]),
+        ('[{"pattern": "\\d+\\s*"}]', [{'pattern': '\\d+\\s*'}]),
+        ('```json\n[{"a": 1}]\n```', [{'a': 1}]),
+        ('{"a":1}\nthanks', {'a': 1}),
+        ("[{'a': True}]\n以上是评审结果 [完]", [{'a': True}]),
+        ('[{"path": "C:\\user\\u12x"}]', [{'path': 'C:\\user\\u12x'}]),
+        ('[{"a": "\\u4e2d\\d"}]', [{'a': '中\\d'}]),
+    ])
+    def test_loads_repairs_common_defects(self, text, expected):
+        """
+        测试目的：验证常见的格式问题在本地被修复
+
+        测试场景：尾逗号、单引号、Python字面量、未转义的换行、非法转义（含不完整的\\u）、代码块包裹、JSON后的说明文字
+        业务重要性：这些小问题以前都会触发一次完整的Bedrock纠错调用
+
+        期望结果：
+        - 解析结果正确，repaired为True
+        """
+        assert json_repair.loads(text) == (expected, True)
+
+    def test_loads_truncated_output(self):
+        """
+        测试目的：验证被截断的输出保留已完整的元素
+
+        测试场景：模型输出达到max_tokens，数组在某个元素中间被截断
+
+        期望结果：
+        - 丢弃最后一个不完整的元素并补全括号
+        - 最外层最后一个完整的标量被保留
+        - 没有任何完整元素时无法修复
+        """
+        assert json_repair.loads('[{"a": 1}, {"b": 2}, {"c": "trunc') == ([{'a': 1}, {'b': 2}], True)
+        assert json_repair.loads('[{"a": 1}, {"b": [1, 2') == ([{'a': 1}], True)
+        assert json_repair.loads('[{"a": 1}') == ([{'a': 1}], True)
+        assert json_repair.loads('{"a": 1, "b": ') == ({'a': 1}, True)
+        assert json_repair.loads('[1, 2, 3') == ([1, 2, 3], True)
+        assert json_repair.loads('["x", "y"') == (['x', 'y'], True)
+        assert json_repair.loads('{"a": 1, "b": 2') == ({'a': 1, 'b': 2}, True)
+        assert json_repair.loads('{"a": 1, "b"') == ({'a': 1}, True)
+
+        with pytest.raises(json_repair.JSONRepairError):
+            json_repair.loads('[{"a": "trunc')
+        with pytest.raises(json_repair.JSONRepairError):
+            json_repair.loads('')
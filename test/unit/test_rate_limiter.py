@@ -0,0 +1,126 @@
+"""
+rate_limiter.py 单元测试
+
+测试目标：验证Bedrock调用的自适应令牌桶限流
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+from botocore.exceptions import ClientError
+import rate_limiter
+
+
+class TestRateLimiter:
+    """rate_limiter.py 测试类"""
+
+    def test_local_token_bucket(self):
+        """
+        测试目的：验证进程内令牌桶的令牌发放与AIMD调整
+
+        测试场景：同一模型连续调用，期间被Bedrock限流
+        业务重要性：大量任务同时调用Bedrock时应平稳地接近配额，而不是集中触发限流后随机退避
+
+        测试流程：
+        1. 连续获取令牌直到桶空，验证需要等待的时间
+        2. 时间推进后令牌按RPM补充
+        3. 调用成功后RPM加性增加，被限流后RPM乘性降低且清空令牌
+
+        期望结果：
+        - 突发请求数不超过桶容量
+        - RPM在上下限之间按AIMD调整
+        """
+        bucket = rate_limiter.LocalTokenBucket()
+        now = [1000.0]
+        with patch('rate_limiter.time.time', side_effect=lambda: now[0]), \
+             patch('rate_limiter.RATE_LIMIT_BURST', 2), \
+             patch('rate_limiter.RATE_LIMIT_RPM', 60):
+
+            assert bucket.try_acquire('claude4-sonnet') == 0
+            assert bucket.try_acquire('claude4-sonnet') == 0
+            assert bucket.try_acquire('claude4-sonnet') == pytest.approx(1), "桶空后应按RPM等待下一个令牌"
+            assert bucket.try_acquire('claude3-haiku') == 0, "不同模型的令牌桶互不影响"
+
+            now[0] += 1
+            assert bucket.try_acquire('claude4-sonnet') == 0, "时间推进后应补充令牌"
+
+            bucket.increase('claude4-sonnet')
+            assert bucket.states['claude4-sonnet']['rpm'] == 60 + rate_limiter.RATE_LIMIT_INCREASE
+
+            now[0] += 10
+            bucket.decrease('claude4-sonnet')
+            assert bucket.states['claude4-sonnet']['rpm'] == (60 + rate_limiter.RATE_LIMIT_INCREASE) * rate_limiter.RATE_LIMIT_DECREASE
+            assert bucket.try_acquire('claude4-sonnet') > 0, "被限流后应清空令牌，且不补回限流前累积的令牌"
+
+            for _ in range(20):
+                bucket.decrease('claude4-sonnet')
+            assert bucket.states['claude4-sonnet']['rpm'] == rate_limiter.RATE_LIMIT_MIN_RPM
+
+    def test_dynamo_token_bucket_writes(self):
+        """
+        测试目的：验证共享令牌桶的AIMD调整不额外增加DynamoDB写入，且限流后从当前时间重新补充令牌
+
+        测试场景：多次调用成功后获取令牌，随后被Bedrock限流
+        业务重要性：每次调用成功都单独写一次DynamoDB会使限流表的写入量翻倍；限流后不更新时间会立刻补回大量令牌
+
+        期望结果：
+        - 调用成功时不写DynamoDB，RPM增量在下一次获取令牌的写入中更新
+        - 限流时以updated为条件，同时清空令牌并更新updated
+        """
+        with patch('base.boto3') as mock_boto3, \
+             patch('rate_limiter.time.time', return_value=1010.0):
+            table = mock_boto3.session.Session.return_value.resource.return_value.Table.return_value
+            bucket = rate_limiter.DynamoTokenBucket('rate-table')
+            item = dict(model='claude4-sonnet', tokens=rate_limiter.to_decimal(0), rpm=rate_limiter.to_decimal(60), updated=rate_limiter.to_decimal(1000))
+            table.get_item.return_value = {'Item': item}
+
+            for _ in range(3):
+                bucket.increase('claude4-sonnet')
+            table.update_item.assert_not_called()
+
+            assert bucket.try_acquire('claude4-sonnet') == 0
+            values = table.update_item.call_args.kwargs['ExpressionAttributeValues']
+            assert float(values[':r']) == 60 + 3 * rate_limiter.RATE_LIMIT_INCREASE, "累积的RPM增量应随获取令牌一并写入"
+            assert bucket.pending['claude4-sonnet'] == 0
+
+            bucket.increase('claude4-sonnet')
+            bucket.decrease('claude4-sonnet')
+            params = table.update_item.call_args.kwargs
+            assert 'updated = :u' in params['ConditionExpression']
+            assert params['ExpressionAttributeValues'][':n'] == rate_limiter.to_decimal(1010.0)
+            assert params['ExpressionAttributeValues'][':z'] == 0
+            assert 'claude4-sonnet' not in bucket.pending, "被限流后应丢弃未写入的增量"
+
+    def test_acquire_waits_or_gives_up(self):
+        """
+        测试目的：验证获取令牌时的等待与放弃
+
+        期望结果：
+        - 等待时间在max_wait内时短暂等待后获取令牌
+        - 超过max_wait时抛出RateLimitExceeded，交给SQS延迟重试
+        """
+        bucket = Mock()
+        bucket.try_acquire.side_effect = [0.5, 0]
+        with patch('rate_limiter.get_bucket', return_value=bucket), \
+             patch('rate_limiter.time.sleep') as mock_sleep:
+            rate_limiter.acquire('claude4-sonnet', max_wait=10)
+            mock_sleep.assert_called_once_with(0.5)
+
+            bucket.try_acquire.side_effect = [60]
+            with pytest.raises(rate_limiter.RateLimitExceeded):
+                rate_limiter.acquire('claude4-sonnet', max_wait=10)
+
+    def test_is_throttling(self):
+        """
+        测试目的：验证只有Bedrock限流异常会触发降速
+        """
+        throttled = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}}, 'InvokeModel')
+        invalid = ClientError({'Error': {'Code': 'ValidationException', 'Message': 'Bad request'}}, 'InvokeModel')
+        assert rate_limiter.is_throttling(throttled)
+        assert not rate_limiter.is_throttling(invalid)
+        assert not rate_limiter.is_throttling(Exception('ThrottlingException'))
@@ -0,0 +1,69 @@
+"""
+report.py 单元测试
+
+测试目标：验证评审报告的结果汇总
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+import json
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import report
+
+
+class TestReport:
+    """report.py 测试类"""
+
+    def test_load_all_results_paginated(self):
+        """
+        测试目的：验证分页读取全部任务并并发读取S3中的评审结果
+
+        测试场景：任务数量超过单次query的1MB限制，分两页返回
+        业务重要性：只读第一页会静默丢失评审结果，逐个读取S3会使报告生成耗时数十秒
+
+        测试流程：
+        1. Mock任务表分两页返回任务，其中包含失败任务和结果读取失败的任务
+        2. 调用load_all_results
+
+        期望结果：
+        - 按LastEvaluatedKey读取所有分页，只投影需要的属性
+        - 只读取成功任务的结果，单个结果读取失败不影响其他结果
+        - 结果按任务顺序汇总，列表结果被展开
+        """
+        pages = [
+            {'Items': [
+                {'request_id': 'r1', 'number': 1, 'succ': True, 'data': 'result/r1/1.json'},
+                {'request_id': 'r1', 'number': 2, 'succ': False},
+            ], 'LastEvaluatedKey': {'request_id': 'r1', 'number': 2}},
+            {'Items': [
+                {'request_id': 'r1', 'number': 3, 'succ': True, 'data': 'result/r1/3.json'},
+                {'request_id': 'r1', 'number': 4, 'succ': True, 'data': 'result/r1/missing.json'},
+                {'request_id': 'r1', 'number': 5, 'succ': True, 'data': 'result/r1/5.json'},
+            ]},
+        ]
+        objects = {
+            'result/r1/1.json': json.dumps({'rule': 'a', 'content': [1]}),
+            'result/r1/3.json': json.dumps([{'rule': 'b', 'content': [3]}, {'rule': 'c', 'content': []}]),
+            'result/r1/5.json': json.dumps({'rule': 'd', 'content': [5]}),
+        }
+
+        mock_table = Mock()
+        mock_table.query.side_effect = pages
+        with patch.dict(os.environ, {'TASK_TABLE': 'task-table', 'BUCKET_NAME': 'test-bucket'}), \
+             patch('report.dynamodb') as mock_dynamodb, \
+             patch('report.base.get_s3_object', side_effect=lambda s3, bucket, key: objects[key]) as mock_get:
+            mock_dynamodb.Table.return_value = mock_table
+            all_data = report.load_all_results('r1')
+
+        assert mock_table.query.call_count == 2, "应读取所有分页"
+        assert mock_table.query.call_args_list[1].kwargs['ExclusiveStartKey'] == {'request_id': 'r1', 'number': 2}
+        params = mock_table.query.call_args_list[0].kwargs
+        assert params['ProjectionExpression'] == '#p0, #p1, #p2, #p3', "只读取生成报告需要的属性"
+        assert [params['ExpressionAttributeNames'][f'#p{i}'] for i in range(4)] == report.REPORT_TASK_FIELDS
+        assert mock_get.call_count == 4, "只读取成功任务的结果"
+        assert [data['rule'] for data in all_data] == ['a', 'b', 'c', 'd'], "结果应按任务顺序汇总"
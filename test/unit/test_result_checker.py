@@ -0,0 +1,72 @@
+"""
+result_checker.py 单元测试
+
+测试目标：验证进度查询接口的分页与任务详情
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+import decimal
+import json
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import result_checker
+
+
+class TestResultChecker:
+    """result_checker.py 测试类"""
+
+    def test_task_summaries_paginated(self):
+        """
+        测试目的：验证默认只分页返回任务摘要，详细信息按number单独获取
+
+        测试场景：大请求的进度页面持续轮询
+        业务重要性：一次返回所有任务并内联S3中的提示词和结果，会超过API Gateway的响应大小和29秒超时
+
+        测试流程：
+        1. 带limit和cursor查询任务列表
+        2. 按number查询单个任务详情
+
+        期望结果：
+        - 列表查询带有Limit、ExclusiveStartKey和投影，不读取S3
+        - 返回下一页的cursor
+        - 详情查询内联S3中的提示词和评审结果
+        """
+        request_table, task_table = Mock(), Mock()
+        request_table.get_item.return_value = {'Item': {'task_total': 3, 'task_complete': 1, 'task_failure': 0, 'task_status': 'Processing'}}
+        task_table.query.return_value = {
+            'Items': [{'request_id': 'r1', 'number': decimal.Decimal(3)}],
+            'LastEvaluatedKey': {'request_id': 'r1', 'number': decimal.Decimal(3)},
+        }
+        task_table.get_item.return_value = {'Item': {'request_id': 'r1', 'number': decimal.Decimal(3), 'succ': True, 'data': 'result/r1/3.json'}}
+        s3_content = json.dumps({'prompt_system': 'sys', 'prompt_user': '["user"]', 'payload': '{}', 'content': [1]})
+
+        with patch.object(result_checker, 'REQUEST_TABLE', 'request-table'), \
+             patch.object(result_checker, 'TASK_TABLE', 'task-table'), \
+             patch('result_checker.dynamodb') as mock_dynamodb, \
+             patch('result_checker.base.get_s3_object', return_value=s3_content) as mock_get:
+            mock_dynamodb.Table.side_effect = lambda name: request_table if name == 'request-table' else task_table
+
+            event = {'queryStringParameters': {'commit_id': 'c1', 'request_id': 'r1', 'limit': '2', 'cursor': '2'}}
+            body = json.loads(result_checker.lambda_handler(event, None)['body'])
+            assert body['succ'] is True and body['ready'] is False
+            assert body['next_cursor'] == '3'
+            params = task_table.query.call_args.kwargs
+            assert params['Limit'] == 2
+            assert params['ExclusiveStartKey'] == {'request_id': 'r1', 'number': decimal.Decimal(2)}
+            assert 'ProjectionExpression' in params
+            mock_get.assert_not_called()
+
+            event = {'queryStringParameters': {'commit_id': 'c1', 'request_id': 'r1', 'limit': '100000'}}
+            result_checker.lambda_handler(event, None)
+            assert task_table.query.call_args.kwargs['Limit'] == result_checker.TASK_PAGE_MAX
+
+            event = {'queryStringParameters': {'commit_id': 'c1', 'request_id': 'r1', 'number': '3'}}
+            body = json.loads(result_checker.lambda_handler(event, None)['body'])
+            assert body['task']['bedrock_system'] == 'sys'
+            assert body['task']['result'] == s3_content
+            assert task_table.get_item.call_args.kwargs['Key'] == {'request_id': 'r1', 'number': decimal.Decimal(3)}
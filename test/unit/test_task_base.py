@@ -0,0 +1,255 @@
+"""
+task_base.py 单元测试
+
+测试目标：验证请求完成后报告只生成一次
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+import datetime
+import json
+import logging
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+from botocore.exceptions import ClientError
+import task_base
+
+
+class TestTaskBase:
+    """task_base.py 测试类"""
+
+    def test_report_claimed_once(self):
+        """
+        测试目的：验证多个执行器同时发现请求完成时，只有认领成功的一个生成报告
+
+        测试场景：最后几个任务同时完成，各自拿到的计数都已达到总数
+        业务重要性：先更新再读取的方式存在竞争，会导致没有报告或重复生成报告
+
+        测试流程：
+        1. 第一次条件更新成功，第二次条件检查失败
+        2. 两次调用check_request_progress
+        3. 未完成的请求调用check_request_progress
+
+        期望结果：
+        - 报告只生成一次
+        - 认领条件允许超时后重新认领
+        - 未完成的请求不认领报告
+        """
+        record = dict(commit_id='c1', request_id='r1', mode='single', project_name='p',
+                      create_time=str(datetime.datetime.now()), task_total=2, task_complete=1, task_failure=1)
+        conflict = ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+
+        mock_table = Mock()
+        mock_table.update_item.side_effect = [{}, conflict]
+        with patch('task_base.dynamodb') as mock_dynamodb, \
+             patch('task_base.report.generate_report_and_notify') as mock_generate:
+            mock_dynamodb.Table.return_value = mock_table
+            mock_dynamodb.meta.client.exceptions.ConditionalCheckFailedException = ClientError
+
+            task_base.check_request_progress(dict(record), logging.getLogger('test'))
+            task_base.check_request_progress(dict(record), logging.getLogger('test'))
+            assert mock_generate.call_count == 1, "报告只应生成一次"
+            params = mock_table.update_item.call_args.kwargs
+            assert 'attribute_not_exists(report_claimed)' in params['ConditionExpression']
+            assert params['ExpressionAttributeValues'][':stale'] < params['ExpressionAttributeValues'][':now']
+
+            mock_table.update_item.reset_mock()
+            task_base.check_request_progress(dict(record, task_failure=0), logging.getLogger('test'))
+            mock_table.update_item.assert_not_called()
+            assert mock_generate.call_count == 1
+
+    def test_complete_claim_overrides_timeout_claim(self):
+        """
+        测试目的：验证超时后生成过报告的请求，在所有任务完成时仍能立即生成最终报告
+
+        测试场景：请求超时后由超时检查认领并生成报告，随后最后一个任务在REPORT_CLAIM_TIMEOUT内完成
+        业务重要性：完成认领被超时认领挡住时，最终报告要等cron兜底才能生成
+
+        测试流程：
+        1. 超时且未完成的请求检查进度
+        2. 所有任务完成的请求检查进度
+
+        期望结果：
+        - 超时认领记录认领原因，只在未认领或认领过期时成功
+        - 完成认领的条件允许覆盖超时认领
+        """
+        old = str(datetime.datetime.now() - datetime.timedelta(hours=1))
+        record = dict(commit_id='c1', request_id='r1', mode='single', project_name='p',
+                      create_time=old, task_total=2, task_complete=1, task_failure=0)
+
+        mock_table = Mock()
+        with patch('task_base.dynamodb') as mock_dynamodb, \
+             patch('task_base.report.generate_report_and_notify') as mock_generate:
+            mock_dynamodb.Table.return_value = mock_table
+
+            task_base.check_request_progress(dict(record), logging.getLogger('test'))
+            params = mock_table.update_item.call_args.kwargs
+            assert params['ExpressionAttributeValues'][':reason'] == task_base.CLAIM_TIMEOUT
+            assert 'report_claim_reason' not in params['ConditionExpression'], "超时认领不能覆盖其他认领"
+
+            task_base.check_request_progress(dict(record, task_complete=2), logging.getLogger('test'))
+            params = mock_table.update_item.call_args.kwargs
+            assert params['ExpressionAttributeValues'][':reason'] == task_base.CLAIM_COMPLETE
+            assert 'report_claim_reason = :timeout' in params['ConditionExpression'], "完成认领应能覆盖超时认领"
+            assert mock_generate.call_count == 2
+
+    def test_sharded_request_counters(self):
+        """
+        测试目的：验证分片计数模式下计数写入分片记录，并在检查进度时汇总
+
+        测试场景：一个请求有上千个任务，所有执行器更新同一条Request记录
+        业务重要性：单条记录的写入热点会导致update_complete_task被限流
+
+        测试流程：
+        1. 分片模式下增加完成计数
+        2. 汇总Request记录和各分片的计数，其中部分分片需要二次读取
+
+        期望结果：
+        - 计数写入分片记录，分片记录使用不同的分区键，不更新Request记录
+        - 汇总结果包含Request记录和所有分片的计数
+        - 不分片时只使用Request记录上的计数
+        """
+        mock_table = Mock()
+        mock_table.get_item.return_value = {'Item': {'commit_id': 'c1', 'request_id': 'r1', 'counter_shards': 4}}
+        with patch.dict(os.environ, {'REQUEST_TABLE': 'request-table'}), \
+             patch('task_base.dynamodb') as mock_dynamodb, \
+             patch('task_base.random.randrange', return_value=2):
+            mock_dynamodb.Table.return_value = mock_table
+            record = task_base.increment_request_counter('c1', 'r1', 'task_complete', 4)
+            assert record['counter_shards'] == 4
+            params = mock_table.update_item.call_args.kwargs
+            assert params['Key'] == {'commit_id': 'c1#shard-2', 'request_id': 'r1'}
+            assert params['UpdateExpression'].startswith('add task_complete :n')
+
+            unprocessed = {'request-table': {'Keys': [{'commit_id': 'c1#shard-3', 'request_id': 'r1'}]}}
+            mock_dynamodb.batch_get_item.side_effect = [
+                {'Responses': {'request-table': [{'task_complete': 3}, {'task_complete': 2, 'task_failure': 1}]}, 'UnprocessedKeys': unprocessed},
+                {'Responses': {'request-table': [{'task_failure': 2}]}, 'UnprocessedKeys': {}},
+            ]
+            record = dict(commit_id='c1', request_id='r1', task_complete=0, task_failure=1, counter_shards=4)
+            assert task_base.get_request_counters(record) == (5, 4)
+            keys = mock_dynamodb.batch_get_item.call_args_list[0].kwargs['RequestItems']['request-table']['Keys']
+            assert len(keys) == 4
+            assert mock_dynamodb.batch_get_item.call_args_list[1].kwargs['RequestItems'] == unprocessed
+
+            mock_dynamodb.batch_get_item.reset_mock()
+            assert task_base.get_request_counters(dict(task_complete=2, task_failure=1)) == (2, 1)
+            mock_dynamodb.batch_get_item.assert_not_called()
+
+    def test_sharded_counter_reads_only_when_shard_done(self):
+        """
+        测试目的：验证分片计数模式下，只有分片上的任务全部结束时才读取Request记录
+
+        测试场景：一个请求有10个任务，分散在4个分片上
+        业务重要性：每个任务都读取Request记录并汇总所有分片，读取次数为任务数乘以分片数，热点从写入转移到了读取
+
+        测试流程：
+        1. 计算各分片的任务数量
+        2. 分片上还有任务未结束时增加计数
+        3. 分片上的最后一个任务结束时增加计数
+
+        期望结果：
+        - 任务按编号对分片数取模分配，各分片的任务数量之和等于任务总数
+        - 分片未结束时不读取Request记录，返回None
+        - 分片结束时读取并返回Request记录
+        """
+        assert [task_base.get_shard_quota(shard, 4, 10) for shard in range(4)] == [2, 3, 3, 2]
+
+        mock_table = Mock()
+        mock_table.get_item.return_value = {'Item': {'commit_id': 'c1', 'request_id': 'r1', 'counter_shards': 4}}
+        with patch('task_base.dynamodb') as mock_dynamodb:
+            mock_dynamodb.Table.return_value = mock_table
+            mock_table.update_item.return_value = {'Attributes': {'task_complete': 1, 'task_failure': 1}}
+            assert task_base.increment_request_counter('c1', 'r1', 'task_complete', 4, 5, 10) is None
+            assert mock_table.update_item.call_args.kwargs['Key'] == {'commit_id': 'c1#shard-1', 'request_id': 'r1'}
+            mock_table.get_item.assert_not_called()
+
+            mock_table.update_item.return_value = {'Attributes': {'task_complete': 2, 'task_failure': 1}}
+            record = task_base.increment_request_counter('c1', 'r1', 'task_failure', 4, 9, 10)
+            assert record['counter_shards'] == 4
+            mock_table.get_item.assert_called_once()
+
+    def test_request_deadline(self):
+        """
+        测试目的：验证请求超时由SQS延迟消息触发，而不是定时扫描整张表
+
+        测试场景：REPORT_TIMEOUT_SECONDS超过SQS的最大延迟，部分任务一直没有完成
+        业务重要性：定时扫描的成本随表的大小增长，且超时检查依赖扫描频率
+
+        测试流程：
+        1. 安排超时检查，延迟超过SQS上限
+        2. 未到超时时间时处理到期消息
+        3. 已超时时处理到期消息
+        4. 请求已完成时处理到期消息
+
+        期望结果：
+        - 延迟被限制在900秒以内
+        - 未到超时时间时按剩余时间再次安排
+        - 已超时时检查进度并生成报告
+        - 已完成的请求不做任何处理
+        """
+        log = logging.getLogger('test')
+        now = datetime.datetime.now()
+        with patch.dict(os.environ, {'TASK_SQS_URL': 'queue-url', 'REQUEST_TABLE': 'request-table', 'REPORT_TIMEOUT_SECONDS': '1800'}), \
+             patch('task_base.sqs_client') as mock_sqs, \
+             patch('task_base.dynamodb') as mock_dynamodb, \
+             patch('task_base.check_request_progress') as mock_check:
+            assert task_base.schedule_request_deadline('c1', 'r1', 1800, log) is True
+            params = mock_sqs.send_message.call_args.kwargs
+            assert params['DelaySeconds'] == 900
+            message = json.loads(task_base.base.decode_base64(params['MessageBody']))
+            assert message == {'type': 'deadline', 'commit_id': 'c1', 'request_id': 'r1'}
+
+            mock_table = mock_dynamodb.Table.return_value
+            record = dict(commit_id='c1', request_id='r1', task_status='Processing', create_time=str(now - datetime.timedelta(seconds=900)))
+            mock_table.get_item.return_value = {'Item': record}
+            task_base.handle_request_deadline(message, log)
+            mock_check.assert_not_called()
+            assert 880 <= mock_sqs.send_message.call_args.kwargs['DelaySeconds'] <= 900, "未到超时时间时应按剩余时间再次安排"
+
+            mock_table.get_item.return_value = {'Item': dict(record, create_time=str(now - datetime.timedelta(seconds=1801)))}
+            task_base.handle_request_deadline(message, log)
+            assert mock_check.call_count == 1
+
+            mock_sqs.send_message.reset_mock()
+            mock_table.get_item.return_value = {'Item': dict(record, task_status='Complete')}
+            task_base.handle_request_deadline(message, log)
+            assert mock_check.call_count == 1
+            mock_sqs.send_message.assert_not_called()
+
+    def test_dynamodb_resource_per_thread(self):
+        """
+        测试目的：验证并发线程各自使用独立的boto3 resource
+
+        测试场景：执行器和定时任务在map_concurrently的工作线程中访问模块级的dynamodb
+        业务重要性：boto3的resource不是线程安全的，多个线程共享同一个resource可能互相干扰
+
+        测试流程：
+        1. 多个线程并发访问task_base.dynamodb
+        2. 同一线程多次访问
+
+        期望结果：
+        - 每个线程创建自己的session和resource
+        - 同一线程内复用已创建的resource
+        """
+        import base
+        import threading
+        resource = base.ThreadLocalResource('dynamodb')
+        barrier = threading.Barrier(4)
+
+        def access(i):
+            barrier.wait(timeout=5)
+            return resource.Table('t'), resource.Table('t')
+
+        with patch('base.boto3') as mock_boto3:
+            mock_boto3.session.Session.side_effect = lambda: Mock()
+            tables = base.map_concurrently(access, range(4), max_workers=4)
+
+        assert mock_boto3.session.Session.call_count == 4, "每个线程应创建独立的session"
+        assert len({id(first) for first, second in tables}) == 4
+        assert all(first is second for first, second in tables), "同一线程应复用resource"
+        assert isinstance(task_base.dynamodb, base.ThreadLocalResource)
@@ -823,10 +823,11 @@ class TestTaskDispatcher:
         
         # 验证默认提示词的生成
         expected_system = '你是一个专业的代码审查助手'
-        expected_user = f'以下是我的代码:\n{test_code}\n请检查代码质量问题\n\n请检查安全漏洞\n\n请检查性能问题'
+        expected_user = f'请检查代码质量问题\n\n请检查安全漏洞\n\n请检查性能问题\n\n以下是我的代码:\n{test_code}'
         
         assert prompt_system == expected_system, "默认系统提示词应该使用system字段"
-        assert prompt_user == expected_user, "默认用户提示词应该按order字段排序组合"
+        assert prompt_user == expected_user, "默认用户提示词应该按order字段排序组合，代码放在最后"
+        assert task_dispatcher.get_prompt_cache_prefix(prompt_user, test_code) == prompt_user.index(test_code), "缓存前缀应截止到代码之前"
         
         # 测试没有order字段的默认提示词
         no_order_rule = {
@@ -889,8 +890,8 @@ class TestTaskDispatcher:
         expected = '检查Java代码的{{issue}}问题，重点关注{{focus}}'  # 缺失的变量保持原样
         assert result == expected, "缺失的变量应该保持原样"
 
-    @patch('task_dispatcher.send_message')
-    def test_task_distribution(self, mock_send_message):
+    @patch('task_dispatcher.send_message_batch')
+    def test_task_distribution(self, mock_send_message_batch):
         """
         测试目的：验证任务数据的正确构造和SQS消息的成功发送
         
@@ -946,8 +947,12 @@ class TestTaskDispatcher:
             }
         ]
         
-        # Mock send_message返回成功
-        mock_send_message.return_value = True
+        # Mock send_message_batch返回成功（没有失败的消息），并记录发送的任务
+        sent_items = []
+        def send_message_batch(messages):
+            sent_items.extend(item for item, body in messages)
+            return []
+        mock_send_message_batch.side_effect = send_message_batch
         
         # 调用send_task_to_sqs函数
         result = task_dispatcher.send_task_to_sqs(
@@ -957,11 +962,12 @@ class TestTaskDispatcher:
         # 验证函数返回成功
         assert result is True, "任务分发应该成功"
         
-        # 验证send_message被调用了正确的次数
-        assert mock_send_message.call_count == 2, "应该发送2个任务到SQS"
+        # 验证任务被批量发送了正确的数量
+        assert mock_send_message_batch.call_count == 1, "2个任务应该在一个批次中发送"
+        assert len(sent_items) == 2, "应该发送2个任务到SQS"
         
         # 验证第一个任务的数据结构
-        first_call_args = mock_send_message.call_args_list[0][0][0]
+        first_call_args = sent_items[0]
         assert first_call_args['context'] == test_event, "任务应该包含原始事件上下文"
         assert first_call_args['commit_id'] == 'commit-abc123', "任务应该包含正确的commit_id"
         assert first_call_args['request_id'] == 'test-request-123', "任务应该包含正确的request_id"
@@ -975,7 +981,7 @@ class TestTaskDispatcher:
         assert first_call_args['confirm_prompt'] == '请确认这个评审结果', "确认提示词应该正确"
         
         # 验证第二个任务的数据结构
-        second_call_args = mock_send_message.call_args_list[1][0][0]
+        second_call_args = sent_items[1]
         assert second_call_args['number'] == 2, "第二个任务的编号应该是2"
         assert second_call_args['filepath'] == 'src/utils.py', "第二个任务文件路径应该正确"
         
@@ -1007,13 +1013,14 @@ class TestTaskDispatcher:
             # 如果DynamoDB表不存在或无权限，跳过这个验证
             print(f"跳过DynamoDB验证: {e}")
         
-        # 测试发送失败的情况
-        mock_send_message.reset_mock()
-        mock_send_message.return_value = False  # 模拟发送失败
+        # 测试发送失败的情况：批量发送全部失败，逐条重试也失败
+        mock_send_message_batch.reset_mock()
+        mock_send_message_batch.side_effect = lambda messages: [item for item, body in messages]
         
-        result = task_dispatcher.send_task_to_sqs(
-            test_event, test_rules, 'test-request-456', 'commit-def456', test_contents
-        )
+        with patch('task_dispatcher.send_message', return_value=False):
+            result = task_dispatcher.send_task_to_sqs(
+                test_event, test_rules, 'test-request-456', 'commit-def456', test_contents
+            )
         
         # 验证即使发送失败，函数仍然返回True（因为这是批量处理）
         assert result is True, "即使部分任务发送失败，函数也应该返回True"
@@ -1498,10 +1505,10 @@ class TestTaskDispatcher:
         - 性能在可接受范围内
         """
         # 测试1：空仓库（没有任何代码文件）
-        with patch('task_dispatcher.codelib.get_project_code_text') as mock_get_project_code_text, \
+        with patch('task_dispatcher.codelib.get_project_code_files') as mock_get_project_code_files, \
              patch('task_dispatcher.codelib.get_involved_files') as mock_get_involved_files:
             
-            mock_get_project_code_text.return_value = None  # 空仓库
+            mock_get_project_code_files.return_value = []  # 空仓库
             mock_get_involved_files.return_value = {}  # 没有变更文件
             
             repo_context = {'project': Mock(name='empty-repo')}
@@ -1636,9 +1643,9 @@ class TestTaskDispatcher:
     @patch('task_dispatcher.codelib.get_rules')
     @patch('task_dispatcher.codelib.get_involved_files')
     @patch('task_dispatcher.codelib.get_repository_file')
-    @patch('task_dispatcher.codelib.get_project_code_text')
+    @patch('task_dispatcher.codelib.get_project_code_files')
     @patch('task_dispatcher.send_message')
-    def test_integration_scenarios(self, mock_send_message, mock_get_project_code_text, 
+    def test_integration_scenarios(self, mock_send_message, mock_get_project_code_files, 
                                  mock_get_repository_file, mock_get_involved_files, 
                                  mock_get_rules, mock_format_commit_id, mock_init_repo_context):
         """
@@ -1759,14 +1766,14 @@ class TestTaskDispatcher:
         mock_get_rules.return_value = mock_rules
         
         # Mock项目代码
-        mock_get_project_code_text.return_value = """
+        mock_get_project_code_files.return_value = [('src/app.py', """
 def main():
     print("Hello World")
     
 class Application:
     def run(self):
         pass
-"""
+""")]
         
         # 执行Webhook流程
         response = task_dispatcher.lambda_handler(webhook_event, {})
@@ -1903,3 +1910,379 @@ class Application:
             
             # 验证响应成功
             assert response['statusCode'] == 200, "无任务流程应该成功执行"
+
+    def test_fetch_plan_shared_by_rules(self):
+        """
+        测试目的：验证一次请求内所有规则共享同一个代码获取计划
+
+        测试场景：一次推送命中多个single/diff规则，target有重叠
+        业务重要性：每个规则各自比较提交、下载文件会成倍增加代码仓库API调用
+
+        测试流程：
+        1. 准备3个single规则和2个diff规则
+        2. 调用make_fetch_plan并用计划生成每个规则的内容
+        3. 验证diff只计算一次，重叠文件只下载一次
+
+        期望结果：
+        - get_involved_files只调用一次
+        - get_repository_file只对single规则命中文件的并集各调用一次
+        - 文件树只解析一次，由所有下载线程共享
+        - 每个规则得到的内容与单独获取时一致
+        """
+        file_diffs = {
+            'src/A.java': 'diff-a',
+            'src/B.java': 'diff-b',
+            'web/index.js': 'diff-index',
+            'README.md': 'diff-readme',
+        }
+        rules = [
+            {'name': 's1', 'mode': 'single', 'target': 'src/*.java'},
+            {'name': 's2', 'mode': 'single', 'target': '**/*.java'},
+            {'name': 's3', 'mode': 'single', 'target': 'web/**'},
+            {'name': 'd1', 'mode': 'diff', 'target': '**'},
+            {'name': 'd2', 'mode': 'diff', 'target': '*.md'},
+        ]
+        repo_context = {'source': 'gitlab', 'project': Mock()}
+
+        blob_shas = {'src/A.java': 'sha-a'}
+        with patch('task_dispatcher.codelib.get_involved_files', return_value=file_diffs) as mock_get_involved_files, \
+             patch('task_dispatcher.codelib.get_blob_shas', return_value=blob_shas) as mock_get_blob_shas, \
+             patch('task_dispatcher.codelib.get_repository_file', side_effect=lambda ctx, path, cid, shas=None: f'code of {path}') as mock_get_file:
+
+            plan = task_dispatcher.make_fetch_plan(repo_context, 'c2', 'c1', rules)
+            contents = {}
+            for rule in rules:
+                if rule['mode'] == 'single':
+                    contents[rule['name']] = task_dispatcher.get_code_contents_for_single(repo_context, 'c2', 'c1', rule, plan=plan)
+                else:
+                    contents[rule['name']] = task_dispatcher.get_code_contents_for_diff(repo_context, 'c2', 'c1', rule, plan=plan)
+
+        assert mock_get_involved_files.call_count == 1, "diff应该只计算一次"
+        fetched = sorted(call.args[1] for call in mock_get_file.call_args_list)
+        assert fetched == ['src/A.java', 'src/B.java', 'web/index.js'], "文件应该只下载一次，且只下载single规则需要的文件"
+        assert mock_get_blob_shas.call_count == 1, "文件树应该只解析一次"
+        assert all(call.args[3] is blob_shas for call in mock_get_file.call_args_list)
+
+        assert [c['filepath'] for c in contents['s2']] == ['src/A.java', 'src/B.java']
+        assert contents['s1'][0]['content'] == 'src/A.java\n```\ncode of src/A.java\n```'
+        assert [c['filepath'] for c in contents['d1']] == list(file_diffs.keys())
+        assert contents['d2'][0]['content'] == 'README.md\n```\ndiff-readme\n```'
+
+        # 只有all模式规则时不需要计算diff
+        with patch('task_dispatcher.codelib.get_involved_files') as mock_get_involved_files:
+            plan = task_dispatcher.make_fetch_plan(repo_context, 'c2', 'c1', [{'name': 'a', 'mode': 'all'}])
+            mock_get_involved_files.assert_not_called()
+            assert plan == dict(file_diffs={}, file_contents={})
+
+    def test_send_task_to_sqs_in_batches(self):
+        """
+        测试目的：验证任务按SendMessageBatch分批并发发送，失败数量汇总后一次性更新
+
+        测试场景：一次推送产生25个任务，其中部分消息批量发送失败
+        业务重要性：逐条发送和逐条更新失败计数会产生数百次串行调用
+
+        测试流程：
+        1. Mock DynamoDB表和SQS客户端
+        2. 第二个批次中有2条消息发送失败，其中1条逐条重试成功
+        3. 调用send_task_to_sqs
+
+        期望结果：
+        - 25个任务分成3个批次（10、10、5）
+        - 只重试批量发送失败的消息
+        - 失败计数只更新一次，数量为1
+        - 未能发送的任务的TASK记录被标记为失败
+        """
+        rule = {'name': 'rule', 'mode': 'diff', 'model': 'claude3-sonnet', 'prompt_user': 'review', 'prompt_system': 'sys'}
+        contents = [dict(mode='diff', filepath=f'f{i}.py', content=f'code {i}', rule=rule) for i in range(25)]
+
+        def send_message_batch(QueueUrl, Entries):
+            if mock_sqs.send_message_batch.call_count == 2:
+                return {'Successful': [], 'Failed': [{'Id': '3', 'SenderFault': False}, {'Id': '7', 'SenderFault': False}]}
+            return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+        mock_table = Mock()
+        mock_table.get_item.return_value = {'Item': {'task_total': 25}}
+        with patch('task_dispatcher.dynamodb') as mock_dynamodb, \
+             patch('task_dispatcher.sqs_client') as mock_sqs, \
+             patch('task_dispatcher.base.FETCH_CONCURRENCY', 1), \
+             patch('task_dispatcher.send_message', side_effect=[True, False]) as mock_send_message, \
+             patch('task_dispatcher.task_base.check_request_progress') as mock_check:
+            mock_dynamodb.Table.return_value = mock_table
+            mock_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+            mock_sqs.send_message_batch.side_effect = send_message_batch
+
+            result = task_dispatcher.send_task_to_sqs({}, [rule], 'req-1', 'commit-1', contents)
+
+        assert result is True
+        sizes = [len(call.kwargs['Entries']) for call in mock_sqs.send_message_batch.call_args_list]
+        assert sizes == [10, 10, 5], "任务应该按每批10条发送"
+        retried = [call.args[0]['number'] for call in mock_send_message.call_args_list]
+        assert retried == [14, 18], "只重试批量发送失败的消息"
+
+        failure_updates = [call for call in mock_table.update_item.call_args_list if 'task_failure = task_failure' in call.kwargs['UpdateExpression']]
+        assert len(failure_updates) == 1, "失败计数只应更新一次"
+        assert failure_updates[0].kwargs['ExpressionAttributeValues'] == {':tf': 1}
+        assert mock_check.call_count == 1, "记录分发失败后应检查一次进度"
+        failed_rows = [r['PutRequest']['Item'] for call in mock_dynamodb.batch_write_item.call_args_list
+                       for r in list(call.kwargs['RequestItems'].values())[0] if r['PutRequest']['Item'].get('succ') is False]
+        assert [row['number'] for row in failed_rows] == [18], "未能发送的任务记录应标记为失败"
+
+    def test_sharded_dispatch_failure_completes_request(self):
+        """
+        测试目的：验证分片计数模式下部分任务发送失败时，其余任务结束后仍按完成认领报告
+
+        测试场景：3个任务分布在2个分片上，其中1个任务发送失败，另外2个任务在分发结束前就已完成
+        业务重要性：发送失败的任务不计入所在分片时，该分片永远达不到任务数量，请求只能等到超时才生成报告
+
+        测试流程：
+        1. 内存中的Request表支持update_item、get_item和batch_get_item
+        2. 第2个任务批量发送和逐条重试都失败，重试时其余任务已经完成
+        3. 调用send_task_to_sqs
+
+        期望结果：
+        - 发送失败计入任务编号所在的分片，不重复计入Request记录
+        - 报告按完成认领并生成一次
+        """
+        from botocore.exceptions import ClientError
+        import re
+        import task_base
+
+        class FakeTable:
+            def __init__(self):
+                self.items = {}
+
+            def get_item(self, Key, ConsistentRead=False):
+                item = self.items.get((Key['commit_id'], Key['request_id']))
+                return {'Item': dict(item)} if item else {}
+
+            def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+                            ConditionExpression=None, ReturnValues=None):
+                names = ExpressionAttributeNames or {}
+                item = self.items.setdefault((Key['commit_id'], Key['request_id']), dict(Key))
+                if ConditionExpression and 'report_claimed' in item:
+                    raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+                for action, body in re.findall(r'(add|set) (.*?)(?= add | set |$)', UpdateExpression):
+                    for clause in body.split(','):
+                        if action == 'add':
+                            field, value = clause.split()
+                            item[field] = item.get(field, 0) + ExpressionAttributeValues[value]
+                            continue
+                        field, expr = [part.strip() for part in clause.split('=')]
+                        field = names.get(field, field)
+                        if '+' in expr:
+                            item[field] = item.get(field, 0) + ExpressionAttributeValues[expr.split('+')[1].strip()]
+                        else:
+                            item[field] = ExpressionAttributeValues[expr]
+                return {'Attributes': dict(item)}
+
+        table = FakeTable()
+        table.items[('commit-1', 'req-1')] = dict(commit_id='commit-1', request_id='req-1', mode='diff', project_name='p',
+                                                  create_time=str(datetime.datetime.now()))
+        fake_dynamodb = Mock()
+        fake_dynamodb.Table.return_value = table
+        fake_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+        fake_dynamodb.meta.client.exceptions.ConditionalCheckFailedException = ClientError
+
+        def batch_get_item(RequestItems):
+            name, request = list(RequestItems.items())[0]
+            rows = [table.get_item(Key=key).get('Item', {}) for key in request['Keys']]
+            return {'Responses': {name: rows}, 'UnprocessedKeys': {}}
+        fake_dynamodb.batch_get_item.side_effect = batch_get_item
+
+        def complete_other_tasks(item):
+            # 重试发送第2个任务之前，第1和第3个任务已经完成
+            for number in (1, 3):
+                record = task_base.increment_request_counter('commit-1', 'req-1', 'task_complete', 2, number, 3)
+                if record:
+                    task_base.check_request_progress(record, task_dispatcher.log)
+            return False
+
+        rule = {'name': 'rule', 'mode': 'diff', 'model': 'claude3-sonnet', 'prompt_user': 'review', 'prompt_system': 'sys'}
+        contents = [dict(mode='diff', filepath=f'f{i}.py', content=f'code {i}', rule=rule) for i in range(3)]
+        with patch.dict(os.environ, {'REQUEST_TABLE': 'request-table', 'TASK_TABLE': 'task-table'}), \
+             patch('task_dispatcher.dynamodb', fake_dynamodb), \
+             patch('task_base.dynamodb', fake_dynamodb), \
+             patch('task_dispatcher.task_base.get_counter_shards', return_value=2), \
+             patch('task_dispatcher.sqs_client') as mock_sqs, \
+             patch('task_dispatcher.send_message', side_effect=complete_other_tasks), \
+             patch('task_base.report.generate_report_and_notify') as mock_generate:
+            mock_sqs.send_message_batch.return_value = {'Successful': [{'Id': '0'}, {'Id': '2'}], 'Failed': [{'Id': '1', 'SenderFault': False}]}
+            assert task_dispatcher.send_task_to_sqs({}, [rule], 'req-1', 'commit-1', contents) is True
+
+        record = table.items[('commit-1', 'req-1')]
+        assert record['task_failure'] == 0, "已编号的失败任务只计入分片"
+        assert table.items[('commit-1#shard-0', 'req-1')]['task_failure'] == 1, "失败应计入任务编号所在的分片"
+        assert record['report_claim_reason'] == 'complete', "应按完成认领报告"
+        assert mock_generate.call_count == 1
+
+    def test_pack_message_batches(self):
+        """
+        测试目的：验证消息按数量和大小限制打包
+
+        期望结果：
+        - 每批不超过10条
+        - 每批总大小不超过256KB，超大消息单独成批
+        """
+        small = [(i, 'x' * 100) for i in range(12)]
+        assert [len(b) for b in task_dispatcher.pack_message_batches(small)] == [10, 2]
+
+        large = [(0, 'x' * 200 * 1024), (1, 'x' * 100 * 1024), (2, 'x' * 300 * 1024), (3, 'x')]
+        assert [[d for d, body in b] for b in task_dispatcher.pack_message_batches(large)] == [[0], [1], [2], [3]]
+
+    def test_chunk_project_files(self):
+        """
+        测试目的：验证all模式按token预算将项目文件分批
+
+        测试场景：项目代码总量超过模型上下文窗口
+        业务重要性：整个项目拼成一个提示词会超过上下文窗口导致评审失败，分批后评审能力随仓库规模扩展
+
+        测试流程：
+        1. 构造分布在多个目录下的文件，按较小的token预算分批
+        2. 构造超过预算的单个目录和单个文件
+        3. 通过get_code_contents_for_all验证每批生成一个任务
+
+        期望结果：
+        - 每批估算的token数不超过预算（单个超大文件除外）
+        - 同一目录的文件尽量在同一批，整体保持文件树顺序
+        - 只有一批时文件路径标识保持不变，多批时带有序号
+        - 预算从上下文窗口中扣除提示词和输出保留的token后计算
+        """
+        def make_file(path, tokens):
+            return (path, 'x' * (tokens * task_dispatcher.CHARS_PER_TOKEN))
+
+        files = [
+            make_file('src/a/A1.java', 30), make_file('src/a/A2.java', 30),
+            make_file('src/b/B1.java', 30), make_file('src/b/B2.java', 30),
+            make_file('src/c/C1.java', 50), make_file('src/c/C2.java', 50), make_file('src/c/C3.java', 50),
+            make_file('src/d/Huge.java', 300),
+            make_file('pom.xml', 10),
+        ]
+        chunks = task_dispatcher.chunk_project_files(files, 100)
+        paths = [ [ path for path, content in chunk ] for chunk in chunks ]
+
+        assert paths == [
+            ['src/a/A1.java', 'src/a/A2.java'],
+            ['src/b/B1.java', 'src/b/B2.java'],
+            ['src/c/C1.java'],
+            ['src/c/C2.java'],
+            ['src/c/C3.java'],
+            ['src/d/Huge.java'],
+            ['pom.xml'],
+        ], "目录放不下时应开启新批次，超大目录按文件拆分，超大文件独占一批"
+        assert [ path for chunk in paths for path in chunk ] == [ path for path, content in files ], "分批后不应丢失或重排文件"
+        assert task_dispatcher.chunk_project_files([], 100) == []
+
+        rule = {'name': '全项目检查', 'mode': 'all', 'target': '**', 'model': 'claude3.7-sonnet'}
+        with patch('task_dispatcher.codelib.get_project_code_files', return_value=files[:2]):
+            contents = task_dispatcher.get_code_contents_for_all({}, 'commit123', rule)
+        assert [ content['filepath'] for content in contents ] == ['<The Whole Project>']
+        assert 'src/a/A1.java' in contents[0]['content'] and 'src/a/A2.java' in contents[0]['content']
+
+        with patch('task_dispatcher.codelib.get_project_code_files', return_value=files), \
+             patch('task_dispatcher.get_chunk_token_budget', return_value=100):
+            contents = task_dispatcher.get_code_contents_for_all({}, 'commit123', rule)
+        assert [ content['filepath'] for content in contents ] == [ f'<The Whole Project> ({i}/7)' for i in range(1, 8) ]
+        assert all(content['mode'] == 'all' and content['rule'] is rule for content in contents)
+
+        budget = task_dispatcher.get_chunk_token_budget(rule)
+        assert budget < (200000 - task_dispatcher.MAX_TOKEN_TO_SAMPLE) * task_dispatcher.CHUNK_CONTEXT_PERCENT // 100, "应为输出和提示词保留token"
+        assert task_dispatcher.get_chunk_token_budget(dict(rule, model='claude-unknown')) == budget, "未知模型应使用默认上下文窗口"
+
+        diy_rule = dict(rule, system='s' * 3000, rule='r' * 30000)
+        prompt_tokens = task_dispatcher.estimate_tokens('s' * 3000) + task_dispatcher.estimate_tokens('r' * 30000 + '\n\n以下是我的代码:\n')
+        assert task_dispatcher.get_chunk_token_budget(diy_rule) == (200000 - prompt_tokens - task_dispatcher.MAX_TOKEN_TO_SAMPLE) * task_dispatcher.CHUNK_CONTEXT_PERCENT // 100, "系统提示词和DIY字段应从预算中扣除"
+
+    def test_reuse_unchanged_single_reviews(self):
+        """
+        测试目的：验证single模式对内容和规则都未变化的文件复用之前的评审结果
+
+        测试场景：合并请求追加提交后，大部分涉及的文件没有变化
+        业务重要性：未变化的文件重复发送给Bedrock会浪费调用配额和费用
+
+        测试流程：
+        1. 生成两个文件的single模式内容，其中一个在评审索引中存在记录
+        2. 调用send_task_to_sqs
+
+        期望结果：
+        - 评审索引key由规则、替换变量后的提示词、确认提示词、文件路径和blob SHA决定，任何一项变化时key不同
+        - 命中索引的任务带有reuse_s3key且不再携带提示词
+        - 未命中的任务正常携带提示词，并带有review_index_key以便评审后记录索引
+        """
+        rule = {'name': 'rule', 'mode': 'single', 'model': 'claude3-sonnet', 'prompt_user': 'review', 'prompt_system': 'sys'}
+        plan = dict(file_diffs={'src/A.java': 'diff A', 'src/B.java': 'diff B'}, file_contents={'src/A.java': 'class A {}', 'src/B.java': 'class B {}'})
+        contents = task_dispatcher.get_code_contents_for_single({}, 'c2', 'c1', dict(rule, target='**'), plan=plan)
+        assert task_dispatcher.base.git_blob_sha('') == 'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391', "blob SHA应与git一致"
+
+        sha_a, sha_b = [ content['blob_sha'] for content in contents ]
+        assert sha_a == task_dispatcher.base.git_blob_sha('class A {}')
+        key_a = task_dispatcher.get_review_index_key(dict(rule, target='**'), 'src/A.java', sha_a)
+        key_b = task_dispatcher.get_review_index_key(dict(rule, target='**'), 'src/B.java', sha_b)
+        assert key_a != key_b
+        assert key_a != task_dispatcher.get_review_index_key(dict(rule, target='**', prompt_user='other'), 'src/A.java', sha_a), "规则内容变化时不能复用"
+        assert key_a != task_dispatcher.get_review_index_key(dict(rule, target='**'), 'src/A.java', sha_a, confirm_prompt='confirm'), "确认提示词变化时不能复用"
+
+        diy_rule = {'name': 'rule', 'mode': 'single', 'model': 'claude3-sonnet', 'system': 'sys', 'rule': 'check {{language}}'}
+        assert task_dispatcher.get_review_index_key(diy_rule, 'src/A.java', sha_a, {'language': 'Java'}) != \
+            task_dispatcher.get_review_index_key(diy_rule, 'src/A.java', sha_a, {'language': 'Kotlin'}), "替换后的提示词变化时不能复用"
+        assert task_dispatcher.get_review_index_key(diy_rule, 'src/A.java', sha_a, {'language': 'Java', 'unused': 'x'}) == \
+            task_dispatcher.get_review_index_key(diy_rule, 'src/A.java', sha_a, {'language': 'Java', 'unused': 'y'}), "未使用的变量不影响复用"
+
+        index = {key_a: '{"result_s3key": "result/req-0/1.json"}'}
+        def get_s3_object(s3, bucket, key):
+            if key not in index:
+                raise task_dispatcher.s3.meta.client.exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            return index[key]
+
+        sent_items = []
+        with patch('task_dispatcher.base.get_s3_object', side_effect=get_s3_object), \
+             patch('task_dispatcher.send_message_batch', side_effect=lambda messages: sent_items.extend(item for item, body in messages) or []), \
+             patch('task_dispatcher.dynamodb') as mock_dynamodb:
+            mock_dynamodb.batch_write_item.return_value = {'UnprocessedItems': {}}
+            assert task_dispatcher.send_task_to_sqs({}, [rule], 'req-1', 'commit-1', contents) is True
+
+        reused, fresh = sent_items
+        assert reused['reuse_s3key'] == 'result/req-0/1.json'
+        assert 'prompt_user' not in reused and 'prompt_system' not in reused, "复用的任务不应携带提示词"
+        assert 'reuse_s3key' not in fresh and fresh['prompt_user']
+        assert fresh['review_index_key'] == key_b
+        assert reused['task_registered'] is True and fresh['task_registered'] is True, "任务记录应已由task_dispatcher批量创建"
+
+    def test_register_tasks_in_batches(self):
+        """
+        测试目的：验证分发前按BatchWriteItem批量创建TASK记录
+
+        测试场景：一次推送产生60个任务，部分记录第一次未被处理
+        业务重要性：每个执行器启动时单独创建记录会占用执行器的关键路径，且result_checker在执行前看不到任务
+
+        测试流程：
+        1. Mock BatchWriteItem，第一次调用返回部分未处理记录，某个批次始终失败
+        2. 调用register_tasks
+
+        期望结果：
+        - 每批不超过25条
+        - 未处理的记录被重试
+        - 始终失败的记录不计入已创建的任务，由执行器自行创建
+        """
+        items = [dict(number=i, mode='single', model='claude3-sonnet') for i in range(1, 61)]
+        calls = []
+
+        def batch_write_item(RequestItems):
+            requests = RequestItems['task-table']
+            numbers = [r['PutRequest']['Item']['number'] for r in requests]
+            calls.append(numbers)
+            if 60 in numbers:
+                raise Exception('throttled')
+            if len(calls) == 1:
+                return {'UnprocessedItems': {'task-table': requests[:2]}}
+            return {'UnprocessedItems': {}}
+
+        with patch.dict(os.environ, {'TASK_TABLE': 'task-table'}), \
+             patch('task_dispatcher.dynamodb') as mock_dynamodb, \
+             patch('task_dispatcher.base.FETCH_CONCURRENCY', 1), \
+             patch('task_dispatcher.time.sleep'):
+            mock_dynamodb.batch_write_item.side_effect = batch_write_item
+            registered = task_dispatcher.register_tasks('req-1', items)
+
+        assert [len(c) for c in calls[:2]] == [25, 2], "未处理的记录应被重试"
+        assert all(len(c) <= 25 for c in calls)
+        assert registered == set(range(1, 51)), "始终失败的批次不应计入已创建的任务"
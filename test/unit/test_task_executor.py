@@ -0,0 +1,463 @@
+"""
+task_executor.py 单元测试
+
+测试目标：验证任务执行器处理SQS任务、调用Bedrock并保存结果的核心逻辑
+"""
+
+import io
+import pytest
+import json
+import threading
+import time
+from unittest.mock import Mock, patch
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import base
+import task_dispatcher
+import task_executor
+
+
+class FakeS3:
+    """内存中的S3，只实现Object(bucket, key).put/get"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def Object(self, bucket, key):
+        store = self.objects
+        obj = Mock()
+        obj.put.side_effect = lambda Body, **kwargs: store.__setitem__(key, Body.encode('utf-8') if isinstance(Body, str) else Body)
+        obj.get.side_effect = lambda: {'Body': io.BytesIO(store[key])}
+        return obj
+
+
+class TestTaskExecutor:
+    """task_executor.py 测试类"""
+
+    def test_offloaded_prompt_round_trip(self):
+        """
+        测试目的：验证超大提示词通过S3转存后能被执行器完整还原
+
+        测试场景：all模式整个项目的代码超过SQS消息大小限制
+        业务重要性：超过256KB的消息会发送失败，大仓库的all评审会被静默丢弃
+
+        测试流程：
+        1. 构造超过阈值的任务，由task_dispatcher转存提示词
+        2. 验证消息中只保留S3 key，且消息大小在SQS限制内
+        3. 由task_executor根据S3 key还原提示词
+
+        期望结果：
+        - 转存后的消息不含提示词，S3中的数据是gzip压缩的
+        - 还原后的提示词与原始提示词一致
+        - 未转存的任务保持不变
+        """
+        fake_s3 = FakeS3()
+        prompt_user = 'public class App {}\n' * 20000
+        item = dict(request_id='req-1', number=3, mode='all', prompt_system='system', prompt_user=prompt_user)
+
+        with patch('task_dispatcher.s3', fake_s3), patch('task_executor.s3', fake_s3):
+            offloaded = task_dispatcher.offload_prompt(item)
+            body = base.encode_base64(base.dump_json(offloaded))
+            assert 'prompt_user' not in offloaded and 'prompt_system' not in offloaded
+            assert offloaded['prompt_s3key'] == 'prompt/req-1/3.json.gz'
+            assert len(body) < task_dispatcher.SQS_MAX_PAYLOAD, "转存后的消息应在SQS限制内"
+            assert len(fake_s3.objects['prompt/req-1/3.json.gz']) < len(prompt_user) / 10, "S3中的提示词应被压缩"
+
+            restored = task_executor.load_offloaded_prompt(json.loads(base.decode_base64(body)))
+            assert restored['prompt_user'] == prompt_user
+            assert restored['prompt_system'] == 'system'
+
+        event = dict(prompt_system='s', prompt_user='u')
+        assert task_executor.load_offloaded_prompt(event) is event, "未转存的任务应保持不变"
+
+    def test_prompt_cache_checkpoints(self):
+        """
+        测试目的：验证请求参数中设置了Bedrock提示词缓存点，并统计缓存命中的token数
+
+        测试场景：同一规则的多个任务共享系统提示词和规则前缀，只有代码不同
+        业务重要性：共享前缀命中缓存可降低每个任务的延迟和输入token成本
+
+        测试流程：
+        1. 为支持缓存的模型构建InvokeModel和Converse请求
+        2. 为不支持缓存的模型或关闭PROMPT_CACHE时构建请求
+        3. 解析两种API返回的缓存用量
+
+        期望结果：
+        - 系统提示词和共享前缀之后各有一个缓存点，代码在缓存点之后
+        - 不支持缓存时请求格式保持不变
+        - 缓存读写token数被正确提取
+        """
+        prompt_user = '请检查安全漏洞\n\n以下是我的代码:\nprint(1)'
+        cache_prefix = prompt_user.index('print(1)')
+        prompt_data = dict(system='你是代码审查专家', messages=[prompt_user], cache_prefix=cache_prefix)
+
+        config = task_executor.model_config.get_model_config('claude4-sonnet')
+        params = task_executor.build_request_params(config, prompt_data, False, 0)
+        assert params['system'] == [{'type': 'text', 'text': '你是代码审查专家', 'cache_control': {'type': 'ephemeral'}}]
+        content = params['messages'][0]['content']
+        assert content[0] == {'type': 'text', 'text': '请检查安全漏洞\n\n以下是我的代码:\n', 'cache_control': {'type': 'ephemeral'}}
+        assert content[1] == {'type': 'text', 'text': 'print(1)'}
+
+        converse = task_executor.build_messages(prompt_data['messages'], for_converse_api=True, cache_prefix=cache_prefix)
+        assert converse[0]['content'][1] == {'cachePoint': {'type': 'default'}}
+        assert ''.join(block.get('text', '') for block in converse[0]['content']) == prompt_user
+
+        legacy = task_executor.model_config.get_model_config('claude3-haiku')
+        params = task_executor.build_request_params(legacy, prompt_data, False, 0)
+        assert params['system'] == '你是代码审查专家', "不支持缓存的模型不应设置缓存点"
+        assert params['messages'][0]['content'] == [{'type': 'text', 'text': prompt_user}]
+
+        with patch('task_executor.PROMPT_CACHE', False):
+            params = task_executor.build_request_params(config, prompt_data, False, 0)
+        assert params['system'] == '你是代码审查专家', "关闭PROMPT_CACHE后不应设置缓存点"
+
+        assert task_executor.get_cache_usage({'cache_read_input_tokens': 1200, 'cache_creation_input_tokens': 0}) == (1200, 0)
+        assert task_executor.get_cache_usage({'cacheReadInputTokens': 0, 'cacheWriteInputTokens': 1500}) == (0, 1500)
+        assert task_executor.get_cache_usage({'input_tokens': 10}) == (0, 0)
+
+    def test_bedrock_client_reused(self):
+        """
+        测试目的：验证Bedrock客户端按超时时间复用
+
+        测试场景：Lambda热启动时多次调用同一模型，以及调用超时时间不同的模型
+        业务重要性：每次调用都创建客户端会重复解析凭证、初始化endpoint和TLS握手
+
+        期望结果：
+        - 相同超时时间只创建一次客户端
+        - 超时时间不同时创建新的客户端，连接池大小和keep-alive按配置设置
+        """
+        task_executor._bedrock_clients.clear()
+        with patch('task_executor.boto3.client', side_effect=lambda **kwargs: Mock()) as mock_client:
+            first = task_executor.get_bedrock_client(900)
+            second = task_executor.get_bedrock_client(900)
+            assert first is second, "相同超时时间应复用客户端"
+            assert mock_client.call_count == 1
+
+            other = task_executor.get_bedrock_client(120)
+            assert other is not first
+            assert mock_client.call_count == 2
+
+            boto_config = mock_client.call_args.kwargs['config']
+            assert boto_config.read_timeout == 120
+            assert boto_config.max_pool_connections == task_executor.BEDROCK_MAX_POOL_CONNECTIONS
+            assert boto_config.tcp_keepalive is True
+        task_executor._bedrock_clients.clear()
+
+    def test_retry_scheduled_through_sqs(self):
+        """
+        测试目的：验证Bedrock调用失败后通过SQS延迟重试，而不是在Lambda中等待
+
+        测试场景：Bedrock被限流，任务需要退避后重试
+        业务重要性：在Lambda中sleep会按空闲时间计费，被限流的批次还可能触发15分钟超时
+
+        测试流程：
+        1. Bedrock调用失败，验证任务带着重试状态以DelaySeconds重新入队
+        2. lambda_handler将已重新入队的消息视为处理成功
+        3. 重新入队的任务再次执行时，沿用重试次数且不重新创建任务记录
+
+        期望结果：
+        - 不调用time.sleep
+        - 重新入队的消息包含原始消息和current_retry
+        - 恢复执行时不覆盖已有的任务记录
+        """
+        event = dict(context={}, commit_id='c1', request_id='r1', number=1, mode='single', model='claude4-sonnet',
+                     rule_name='rule', prompt_system='system', prompt_user='user')
+
+        with patch('task_executor.TASK_SQS_URL', 'https://sqs.example.com/queue'), \
+             patch('task_executor.sqs') as mock_sqs, \
+             patch('task_executor.time.sleep') as mock_sleep, \
+             patch('task_executor.invoke_claude', side_effect=Exception('ThrottlingException')), \
+             patch('task_executor.update_failure_task'), \
+             patch('task_executor.create_task') as mock_create_task:
+
+            record = dict(messageId='m1', body=base.encode_base64(base.dump_json(event)))
+            response = task_executor.lambda_handler(dict(Records=[record]), None)
+
+            assert response['batchItemFailures'] == []
+            assert response['batchItemSeccesses'] == [{'itemIdentifier': 'm1'}], "已重新入队的消息应被删除"
+            mock_sleep.assert_not_called()
+            mock_create_task.assert_called_once()
+
+            kwargs = mock_sqs.send_message.call_args.kwargs
+            assert 0 <= kwargs['DelaySeconds'] <= task_executor.SQS_DELAY_LIMIT
+            resent = json.loads(base.decode_base64(kwargs['MessageBody']))
+            assert resent['retry_state']['current_retry'] == 1
+            assert resent['prompt_user'] == 'user'
+
+            # 恢复执行：沿用重试次数，不重新创建任务记录
+            mock_sqs.send_message.reset_mock()
+            record = dict(messageId='m2', body=kwargs['MessageBody'])
+            task_executor.lambda_handler(dict(Records=[record]), None)
+            mock_create_task.assert_called_once()
+            resent = json.loads(base.decode_base64(mock_sqs.send_message.call_args.kwargs['MessageBody']))
+            assert resent['retry_state']['current_retry'] == 2
+            assert len(resent['retry_state']['error_messages']) == 2
+
+    def test_rate_limited_task_requeued(self):
+        """
+        测试目的：验证限流器拒绝时任务重新入队，不计入重试次数
+
+        测试场景：大请求的任务数远超限流器当前的RPM
+        业务重要性：按普通失败处理时，任务会在从未调用Bedrock的情况下被标记为最终失败
+
+        测试流程：
+        1. 限流器拒绝获取令牌
+        2. 重新入队的任务再次被限流
+
+        期望结果：
+        - 不调用time.sleep，不记录失败
+        - 按预计等待时间延迟重新入队，重试次数保持为0
+        """
+        event = dict(context={}, commit_id='c1', request_id='r1', number=1, mode='single', model='claude4-sonnet',
+                     rule_name='rule', prompt_system='system', prompt_user='user')
+        limited = task_executor.rate_limiter.RateLimitExceeded('rate limited', wait=5)
+
+        with patch('task_executor.TASK_SQS_URL', 'https://sqs.example.com/queue'), \
+             patch('task_executor.sqs') as mock_sqs, \
+             patch('task_executor.time.sleep') as mock_sleep, \
+             patch('task_executor.invoke_claude', side_effect=limited), \
+             patch('task_executor.update_failure_task') as mock_update_failure, \
+             patch('task_executor.create_task') as mock_create_task:
+
+            body = base.encode_base64(base.dump_json(event))
+            for i in range(2):
+                response = task_executor.lambda_handler(dict(Records=[dict(messageId=f'm{i}', body=body)]), None)
+                assert response['batchItemFailures'] == []
+                kwargs = mock_sqs.send_message.call_args.kwargs
+                assert 6 <= kwargs['DelaySeconds'] <= 6 + task_executor.SQS_BASE_DELAY
+                body = kwargs['MessageBody']
+                assert json.loads(base.decode_base64(body))['retry_state']['current_retry'] == 0, "限流不应计入重试次数"
+
+            mock_sleep.assert_not_called()
+            mock_update_failure.assert_not_called()
+            mock_create_task.assert_called_once()
+
+    def test_lambda_handler_concurrent_records(self):
+        """
+        测试目的：验证同一批次的SQS消息被并发处理，且逐条返回处理结果
+
+        测试场景：一批3条消息，其中一条评审失败
+        业务重要性：逐条处理时整批耗时是单个评审的N倍，并发后接近最慢的单个评审
+
+        测试流程：
+        1. 每条消息的处理都等待其他消息同时开始（顺序处理会超时失败）
+        2. 其中一条消息处理失败
+
+        期望结果：
+        - 3条消息同时处于处理中
+        - 失败的消息出现在batchItemFailures中，其余在batchItemSeccesses中，顺序与输入一致
+        """
+        barrier = threading.Barrier(3, timeout=5)
+
+        def handle(record, event, context):
+            barrier.wait()
+            if event['number'] == 2:
+                raise Exception('Bedrock error')
+
+        records = [ dict(messageId=f'm{number}', body=base.encode_base64(base.dump_json(dict(number=number)))) for number in (1, 2, 3) ]
+        with patch('task_executor.handle_code_review', side_effect=handle), \
+             patch('task_executor.EXECUTOR_CONCURRENCY', 3):
+            response = task_executor.lambda_handler(dict(Records=records), None)
+
+        assert response['batchItemSeccesses'] == [{'itemIdentifier': 'm1'}, {'itemIdentifier': 'm3'}]
+        assert response['batchItemFailures'] == [{'itemIdentifier': 'm2'}]
+
+    def test_read_response_stream_early_stop(self):
+        """
+        测试目的：验证流式读取Bedrock响应，并在看到</output>后提前结束
+
+        测试场景：模型在<output>之后还会输出较长的<thought>
+        业务重要性：评审结果只取<output>中的内容，提前结束可缩短任务耗时
+
+        测试流程：
+        1. 构造InvokeModel和Converse两种流式响应
+        2. 分别在允许和不允许提前结束时读取
+
+        期望结果：
+        - 允许提前结束时读到</output>即停止，并关闭流
+        - 不允许时读取完整文本，stop_reason和usage来自流中的事件
+        - 记录第一个token的时间
+        """
+        def invoke_model_stream(texts):
+            events = [{'type': 'message_start', 'message': {'usage': {'input_tokens': 100, 'cache_read_input_tokens': 80}}}]
+            events += [{'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': text}} for text in texts]
+            events += [{'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': 20}}]
+            return [{'chunk': {'bytes': json.dumps(event).encode('utf-8')}} for event in events]
+
+        texts = ['<output>[{"title": "SQL注入"}]', '</output>', '<thought>很长的思考过程</thought>']
+
+        class Stream(list):
+            closed = False
+            def close(self):
+                self.closed = True
+
+        stream = Stream(invoke_model_stream(texts))
+        result, first_token_time = task_executor.read_invoke_model_stream(stream, early_stop=True)
+        assert result['text'] == '<output>[{"title": "SQL注入"}]</output>'
+        assert result['stop_reason'] == 'early_stop'
+        assert result['usage'] == {'input_tokens': 100, 'cache_read_input_tokens': 80}
+        assert first_token_time is not None
+        assert stream.closed, "提前结束后应关闭流"
+
+        result, _ = task_executor.read_invoke_model_stream(invoke_model_stream(texts), early_stop=False)
+        assert result['text'] == ''.join(texts)
+        assert result['stop_reason'] == 'end_turn'
+        assert result['usage']['output_tokens'] == 20
+
+        converse_events = [{'messageStart': {'role': 'assistant'}},
+                           {'contentBlockDelta': {'delta': {'reasoningContent': {'text': '先分析'}}}}]
+        converse_events += [{'contentBlockDelta': {'delta': {'text': text}}} for text in texts]
+        converse_events += [{'messageStop': {'stopReason': 'end_turn'}},
+                            {'metadata': {'usage': {'inputTokens': 100, 'cacheReadInputTokens': 80}}}]
+        result, _ = task_executor.read_converse_stream(converse_events, early_stop=True)
+        assert result['text'] == '<output>[{"title": "SQL注入"}]</output>'
+        assert result['reasoning'] == '先分析'
+
+        result, _ = task_executor.read_converse_stream(converse_events, early_stop=False)
+        assert result['text'] == ''.join(texts)
+        assert result['stop_reason'] == 'end_turn'
+        assert task_executor.get_cache_usage(result['usage']) == (80, 0)
+
+    def test_extract_repairs_before_rectifier(self):
+        """
+        测试目的：验证本地修复JSON成功时不再调用Bedrock纠错
+
+        测试场景：<output>中的JSON带尾逗号，或因输出截断缺少</output>
+        业务重要性：以前小的语法问题也会触发一次完整的Bedrock调用
+
+        期望结果：
+        - 修复成功时只调用一次Bedrock，并记录解析耗时
+        - 无法修复时才发送JSON_RECTIFIER_PROMPT
+        """
+        assert task_executor.extract_bedrock_response('<output>[{"title": "a"},]</output><thought>...</thought>') == [{'title': 'a'}]
+        assert task_executor.extract_bedrock_response('<output>[{"title": "a"}, {"title": "b') == [{'title': 'a'}]
+        assert task_executor.extract_bedrock_response("<output>{'title': 'a'}</output>") == [{'title': 'a'}]
+
+        def reply_with(*texts):
+            replies = iter(texts)
+            def invoke(task_name, prompt_data):
+                prompt_data['latest_reply'] = next(replies)
+                prompt_data['messages'].append(prompt_data['latest_reply'])
+                return prompt_data
+            return invoke
+
+        prompt_data = dict(messages=[], current_retry=0, max_retry=3)
+        with patch('task_executor.invoke_bedrock', side_effect=reply_with('<output>[{"title": "a"},]</output>')) as mock_invoke:
+            prompt_data = task_executor.invoke_and_extract_bedrock('task', prompt_data, 'review')
+        assert mock_invoke.call_count == 1, "本地修复成功时不应调用纠错"
+        assert prompt_data['content'] == [{'title': 'a'}]
+        assert prompt_data['parse_timecost'] >= 0
+
+        prompt_data = dict(messages=[], current_retry=0, max_retry=3)
+        with patch('task_executor.invoke_bedrock', side_effect=reply_with('<output>not json</output>', '<output>[]</output>')) as mock_invoke:
+            prompt_data = task_executor.invoke_and_extract_bedrock('task', prompt_data, 'review')
+        assert mock_invoke.call_count == 2, "无法修复时应调用纠错"
+        assert prompt_data['messages'][2].startswith('The JSON in <output> tag seems invalid')
+        assert prompt_data['content'] == []
+
+    def test_result_cache_by_prompt_fingerprint(self):
+        """
+        测试目的：验证完全相同的任务直接使用缓存的评审结果
+
+        测试场景：rebase或force push后，同一规则对相同代码再次评审
+        业务重要性：相同的提示词没有必要再调用一次Bedrock
+
+        测试流程：
+        1. 第一次执行任务，调用Bedrock并写入缓存
+        2. 另一个请求中提示词完全相同的任务，直接命中缓存
+        3. 提示词不同或缓存过期时重新调用Bedrock
+
+        期望结果：
+        - 命中缓存时不调用Bedrock，结果标记为cached，并归属于当前请求
+        - 未命中时结果标记为未缓存
+        """
+        fake_s3 = FakeS3()
+        event = dict(context={}, commit_id='c1', request_id='r1', number=1, mode='single', model='claude4-sonnet',
+                     rule_name='rule', prompt_system='system', prompt_user='user')
+
+        def invoke(task_name, prompt_data, message):
+            prompt_data['messages'] += [message, '<output>[]</output>']
+            prompt_data['content'] = [{'title': 'finding'}]
+            return prompt_data
+
+        with patch.dict(os.environ, {'BUCKET_NAME': 'test-bucket'}), \
+             patch('task_executor.s3', fake_s3), \
+             patch('task_executor.invoke_and_extract_bedrock', side_effect=invoke) as mock_invoke, \
+             patch('task_executor.create_task'), \
+             patch('task_executor.update_complete_task') as mock_complete, \
+             patch('task_executor.task_base.check_request_progress'):
+
+            task_executor.handle_code_review({}, dict(event), {})
+            assert mock_invoke.call_count == 1
+            assert mock_complete.call_args.args[4]['cached'] is False
+
+            task_executor.handle_code_review({}, dict(event, request_id='r2', number=5), {})
+            assert mock_invoke.call_count == 1, "相同提示词应命中缓存"
+            commit_id, request_id, number, mode, result = mock_complete.call_args.args
+            assert (request_id, number) == ('r2', 5)
+            assert result['cached'] is True and result['request_id'] == 'r2'
+            assert result['content'] == [{'title': 'finding'}]
+
+            task_executor.handle_code_review({}, dict(event, prompt_user='other'), {})
+            assert mock_invoke.call_count == 2, "提示词不同时不应命中缓存"
+
+            with patch('task_executor.time.time', return_value=time.time() + task_executor.RESULT_CACHE_TTL + 1):
+                task_executor.handle_code_review({}, dict(event), {})
+            assert mock_invoke.call_count == 3, "缓存过期后应重新评审"
+
+    def test_reuse_review_by_index(self):
+        """
+        测试目的：验证single模式评审后记录评审索引，并能直接复用之前的评审结果
+
+        测试场景：文件内容和规则都未变化，task_dispatcher在任务中指定了可复用的结果
+        业务重要性：未变化的文件不应再次调用Bedrock
+
+        测试流程：
+        1. 执行带有review_index_key的任务，评审成功后写入索引
+        2. 执行带有reuse_s3key的任务
+        3. 复用的结果不存在时执行任务
+
+        期望结果：
+        - 索引指向本次任务的结果文件
+        - 复用时不调用Bedrock，结果归属于当前请求并记录来源
+        - 结果不存在时任务失败，而不是卡住
+        """
+        fake_s3 = FakeS3()
+        event = dict(context={}, commit_id='c1', request_id='r1', number=1, mode='single', model='claude4-sonnet',
+                     rule_name='rule', prompt_system='system', prompt_user='user', review_index_key='cache/review-index/k.json')
+
+        def invoke(task_name, prompt_data, message):
+            prompt_data['messages'] += [message, '<output>[]</output>']
+            prompt_data['content'] = [{'title': 'finding'}]
+            return prompt_data
+
+        with patch.dict(os.environ, {'BUCKET_NAME': 'test-bucket'}), \
+             patch('task_executor.s3', fake_s3), \
+             patch('task_executor.RESULT_CACHE_TTL', 0), \
+             patch('task_executor.invoke_and_extract_bedrock', side_effect=invoke) as mock_invoke, \
+             patch('task_executor.create_task'), \
+             patch('task_executor.update_complete_task') as mock_complete, \
+             patch('task_executor.update_failure_task') as mock_failure, \
+             patch('task_executor.task_base.check_request_progress') as mock_progress:
+
+            task_executor.handle_code_review({}, dict(event), {})
+            index = json.loads(fake_s3.objects['cache/review-index/k.json'])
+            assert index['result_s3key'] == 'result/r1/1.json'
+
+            fake_s3.objects['result/r1/1.json'] = json.dumps(dict(mock_complete.call_args.args[4])).encode('utf-8')
+            reuse_event = dict(context={}, commit_id='c2', request_id='r2', number=3, mode='single', model='claude4-sonnet',
+                               rule_name='rule', reuse_s3key='result/r1/1.json', review_index_key='cache/review-index/k.json')
+            task_executor.handle_code_review({}, reuse_event, {})
+            assert mock_invoke.call_count == 1, "复用结果时不应调用Bedrock"
+            commit_id, request_id, number, mode, result = mock_complete.call_args.args
+            assert (commit_id, request_id, number) == ('c2', 'r2', 3)
+            assert result['content'] == [{'title': 'finding'}]
+            assert result['cached'] is True and result['reused_from'] == 'result/r1/1.json'
+
+            task_executor.handle_code_review({}, dict(reuse_event, reuse_s3key='result/missing.json'), {})
+            assert mock_failure.call_count == 1, "复用的结果不存在时任务应失败"
+            assert mock_progress.call_count == 3
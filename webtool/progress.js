@@ -25,6 +25,15 @@ export function renderJsonMessage(jsonData) {
         progressContent.insertBefore(statusContainer, progressContent.firstChild);
     }
 
+    // 合并本次读取的一页任务摘要，以及已经加载过的任务详情
+    (jsonData.tasks || []).forEach((task) => {
+        vars.taskSummaries[task.number] = task;
+    });
+    jsonData = {
+        ...jsonData,
+        tasks: Object.values(vars.taskSummaries).map(task => ({ ...task, ...(vars.taskDetails[task.number] || {}) }))
+    };
+
     // 检查 tasks 是否为 null 或空数组
     const isTasksEmpty = !jsonData.tasks || jsonData.tasks.length === 0;
 
@@ -107,6 +116,13 @@ export function updateOrCreateTaskElement(task) {
         taskElement.className = 'task';
         taskElement.setAttribute('data-task-number', task.number);
         taskElement.innerHTML = `<h4>Task ${task.number}</h4>`;
+
+        // 提示词和评审结果较大，点击后再单独获取
+        const detailButton = document.createElement('button');
+        detailButton.className = 'detail-button';
+        detailButton.textContent = '加载详情';
+        detailButton.onclick = () => loadTaskDetail(task.number);
+        taskElement.appendChild(detailButton);
         
         // 找到正确的插入位置
         let insertAfter = null;
@@ -140,6 +156,9 @@ export function updateOrCreateTaskElement(task) {
         {key: 'bedrock_start_time', label: 'Bedrock Start', multiline: false},
         {key: 'bedrock_end_time', label: 'Bedrock End', multiline: false},
         {key: 'bedrock_timecost', label: 'Bedrock Timecost', multiline: false},
+        {key: 'bedrock_ttft', label: 'Time to First Token', multiline: false},
+        {key: 'bedrock_cache_read_tokens', label: 'Cache Read Tokens', multiline: false},
+        {key: 'bedrock_cache_write_tokens', label: 'Cache Write Tokens', multiline: false},
         {key: 'bedrock_system', label: '系统提示词', multiline: true},
         {key: 'bedrock_prompt', label: '用户提示词', multiline: true},
         {key: 'bedrock_payload', label:'Bedrock Payload', multiline: true},
@@ -186,8 +205,10 @@ export function updateOrCreateFieldElement(taskElement, field, task) {
         } catch (error) {
             value = task[field.key] || '';
         }
-    } else if (field.key === 'bedrock_timecost') {
+    } else if (field.key === 'bedrock_timecost' || field.key === 'bedrock_ttft') {
         value = formatDuration(task[field.key]);
+    } else if (field.key === 'bedrock_cache_read_tokens' || field.key === 'bedrock_cache_write_tokens') {
+        value = String(task[field.key]);
     } else if (field.key === 'bedrock_prompt') {
         try {
             const promptData = JSON.parse(task[field.key]);
@@ -203,7 +224,7 @@ export function updateOrCreateFieldElement(taskElement, field, task) {
         value = task[field.key] || '';
     }
 
-    const isPlainText = ['succ', 'bedrock_model', 'bedrock_start_time', 'bedrock_end_time', 'bedrock_timecost'].includes(field.key);
+    const isPlainText = ['succ', 'bedrock_model', 'bedrock_start_time', 'bedrock_end_time', 'bedrock_timecost', 'bedrock_ttft', 'bedrock_cache_read_tokens', 'bedrock_cache_write_tokens'].includes(field.key);
 
     if (!fieldElement) {
         fieldElement = createFieldElement(field.label, value, field.multiline, field.key === 'bedrock_payload', isPlainText);
@@ -357,6 +378,23 @@ export function createFieldElement(label, value, isMultiline = false, formatJson
     return fieldElement;
 }
 
+export function loadTaskDetail(number) {
+    const query = vars.taskQuery;
+    if (!query) return;
+    getTaskDetail(query.endpoint, query.requestId, query.commitId, query.apiKey, number)
+        .then(response => {
+            if (response.status !== 200 || !response.data.succ) {
+                throw new Error(JSON.stringify(response.data));
+            }
+            vars.taskDetails[number] = response.data.task;
+            updateOrCreateTaskElement({ ...(vars.taskSummaries[number] || {}), ...response.data.task });
+        })
+        .catch(error => {
+            console.error('获取任务详情失败:', error);
+            showToast('获取任务详情失败');
+        });
+}
+
 export function pollForReport(endpoint, requestId, apiKey) {
     let statusContainer = document.getElementById('status-container');
     let progressContent = document.getElementById('progress-content');
@@ -374,11 +412,21 @@ export function pollForReport(endpoint, requestId, apiKey) {
 
     const codeReviewCommitId = document.getElementById('code-review-commit-id').value;
 
-    getCodeReviewReport(endpoint, requestId, codeReviewCommitId, apiKey)
+    // 新的评审请求，清空上一次的任务
+    if (!vars.taskQuery || vars.taskQuery.requestId !== requestId) {
+        vars.taskCursor = null;
+        vars.taskSummaries = {};
+        vars.taskDetails = {};
+    }
+    vars.taskQuery = { endpoint, requestId, commitId: codeReviewCommitId, apiKey };
+
+    getCodeReviewReport(endpoint, requestId, codeReviewCommitId, apiKey, vars.taskCursor)
         .then(response => {
             if (response.status !== 200 || !response.data.succ) {
                 throw new Error(JSON.stringify(response.data));
             }
+            // 每次轮询只读取一页，读完最后一页后从头开始
+            vars.taskCursor = response.data.next_cursor || null;
             if (response.data.ready && response.data.url) {
                 clearInterval(vars.reportTimer);
                 vars.reportTimer = null;
@@ -431,10 +479,18 @@ export function updateSummary(summary) {
     }
 }
 
-export function getCodeReviewReport(endpoint, requestId, commitId, apiKey) {
+export function getCodeReviewReport(endpoint, requestId, commitId, apiKey, cursor = null) {
+    const headers = {
+        'X-API-KEY': apiKey,
+        'Content-Type': 'application/json'
+    };
+    const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+    return axios.get(`${endpoint}/result?request_id=${requestId}&commit_id=${commitId}${cursorParam}`, { headers });
+}
+export function getTaskDetail(endpoint, requestId, commitId, apiKey, number) {
     const headers = {
         'X-API-KEY': apiKey,
         'Content-Type': 'application/json'
     };
-    return axios.get(`${endpoint}/result?request_id=${requestId}&commit_id=${commitId}`, { headers });
-}
\ No newline at end of file
+    return axios.get(`${endpoint}/result?request_id=${requestId}&commit_id=${commitId}&number=${number}`, { headers });
+}
@@ -62,6 +62,11 @@ export const vars = {
     currentMessage: '',
     reportStartTime: null,
     reportTimer: null,
+    // 进度轮询：每次只读取一页任务摘要，按number合并；详细信息按需单独获取
+    taskQuery: null,
+    taskCursor: null,
+    taskSummaries: {},
+    taskDetails: {},
     showHelpOnStartup: true,
 
     templateData: {